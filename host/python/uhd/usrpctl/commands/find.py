@@ -16,8 +16,10 @@ class FindCommand(BaseCommand):
         """
         Adding subparser for find command
         """
-        parser.add_parser(cls.command_name(),
+        subparser = parser.add_parser(cls.command_name(),
                 help="print devices found using id parameter")
+        subparser.add_argument("-mtu", action="store_true",
+                help="measure round trip time and path MTU of MPM devices")
 
     def is_multi_device_capable(self):
         """
@@ -31,7 +33,18 @@ class FindCommand(BaseCommand):
         from the id argument the only thing left to do is
         print the found devices. Print mimics the behaviour
         of uhd_find_devices.
+
+        With -mtu, the devices which have an address are also sent echo
+        requests to measure their RTT and path MTU (see mpmdiscovery).
+        Devices which don't answer them (i.e., non-MPM devices) are
+        printed without.
         """
+        paths = {}
+        if args.mtu:
+            # mprpc is only needed for this
+            from uhd.utils.mpmdiscovery import measure_paths
+            addrs = {usrp.to_dict().get("addr") for usrp in usrps} - {None}
+            paths = measure_paths(sorted(addrs))
         for index, usrp in enumerate(usrps):
             print('--------------------------------------------------')
             print(f"-- UHD Device {index}")
@@ -39,5 +52,9 @@ class FindCommand(BaseCommand):
             print('Device Address:')
             for key, value in usrp.to_dict().items():
                 print(f"    {key}: {value}")
+            rtt, mtu = paths.get(usrp.to_dict().get("addr"), (None, 0))
+            if rtt is not None:
+                print(f"    rtt: {rtt * 1000:.3f} ms")
+                print(f"    mtu: {mtu}")
             print()
             print()
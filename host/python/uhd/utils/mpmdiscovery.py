@@ -0,0 +1,353 @@
+#
+# Copyright 2024 Ettus Research, a National Instruments Brand
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Parallel discovery of MPM devices
+
+scan() broadcasts one discovery request on every local interface and
+collects all responses until a deadline, so finding a lab full of devices
+takes about as long as finding one. Responding devices are then queried
+with get_device_info over RPC (and optionally probed for their path MTU)
+concurrently, over a bounded number of connections. The RPC calls use the
+same mprpc client as mpmtools, on a thread pool.
+
+usrpctl find -mtu uses measure_paths() to add RTT and path MTU to the
+devices found by UHD.
+
+Example:
+>>> from uhd.utils.mpmdiscovery import find_devices
+>>> for device in find_devices(measure_mtu=True):
+...     print(device.addr, device.serial, device.rtt, device.mtu)
+
+Running this module prints the devices it finds.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import socket
+import struct
+import sys
+import time
+from dataclasses import dataclass, field
+from mprpc import RPCClient
+from mprpc.exceptions import RPCError
+
+MPM_DISCOVERY_PORT = 49600
+MPM_RPC_PORT = 49601
+MPM_DISCOVERY_CMD = b"MPM-DISC"
+MPM_ECHO_CMD = b"MPM-ECHO"
+MPM_RESPONSE_PREAMBLE = "USRP-MPM"
+# Default time to wait for discovery responses, in seconds
+DISCOVERY_TIMEOUT = 1.0
+# Default timeout of the connection and of every RPC call, in seconds
+RPC_TIMEOUT = 2.0
+# Default number of RPC connections which are open at the same time
+MAX_CONNECTIONS = 32
+# Time to wait for an echo reply before the frame size is assumed to exceed
+# the MTU, in seconds
+ECHO_TIMEOUT = 0.2
+# Frame sizes tested by the path MTU probe, like UHD's discover_mtu()
+MIN_FRAME_SIZE = 1472
+MAX_FRAME_SIZE = 8000
+# Linux only, see ip(7)
+SIOCGIFFLAGS = 0x8913
+SIOCGIFBRDADDR = 0x8919
+IFF_UP = 0x1
+IFF_BROADCAST = 0x2
+IP_MTU_DISCOVER = 10
+IP_PMTUDISC_DO = 2
+
+@dataclass
+class DiscoveredDevice:
+    """
+    One response to a discovery request, and what the probes found out
+    about the device behind it.
+
+    A device with several connected interfaces is reported once per
+    interface, these share the serial.
+    """
+    addr: str
+    # The key/value pairs of the discovery response (type, product, serial,
+    # ...). 'claimed' is a bool.
+    info: dict
+    # Round trip time of the discovery request, or of the echo request if
+    # measure_mtu was set, in seconds
+    rtt: float
+    # Result of get_device_info, if probed
+    device_info: dict = field(default_factory=dict)
+    # Largest frame size in bytes which got through, if measured
+    mtu: int = 0
+    # Error message, if probing the device failed
+    error: str = ""
+
+    @property
+    def serial(self):
+        """ Serial number from the discovery response """
+        return self.info.get('serial', '')
+
+def get_broadcast_addrs():
+    """
+    Return the broadcast addresses of all local interfaces which are up.
+
+    Falls back to the limited broadcast address if the interfaces can't be
+    queried (e.g., on anything but Linux).
+    """
+    addrs = []
+    try:
+        import fcntl
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for _, ifname in socket.if_nameindex():
+                ifreq = struct.pack('256s', ifname.encode()[:15])
+                try:
+                    flags = struct.unpack_from(
+                        'H', fcntl.ioctl(sock.fileno(), SIOCGIFFLAGS, ifreq), 16)[0]
+                    if not flags & IFF_UP or not flags & IFF_BROADCAST:
+                        continue
+                    brdaddr = fcntl.ioctl(sock.fileno(), SIOCGIFBRDADDR, ifreq)
+                except OSError:
+                    # No IPv4 address on this interface
+                    continue
+                addrs.append(socket.inet_ntoa(brdaddr[20:24]))
+    except (ImportError, OSError, AttributeError):
+        pass
+    return sorted(set(addrs)) or ["255.255.255.255"]
+
+def parse_discovery_response(data):
+    """
+    Parse a discovery response into a dictionary, or return None if it is
+    not one.
+    """
+    fields = data.decode('ascii', errors='replace').split(';')
+    if fields[0] != MPM_RESPONSE_PREAMBLE:
+        return None
+    info = dict(item.split('=', 1) for item in fields[1:] if '=' in item)
+    info['claimed'] = info.get('claimed') == 'True'
+    return info
+
+class _DiscoveryProtocol(asyncio.DatagramProtocol):
+    """
+    Collects discovery responses, keeping the first one per address
+    """
+    def __init__(self):
+        self.transport = None
+        self.send_time = None
+        self.responses = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if addr[0] in self.responses:
+            return
+        info = parse_discovery_response(data)
+        if info is not None:
+            self.responses[addr[0]] = (info, time.monotonic() - self.send_time)
+
+async def discover(addrs=None, timeout=DISCOVERY_TIMEOUT, port=MPM_DISCOVERY_PORT):
+    """
+    Send a discovery request to every address in addrs (broadcast or
+    unicast; defaults to the broadcast addresses of all local interfaces)
+    and collect responses for timeout seconds.
+
+    Returns a list of DiscoveredDevice.
+    """
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        _DiscoveryProtocol, local_addr=("0.0.0.0", 0), allow_broadcast=True)
+    try:
+        protocol.send_time = time.monotonic()
+        for addr in addrs or get_broadcast_addrs():
+            try:
+                transport.sendto(MPM_DISCOVERY_CMD, (addr, port))
+            except OSError as ex:
+                print("[MPMDISC] Could not send to {}: {}".format(addr, ex),
+                      file=sys.stderr)
+        await asyncio.sleep(timeout)
+    finally:
+        transport.close()
+    return [
+        DiscoveredDevice(addr=addr, info=info, rtt=rtt)
+        for addr, (info, rtt) in sorted(protocol.responses.items())
+    ]
+
+def get_device_info(addr, port=MPM_RPC_PORT, timeout=RPC_TIMEOUT):
+    """
+    Return the result of get_device_info of the device at addr. This is a
+    blocking call, it doesn't need a claim.
+    """
+    client = RPCClient(addr, port, timeout=timeout, pack_params={'use_bin_type': True})
+    try:
+        return client.call('get_device_info')
+    finally:
+        client.close()
+
+class _EchoProtocol(asyncio.DatagramProtocol):
+    """
+    Hands echo replies to whoever waits for them
+    """
+    def __init__(self):
+        self.replies = asyncio.Queue()
+
+    def datagram_received(self, data, addr):
+        self.replies.put_nowait(data)
+
+    def error_received(self, exc):
+        # E.g., EMSGSIZE when a frame exceeds the local MTU. Treated like a
+        # lost frame.
+        pass
+
+async def _echo(transport, protocol, payload, timeout):
+    """
+    Send payload as echo request, return the length of the reply or 0 if
+    none came back in time
+    """
+    while not protocol.replies.empty():
+        protocol.replies.get_nowait()
+    try:
+        transport.sendto(payload)
+    except OSError:
+        return 0
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            reply = await asyncio.wait_for(
+                protocol.replies.get(), max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            return 0
+        # Late replies to earlier requests don't count
+        if reply[:len(MPM_ECHO_CMD) + 10] == payload[:len(MPM_ECHO_CMD) + 10]:
+            return len(reply)
+
+async def measure_path(addr, port=MPM_DISCOVERY_PORT, echo_timeout=ECHO_TIMEOUT,
+                       min_frame_size=MIN_FRAME_SIZE, max_frame_size=MAX_FRAME_SIZE):
+    """
+    Measure round trip time and path MTU to the device at addr using echo
+    requests. The MTU is found by bisection, the same way UHD does it when
+    it connects to a device.
+
+    Returns (rtt, mtu), with rtt in seconds. rtt is None if the device
+    didn't answer at all.
+    """
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        _EchoProtocol, remote_addr=(addr, port))
+    try:
+        sock = transport.get_extra_info('socket')
+        try:
+            # Don't fragment, or every size would get through
+            sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+        except OSError:
+            pass
+        rtts = []
+        for seq_no in range(3):
+            payload = MPM_ECHO_CMD + ";{:04d},ping".format(seq_no).encode()
+            start = time.monotonic()
+            if await _echo(transport, protocol, payload, echo_timeout):
+                rtts.append(time.monotonic() - start)
+        if not rtts:
+            return None, 0
+        seq_no = 0
+        while min_frame_size < max_frame_size:
+            # Only test multiples of 4 bytes
+            test_size = (max_frame_size // 2 + min_frame_size // 2 + 3) & ~3
+            header = MPM_ECHO_CMD + ";{:04d},{:04d}".format(seq_no, test_size).encode()
+            seq_no += 1
+            reply_len = await _echo(
+                transport, protocol, header.ljust(test_size, b"#"), echo_timeout)
+            if reply_len == 0:
+                max_frame_size = test_size - 4
+            elif reply_len >= test_size:
+                min_frame_size = test_size
+            else:
+                max_frame_size = reply_len
+        return min(rtts), min_frame_size
+    finally:
+        transport.close()
+
+async def probe(device, executor, rpc_port=MPM_RPC_PORT, rpc_timeout=RPC_TIMEOUT,
+                measure_mtu=False):
+    """
+    Fill in device_info (and rtt and mtu, if measure_mtu) of device.
+    The RPC call runs on executor, whose number of workers bounds the number
+    of open connections. Errors are stored in device.error instead of raised.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        device.device_info = await loop.run_in_executor(
+            executor, get_device_info, device.addr, rpc_port, rpc_timeout)
+        if measure_mtu:
+            rtt, device.mtu = await measure_path(device.addr)
+            if rtt is not None:
+                device.rtt = rtt
+    except (OSError, RPCError) as ex:
+        device.error = str(ex) or type(ex).__name__
+
+async def scan(addrs=None, timeout=DISCOVERY_TIMEOUT, probe_devices=True,
+               measure_mtu=False, max_connections=MAX_CONNECTIONS,
+               rpc_timeout=RPC_TIMEOUT):
+    """
+    Discover devices (see discover()), then probe all of them in parallel
+    (see probe()), with at most max_connections RPC connections open at
+    a time.
+
+    Returns a list of DiscoveredDevice, sorted by address.
+    """
+    devices = await discover(addrs, timeout)
+    if probe_devices and devices:
+        with ThreadPoolExecutor(min(max_connections, len(devices))) as executor:
+            await asyncio.gather(*[
+                probe(device, executor, rpc_timeout=rpc_timeout,
+                      measure_mtu=measure_mtu)
+                for device in devices
+            ])
+    return devices
+
+async def _measure_paths(addrs, **kwargs):
+    return await asyncio.gather(*[measure_path(addr, **kwargs) for addr in addrs])
+
+def measure_paths(addrs, **kwargs):
+    """
+    Blocking version of measure_path(), which measures the paths to all
+    addresses in addrs in parallel. Takes the same keyword arguments.
+
+    Returns a dictionary which maps each address to (rtt, mtu).
+    """
+    return dict(zip(addrs, asyncio.run(_measure_paths(addrs, **kwargs))))
+
+def find_devices(**kwargs):
+    """
+    Blocking version of scan(), takes the same arguments
+    """
+    return asyncio.run(scan(**kwargs))
+
+def main():
+    """
+    Print all devices which answer
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("addrs", nargs="*",
+                        help="Addresses to send discovery requests to, "
+                             "defaults to all local broadcast addresses")
+    parser.add_argument("-t", "--timeout", type=float, default=DISCOVERY_TIMEOUT,
+                        help="Time to wait for discovery responses")
+    parser.add_argument("-m", "--measure-mtu", action="store_true",
+                        help="Measure path MTU and RTT with echo requests")
+    args = parser.parse_args()
+    start = time.monotonic()
+    devices = find_devices(addrs=args.addrs, timeout=args.timeout,
+                           measure_mtu=args.measure_mtu)
+    for device in devices:
+        print("{:15s} {:10s} {:8s} {:>9.3f} ms{}{}{}".format(
+            device.addr, device.info.get('product', ''), device.serial,
+            device.rtt * 1000,
+            "  MTU {}".format(device.mtu) if device.mtu else "",
+            "  claimed" if device.info.get('claimed') else "",
+            "  error: {}".format(device.error) if device.error else ""))
+    print("Found {} device(s) in {:.2f} s".format(
+        len(devices), time.monotonic() - start))
+
+if __name__ == "__main__":
+    main()
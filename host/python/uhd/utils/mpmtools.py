@@ -8,6 +8,7 @@ RPC/MPM utilities for debugging USRPs
 """
 
 from enum import Enum
+import hashlib
 import multiprocessing
 import queue
 import signal
@@ -15,6 +16,8 @@ from mprpc import RPCClient
 from mprpc.exceptions import RPCError
 
 MPM_RPC_PORT = 49601
+# Chunk size of MPMClient.update_component_chunked()
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
 def _claim_loop(client, cmd_q, token_q):
     """
@@ -145,6 +148,8 @@ class MPMClient:
             host=host, port=port
         ))
         self._remote_methods = []
+        self._requires_token = {}
+        self._token = None
         if init_mode == InitMode.Hijack:
             assert token
             self._token = token
@@ -163,6 +168,7 @@ class MPMClient:
         methods = self._client.call('list_methods')
         for method in methods:
             self._add_command(*method)
+        self._has_multicall = 'multicall' in self._requires_token
         print("[MPMRPC] Added {} methods.".format(len(methods)))
 
     def __del__(self):
@@ -187,10 +193,65 @@ class MPMClient:
         """
         self._claimer.exit()
 
+    def multicall(self, calls, raise_on_error=False):
+        """
+        Run several RPC calls in one round trip.
+
+        calls is a list of (command, args) pairs, where args is a list of
+        arguments without the token, which is added where required.
+        Returns a list with one (success, value) pair per call, where value
+        is the return value, or the error message if the call failed. With
+        raise_on_error, the first failed call raises a RuntimeError instead.
+
+        Falls back to one call per command if the device's MPM doesn't
+        support batched calls.
+        """
+        calls = [(str(command), list(args)) for command, args in calls]
+        if self._has_multicall:
+            results = self._client.call('multicall', self._token or "", calls)
+        else:
+            results = []
+            for command, args in calls:
+                try:
+                    results.append((True, self._rpc_template(
+                        command, self._requires_token.get(command, False), *args)))
+                except (RPCError, RuntimeError) as ex:
+                    results.append((False, str(ex)))
+        if raise_on_error:
+            for (command, _), (success, value) in zip(calls, results):
+                if not success:
+                    raise RuntimeError("[MPMRPC] `{}' failed: {}".format(command, value))
+        return [tuple(result) for result in results]
+
+    def update_component_chunked(self, metadata_l, data_l, chunk_size=UPLOAD_CHUNK_SIZE):
+        """
+        Update components like the update_component command does, but upload
+        the files in chunks. If an earlier upload of a file was interrupted,
+        it resumes where it stopped.
+
+        The metadata get 'sha256' and 'size' keys with the hash and the size
+        of the file, which the device checks before installing it, and before
+        resuming an earlier upload.
+        """
+        filenames = []
+        for metadata, data in zip(metadata_l, data_l):
+            metadata = dict(metadata)
+            metadata['sha256'] = hashlib.sha256(data).hexdigest()
+            metadata['size'] = str(len(data))
+            offset = self._rpc_template('begin_component_upload', True, metadata)
+            while offset < len(data):
+                chunk = data[offset:offset + chunk_size]
+                offset = self._rpc_template(
+                    'append_component_chunk', True, metadata['filename'], offset,
+                    chunk, hashlib.sha256(chunk).hexdigest())
+            filenames.append(metadata['filename'])
+        return self._rpc_template('commit_component_upload', True, filenames)
+
     def _add_command(self, command, docs, requires_token):
         """
         Add a command to the current session
         """
+        self._requires_token[command] = requires_token
         if not hasattr(self, command):
             new_command = lambda *args, **kwargs: self._rpc_template(
                 str(command), requires_token, *args, **kwargs
@@ -0,0 +1,149 @@
+#
+# Copyright 2024 Ettus Research, a National Instruments Brand
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Unit test for uhd.utils.mpmdiscovery
+"""
+
+import asyncio
+import socket
+import sys
+import unittest
+from unittest import mock
+from uhd.utils import mpmdiscovery
+from uhd.utils.mpmdiscovery import parse_discovery_response, discover, \
+    measure_path, probe, get_broadcast_addrs, DiscoveredDevice, \
+    MPM_DISCOVERY_CMD, MPM_ECHO_CMD
+
+class _Responder(asyncio.DatagramProtocol):
+    """
+    Answers discovery and echo requests on localhost like MPM does. Echo
+    requests larger than mtu are dropped; replies are truncated to
+    max_reply bytes.
+    """
+    def __init__(self, response, mtu=65507, max_reply=65507):
+        self.response = response
+        self.mtu = mtu
+        self.max_reply = max_reply
+        self.transport = None
+        self.echo_sizes = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if data == MPM_DISCOVERY_CMD:
+            self.transport.sendto(self.response, addr)
+        elif data.startswith(MPM_ECHO_CMD):
+            self.echo_sizes.append(len(data))
+            if len(data) <= self.mtu:
+                self.transport.sendto(data[:self.max_reply], addr)
+
+class MPMDiscoveryTest(unittest.TestCase):
+    """ Test MPM discovery against a responder on localhost """
+    RESPONSE = b"USRP-MPM;type=sim;product=B206;serial=1234;claimed=False"
+
+    def _run(self, coro_func, **kwargs):
+        """
+        Start a responder with kwargs, then run coro_func(port, responder)
+        """
+        async def run():
+            loop = asyncio.get_running_loop()
+            transport, responder = await loop.create_datagram_endpoint(
+                lambda: _Responder(self.RESPONSE, **kwargs),
+                local_addr=("127.0.0.1", 0))
+            try:
+                port = transport.get_extra_info('sockname')[1]
+                return await coro_func(port, responder)
+            finally:
+                transport.close()
+        return asyncio.run(run())
+
+    def test_parse_discovery_response(self):
+        """
+        Check responses are parsed into dictionaries
+        """
+        info = parse_discovery_response(self.RESPONSE)
+        self.assertEqual(info, {
+            'type': 'sim', 'product': 'B206', 'serial': '1234', 'claimed': False})
+        info = parse_discovery_response(b"USRP-MPM;claimed=True;addr=a=b;empty;")
+        self.assertEqual(info, {'claimed': True, 'addr': 'a=b'})
+        self.assertEqual(parse_discovery_response(b"USRP-MPM"), {'claimed': False})
+        self.assertIsNone(parse_discovery_response(b"MPM-DISC"))
+        self.assertIsNone(parse_discovery_response(b"\xff\xfe"))
+
+    def test_get_broadcast_addrs(self):
+        """
+        Check there is always an address to broadcast to, even without
+        fcntl (e.g., on Windows)
+        """
+        self.assertTrue(get_broadcast_addrs())
+        with mock.patch.dict(sys.modules, {'fcntl': None}):
+            self.assertEqual(get_broadcast_addrs(), ["255.255.255.255"])
+
+    def test_discover(self):
+        """
+        Check discover() collects one response per address
+        """
+        async def run(port, _):
+            return await discover(["127.0.0.1", "127.0.0.1"], 0.2, port)
+        devices = self._run(run)
+        self.assertEqual(len(devices), 1)
+        self.assertEqual(devices[0].addr, "127.0.0.1")
+        self.assertEqual(devices[0].serial, "1234")
+        self.assertFalse(devices[0].info['claimed'])
+        self.assertGreater(devices[0].rtt, 0)
+        self.assertLess(devices[0].rtt, 0.2)
+        # Nobody listening
+        async def run_unanswered(port, responder):
+            responder.transport.close()
+            return await discover(["127.0.0.1"], 0.1, port)
+        self.assertEqual(self._run(run_unanswered), [])
+
+    def test_measure_path(self):
+        """
+        Check the MTU bisection finds the largest frame size that gets
+        through
+        """
+        def measure(**kwargs):
+            async def run(port, responder):
+                return await measure_path("127.0.0.1", port, 0.1), responder
+            return self._run(run, **kwargs)
+        (rtt, mtu), responder = measure(mtu=4000)
+        self.assertGreater(rtt, 0)
+        self.assertEqual(mtu, 4000)
+        # Bisection, not a linear search: 3 pings plus about log2(8000 - 1472) sizes
+        self.assertLess(len(responder.echo_sizes), 3 + 16)
+        self.assertTrue(all(size % 4 == 0 for size in responder.echo_sizes[3:]))
+        (_, mtu), _ = measure(mtu=5123)
+        self.assertEqual(mtu, 5120)
+        # Truncated replies bound the frame size, too
+        (_, mtu), _ = measure(max_reply=3000)
+        self.assertEqual(mtu, 3000)
+        (_, mtu), _ = measure()
+        self.assertEqual(mtu, mpmdiscovery.MAX_FRAME_SIZE)
+        (_, mtu), _ = measure(mtu=1000)
+        self.assertEqual(mtu, mpmdiscovery.MIN_FRAME_SIZE)
+        # No replies at all
+        (rtt, mtu), _ = measure(mtu=0)
+        self.assertIsNone(rtt)
+        self.assertEqual(mtu, 0)
+
+    def test_probe_error(self):
+        """
+        Check a failing RPC call ends up in the device's error
+        """
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        device = DiscoveredDevice(addr="127.0.0.1", info={}, rtt=0.0)
+        async def run():
+            await probe(device, None, rpc_port=port, rpc_timeout=0.5)
+        asyncio.run(run())
+        self.assertEqual(device.device_info, {})
+        self.assertTrue(device.error)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+#
+# Copyright 2024 Ettus Research, a National Instruments Brand
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Unit test for uhd.utils.mpmtools
+"""
+
+import unittest
+from unittest import mock
+from mprpc.exceptions import RPCError
+from uhd.utils.mpmtools import MPMClient, InitMode
+
+TOKEN = "T" * 40
+
+class _RPCClient:
+    """
+    Answers calls like MPM does, and remembers them. Batched calls are only
+    supported if has_multicall is set.
+    """
+    has_multicall = False
+
+    def __init__(self, host, port, pack_params=None):
+        self.calls = []
+        self.gain = 0
+
+    def list_methods(self):
+        " Like MPMServer.list_methods() "
+        methods = [
+            ('get_state', "", False),
+            ('set_gain', "", True),
+            ('fail', "", True),
+        ]
+        if self.has_multicall:
+            methods.append(('multicall', "", True))
+        return methods
+
+    def get_state(self):
+        " A safe call "
+        return "ok"
+
+    def set_gain(self, token, gain):
+        " A claimed call "
+        if token != TOKEN:
+            raise RPCError("Invalid token!")
+        self.gain = gain
+        return gain
+
+    def fail(self, token):
+        " A claimed call which always fails "
+        raise RPCError("Broken")
+
+    def multicall(self, token, calls):
+        " Like MPMServer.multicall(), but results are lists as after msgpack "
+        results = []
+        for method, args in calls:
+            if method in ('set_gain', 'fail'):
+                args = [token] + args
+            try:
+                results.append([True, getattr(self, method)(*args)])
+            except RPCError as ex:
+                results.append([False, str(ex)])
+        return results
+
+    def call(self, method, *args):
+        " Dispatch to the methods above "
+        self.calls.append((method, args))
+        return getattr(self, method)(*args)
+
+class MPMClientTest(unittest.TestCase):
+    """ Test MPMClient against a fake RPC client """
+    CALLS = [('get_state', []), ('set_gain', [3]), ('fail', [])]
+    RESULTS = [(True, "ok"), (True, 3), (False, "Broken")]
+
+    def _client(self, has_multicall, init_mode=InitMode.Hijack, token=TOKEN):
+        patcher = mock.patch.object(_RPCClient, 'has_multicall', has_multicall)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        with mock.patch('uhd.utils.mpmtools.RPCClient', _RPCClient):
+            client = MPMClient(init_mode, "localhost", token=token)
+        # pylint: disable=protected-access
+        rpc = client._client
+        rpc.calls.clear()
+        return client, rpc
+
+    def test_multicall(self):
+        """
+        Check a device with batched calls gets one call
+        """
+        client, rpc = self._client(has_multicall=True)
+        self.assertEqual(client.multicall(self.CALLS), self.RESULTS)
+        self.assertEqual(rpc.calls, [('multicall', (TOKEN, self.CALLS))])
+        self.assertEqual(rpc.gain, 3)
+
+    def test_multicall_fallback(self):
+        """
+        Check devices without batched calls get one call per command, with
+        the token where required
+        """
+        client, rpc = self._client(has_multicall=False)
+        self.assertEqual(client.multicall(self.CALLS), self.RESULTS)
+        self.assertEqual(rpc.calls, [
+            ('get_state', ()), ('set_gain', (TOKEN, 3)), ('fail', (TOKEN,))])
+        self.assertEqual(rpc.gain, 3)
+        with self.assertRaisesRegex(RuntimeError, "`fail' failed: Broken"):
+            client.multicall(self.CALLS, raise_on_error=True)
+        self.assertEqual(client.multicall([]), [])
+
+    def test_multicall_no_claim(self):
+        """
+        Check calls which require a claim fail without a token, and the
+        others still run
+        """
+        client, rpc = self._client(has_multicall=False, init_mode=InitMode.Noclaim, token=None)
+        results = client.multicall(self.CALLS[:2])
+        self.assertEqual(results[0], (True, "ok"))
+        self.assertFalse(results[1][0])
+        self.assertIn("no claim available", results[1][1])
+        self.assertEqual(rpc.calls, [('get_state', ())])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,6 +10,7 @@
 #include <boost/noncopyable.hpp>
 #include <memory>
 #include <string>
+#include <vector>
 
 namespace mpm { namespace spi {
 
@@ -44,6 +45,23 @@ public:
      */
     virtual uint64_t transfer64_40(const uint64_t data) = 0;
 
+    /*! Convenience function: Several 24 bit write xfers, read data is
+     * discarded.
+     *
+     * Chip select is deasserted between xfers, so this is equivalent to
+     * calling transfer24_8() for every element of data, which is what the
+     * default implementation does. Implementations may batch the xfers into
+     * fewer driver calls.
+     *
+     * \param data The write data, one element per xfer
+     */
+    virtual void transfer24_8_multi(const std::vector<uint32_t>& data)
+    {
+        for (const uint32_t xfer_data : data) {
+            transfer24_8(xfer_data);
+        }
+    }
+
     /*!
      * \param device The path to the spidev used (e.g. "/dev/spidev0.0")
      * \param speed_hz Transaction speed in Hz
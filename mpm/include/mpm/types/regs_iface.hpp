@@ -7,7 +7,10 @@
 #pragma once
 
 #include <boost/noncopyable.hpp>
+#include <cstdint>
 #include <memory>
+#include <utility>
+#include <vector>
 
 namespace mpm { namespace types {
 
@@ -26,6 +29,18 @@ public:
      */
     virtual void poke8(const uint32_t addr, const uint8_t data) = 0;
 
+    /*! Write several 8-bit values, in the given order
+     *
+     * The default implementation calls poke8() for every value.
+     * Implementations may batch the writes into fewer bus transactions.
+     */
+    virtual void pokes8(const std::vector<std::pair<uint32_t, uint8_t>>& addr_vals)
+    {
+        for (const auto& addr_val : addr_vals) {
+            poke8(addr_val.first, addr_val.second);
+        }
+    }
+
     /*! Return a 16-bit value from a given address
      */
     virtual uint16_t peek16(const uint32_t addr) = 0;
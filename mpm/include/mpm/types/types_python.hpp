@@ -11,6 +11,7 @@
 #include "log_buf.hpp"
 #include "mmap_regs_iface.hpp"
 #include "regs_iface.hpp"
+#include <pybind11/stl.h>
 
 void export_types(py::module& top_module)
 {
@@ -24,6 +25,7 @@ void export_types(py::module& top_module)
     py::class_<regs_iface, std::shared_ptr<regs_iface>>(m, "regs_iface")
         .def("peek8", &regs_iface::peek8)
         .def("poke8", &regs_iface::poke8)
+        .def("pokes8", &regs_iface::pokes8)
         .def("peek16", &regs_iface::peek16)
         .def("poke16", &regs_iface::poke16)
         .def("peek32", &regs_iface::peek32)
@@ -52,6 +52,18 @@ public:
         _spi_iface->transfer24_8(transaction);
     }
 
+    void pokes8(const std::vector<std::pair<uint32_t, uint8_t>>& addr_vals)
+    {
+        std::vector<uint32_t> transactions;
+        transactions.reserve(addr_vals.size());
+        for (const auto& addr_val : addr_vals) {
+            transactions.push_back(0 | _write_flags | (addr_val.first << _addr_shift)
+                                   | (addr_val.second << _data_shift));
+        }
+
+        _spi_iface->transfer24_8_multi(transactions);
+    }
+
     uint16_t peek16(const uint32_t addr)
     {
         uint32_t transaction = 0 | (addr << _addr_shift) | _read_flags;
@@ -136,3 +136,47 @@ int transfer(int fd,
 
     return 0;
 }
+
+int transfer_multi(int fd,
+    uint8_t* tx,
+    uint8_t* rx,
+    uint32_t len,
+    uint32_t num_xfers,
+    uint32_t speed_hz,
+    uint8_t bits_per_word,
+    uint16_t delay_us)
+{
+    int err;
+    struct spi_ioc_transfer tr[SPI_MAX_XFERS];
+
+    if (num_xfers == 0) {
+        return 0;
+    }
+    if (num_xfers > SPI_MAX_XFERS) {
+        return -EINVAL;
+    }
+
+    memset(tr, 0, sizeof(tr));
+    for (uint32_t i = 0; i < num_xfers; i++) {
+        tr[i].tx_buf        = (unsigned long)(tx + i * len);
+        tr[i].rx_buf        = (unsigned long)(rx + i * len);
+        tr[i].len           = len;
+        tr[i].speed_hz      = speed_hz;
+        tr[i].delay_usecs   = delay_us;
+        tr[i].bits_per_word = bits_per_word;
+        // Deassert chip select between transactions, but not after the last
+        // one (that happens anyway)
+        tr[i].cs_change = (i + 1 < num_xfers);
+        tr[i].tx_nbits  = 1; // Standard SPI
+        tr[i].rx_nbits  = 1; // Standard SPI
+    }
+
+    err = ioctl(fd, SPI_IOC_MESSAGE(num_xfers), tr);
+    if (err < 0) {
+        fprintf(stderr, "%s: Failed ioctl: %d\n", __func__, err);
+        perror("ioctl: \n");
+        return err;
+    }
+
+    return 0;
+}
@@ -44,3 +44,30 @@ int transfer(int fd,
     uint32_t speed_hz,
     uint8_t bits_per_word,
     uint16_t delay_us);
+
+//! Maximum number of transactions per transfer_multi() call
+#define SPI_MAX_XFERS 64
+
+/*! Do several SPI transactions of the same length with one spidev call
+ *
+ * Chip select is deasserted between the transactions, so this is the same
+ * as calling transfer() num_xfers times, but without the per-call overhead.
+ *
+ * \param tx Buffer of data to be written, num_xfers * len bytes
+ * \param rx Must match tx buffer length; results will be written here
+ * \param len Number of bytes per transaction
+ * \param num_xfers Number of transactions, at most SPI_MAX_XFERS
+ * \param speed_hz Speed of the transactions in Hz
+ * \param bits_per_word 8, dude
+ * \param delay_us Delay between transfers
+ *
+ * \returns 0 if all is golden
+ */
+int transfer_multi(int fd,
+    uint8_t* tx,
+    uint8_t* rx,
+    uint32_t len,
+    uint32_t num_xfers,
+    uint32_t speed_hz,
+    uint8_t bits_per_word,
+    uint16_t delay_us);
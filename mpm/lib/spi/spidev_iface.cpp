@@ -13,6 +13,7 @@ extern "C" {
 #include <fcntl.h>
 #include <linux/spi/spidev.h>
 #include <boost/format.hpp>
+#include <algorithm>
 #include <iostream>
 
 using namespace mpm::spi;
@@ -79,6 +80,27 @@ public:
         return uint32_t(rx[1] << 8 | rx[2]);
     }
 
+    void transfer24_8_multi(const std::vector<uint32_t>& data)
+    {
+        uint8_t tx[SPI_MAX_XFERS * 3];
+        uint8_t rx[SPI_MAX_XFERS * 3]; // Buffer length must match tx buffer
+
+        for (size_t offset = 0; offset < data.size(); offset += SPI_MAX_XFERS) {
+            const size_t num_xfers =
+                std::min(data.size() - offset, size_t(SPI_MAX_XFERS));
+            for (size_t i = 0; i < num_xfers; i++) {
+                const uint32_t xfer_data = data[offset + i];
+                tx[3 * i]                = (xfer_data >> 16) & 0xFF;
+                tx[3 * i + 1]            = (xfer_data >> 8) & 0xFF;
+                tx[3 * i + 2]            = xfer_data & 0xFF;
+            }
+            if (transfer_multi(_fd, &tx[0], &rx[0], 3, num_xfers, _speed, _bits, _delay)
+                != 0) {
+                throw mpm::runtime_error(str(boost::format("SPI Transaction failed!")));
+            }
+        }
+    }
+
     uint64_t transfer64_40(const uint64_t data_)
     {
         uint64_t data    = data_;
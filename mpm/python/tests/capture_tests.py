@@ -0,0 +1,155 @@
+#
+# Copyright 2024 Ettus Research, a National Instruments Brand
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Tests for the pcap capture of the simulator
+"""
+
+import logging
+import os
+import socket
+import tempfile
+import time
+import unittest
+from base_tests import TestBase
+from usrp_mpm.mpmlog import get_original
+from usrp_mpm.simulator.capture import PcapRecorder, PCAP_FILE_HEADER, \
+    PCAP_RECORD_HEADER, IPV4_HEADER, UDP_HEADER, HEADERS_LEN, PCAP_MAGIC_NS, \
+    PCAP_VERSION, SNAPLEN, LINKTYPE_RAW, IP_PROTO_UDP
+
+SRC = ("192.168.10.1", 49152)
+DST = ("192.168.10.2", 49153)
+
+def _read_pcap(path):
+    """
+    Parse a capture file into its file header and a list of
+    (timestamp, src, dst, data) tuples, one per record
+    """
+    with open(path, 'rb') as pcap_file:
+        contents = pcap_file.read()
+    header = PCAP_FILE_HEADER.unpack_from(contents)
+    records = []
+    offset = PCAP_FILE_HEADER.size
+    while offset < len(contents):
+        seconds, nanoseconds, incl_len, orig_len = \
+            PCAP_RECORD_HEADER.unpack_from(contents, offset)
+        assert incl_len == orig_len
+        offset += PCAP_RECORD_HEADER.size
+        packet = contents[offset:offset + incl_len]
+        offset += incl_len
+        (version_ihl, _, total_len, _, _, _, proto, _, src_addr, dst_addr) = \
+            IPV4_HEADER.unpack_from(packet)
+        assert version_ihl == 0x45
+        assert proto == IP_PROTO_UDP
+        assert total_len == incl_len
+        src_port, dst_port, udp_len, _ = UDP_HEADER.unpack_from(packet, IPV4_HEADER.size)
+        assert udp_len == incl_len - IPV4_HEADER.size
+        records.append((
+            seconds * 1000000000 + nanoseconds,
+            (socket.inet_ntoa(src_addr), src_port),
+            (socket.inet_ntoa(dst_addr), dst_port),
+            packet[HEADERS_LEN:]))
+    return header, records
+
+class TestPcapRecorder(TestBase):
+    """
+    Tests for PcapRecorder
+    """
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = os.path.join(tmp_dir.name, "chdr.pcap")
+        self.log = logging.getLogger("capture_tests")
+
+    def _record_size(self, payload_len):
+        return PCAP_RECORD_HEADER.size + HEADERS_LEN + payload_len
+
+    def test_records(self):
+        """
+        Checking datagrams are written as IPv4/UDP records of a pcap file...
+        """
+        start = time.time_ns()
+        recorder = PcapRecorder(self.log, self.path)
+        datagrams = [bytes([i]) * (8 * i + 8) for i in range(4)]
+        for data in datagrams:
+            recorder.record(data, SRC, DST)
+        recorder.record(b"\xAA", DST, SRC)
+        recorder.close()
+        header, records = _read_pcap(self.path)
+        self.assertEqual(header, (PCAP_MAGIC_NS, *PCAP_VERSION, 0, 0, SNAPLEN, LINKTYPE_RAW))
+        self.assertEqual(PCAP_FILE_HEADER.size, 24)
+        self.assertEqual(PCAP_RECORD_HEADER.size, 16)
+        self.assertEqual([record[1:] for record in records],
+                         [(SRC, DST, data) for data in datagrams] + [(DST, SRC, b"\xAA")])
+        timestamps = [record[0] for record in records]
+        self.assertEqual(timestamps, sorted(timestamps))
+        self.assertGreaterEqual(timestamps[0], start)
+        self.assertLessEqual(timestamps[-1], time.time_ns())
+        self.assertEqual(recorder.get_stats(), {'written': 5, 'dropped': 0, 'pending': 0})
+
+    def test_max_pending(self):
+        """
+        Checking datagrams are dropped while the writer is too far behind...
+        """
+        recorder = PcapRecorder(self.log, self.path, max_pending=2)
+        entered = get_original('threading', 'Event')()
+        release = get_original('threading', 'Event')()
+        self.addCleanup(release.set)
+        write_record = recorder._write_record
+        def blocking_write_record(*args):
+            entered.set()
+            release.wait(5.0)
+            write_record(*args)
+        recorder._write_record = blocking_write_record
+        recorder.record(b"\x00", SRC, DST)
+        self.assertTrue(entered.wait(5.0))
+        # The writer holds the first datagram, so two more fit into the queue
+        for i in range(1, 5):
+            recorder.record(bytes([i]), SRC, DST)
+        self.assertEqual(recorder.get_stats(), {'written': 0, 'dropped': 2, 'pending': 2})
+        release.set()
+        recorder.close()
+        self.assertEqual(recorder.get_stats(), {'written': 3, 'dropped': 2, 'pending': 0})
+        _, records = _read_pcap(self.path)
+        self.assertEqual([record[3] for record in records], [b"\x00", b"\x01", b"\x02"])
+
+    def test_rotate(self):
+        """
+        Checking ring mode keeps the newest max_files files...
+        """
+        # Every record starts a new file
+        recorder = PcapRecorder(self.log, self.path, max_size=PCAP_FILE_HEADER.size + 1,
+                                max_files=3)
+        for i in range(4):
+            recorder.record(bytes([i]) * 4, SRC, DST)
+        recorder.close()
+        self.assertEqual(sorted(os.listdir(os.path.dirname(self.path))),
+                         ["chdr.pcap", "chdr.pcap.1", "chdr.pcap.2"])
+        for path, payloads in ((self.path, []),
+                               (self.path + ".1", [b"\x03" * 4]),
+                               (self.path + ".2", [b"\x02" * 4])):
+            header, records = _read_pcap(path)
+            self.assertEqual(header[0], PCAP_MAGIC_NS)
+            self.assertEqual([record[3] for record in records], payloads)
+        self.assertEqual(recorder.get_stats()['written'], 4)
+
+    def test_rotate_single_file(self):
+        """
+        Checking ring mode with one file truncates it...
+        """
+        # Two records fit into a file
+        recorder = PcapRecorder(self.log, self.path,
+                                max_size=PCAP_FILE_HEADER.size + 2 * self._record_size(4))
+        for i in range(5):
+            recorder.record(bytes([i]) * 4, SRC, DST)
+        recorder.close()
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ["chdr.pcap"])
+        self.assertEqual(os.path.getsize(self.path),
+                         PCAP_FILE_HEADER.size + self._record_size(4))
+        _, records = _read_pcap(self.path)
+        self.assertEqual([record[3] for record in records], [b"\x04" * 4])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,211 @@
+#
+# Copyright 2024 Ettus Research, a National Instruments Brand
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Tests for uploading component files in chunks
+"""
+
+import os
+import tempfile
+import unittest
+from hashlib import sha256
+from unittest import mock
+from base_tests import TestBase
+from usrp_mpm.mpmlog import get_main_logger
+from usrp_mpm.periph_manager import base
+from usrp_mpm.periph_manager.base import PeriphManagerBase
+
+def _sha256(data):
+    return sha256(data).hexdigest()
+
+class _PeriphManager(PeriphManagerBase):
+    """
+    Just enough of a periph manager to upload and install components
+    """
+    updateable_components = {
+        'fpga': {'callback': 'install', 'reset': True},
+        'dts': {'callback': 'install', 'reset': False},
+    }
+
+    def __init__(self):
+        # pylint: disable=super-init-not-called
+        # The base class constructor talks to the hardware
+        self.log = get_main_logger(use_logbuf=False).getChild("component_upload_tests")
+        self._uploads = {}
+        self.installed = []
+
+    def install(self, filepath, metadata):
+        """ Remember what was installed """
+        with open(filepath, 'rb') as comp_file:
+            self.installed.append((metadata['id'], comp_file.read()))
+
+class TestComponentUpload(TestBase):
+    """
+    Tests for ComponentUpload and the upload methods of PeriphManagerBase
+    """
+    FPGA = bytes(range(256)) * 40
+    DTS = b"/dts-v1/;\n" * 50
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.upload_path = os.path.join(tmp_dir.name, "uploads")
+        patcher = mock.patch.object(base, 'UPLOAD_PATH', self.upload_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mgr = _PeriphManager()
+        self.addCleanup(self._close_files)
+
+    @staticmethod
+    def _metadata(comp_id, filename, data):
+        return {'id': comp_id, 'filename': filename,
+                'sha256': _sha256(data), 'size': str(len(data))}
+
+    def _path(self, filename):
+        return os.path.join(self.upload_path, filename)
+
+    def _append(self, filename, data, offset, end):
+        chunk = data[offset:end]
+        return self.mgr.append_component_chunk(filename, offset, chunk, _sha256(chunk))
+
+    def _close_files(self):
+        for upload in self.mgr._uploads.values():
+            upload.part_file.close()
+
+    def _restart(self):
+        """ Replace the periph manager, like when MPM was restarted """
+        self._close_files()
+        self.mgr = _PeriphManager()
+
+    def _upload(self, comp_id, filename, data, chunk_size=1000):
+        """ Upload all of data, from where the upload resumes """
+        offset = self.mgr.begin_component_upload(self._metadata(comp_id, filename, data))
+        while offset < len(data):
+            offset = self._append(filename, data, offset, offset + chunk_size)
+        return offset
+
+    def test_upload(self):
+        """
+        Checking files are uploaded in chunks and installed...
+        """
+        self._upload('fpga', 'usrp.bit', self.FPGA)
+        self._upload('dts', 'usrp.dts', self.DTS, chunk_size=64)
+        metadata_l = self.mgr.install_uploaded_components(['usrp.bit', 'usrp.dts'])
+        self.assertEqual([metadata['id'] for metadata in metadata_l], ['fpga', 'dts'])
+        self.assertEqual(self.mgr.installed, [('fpga', self.FPGA), ('dts', self.DTS)])
+        self.assertEqual(sorted(os.listdir(self.upload_path)), ['usrp.bit', 'usrp.dts'])
+        with self.assertRaises(RuntimeError):
+            self.mgr.install_uploaded_components(['usrp.bit'])
+
+    def test_resume(self):
+        """
+        Checking an interrupted upload resumes where it stopped...
+        """
+        metadata = self._metadata('fpga', 'usrp.bit', self.FPGA)
+        self.assertEqual(self.mgr.begin_component_upload(metadata), 0)
+        self._append('usrp.bit', self.FPGA, 0, 3000)
+        # Beginning again in the same session continues, too
+        self.assertEqual(self.mgr.begin_component_upload(metadata), 3000)
+        # A new periph manager finds the partial file
+        self._restart()
+        self.assertEqual(self.mgr.begin_component_upload(metadata), 3000)
+        with self.assertRaises(RuntimeError):
+            self._append('usrp.bit', self.FPGA, 0, 1000)
+        self.assertEqual(self._upload('fpga', 'usrp.bit', self.FPGA), len(self.FPGA))
+        self.mgr.install_uploaded_components(['usrp.bit'])
+        self.assertEqual(self.mgr.installed, [('fpga', self.FPGA)])
+
+    def test_stale_part(self):
+        """
+        Checking a partial file of a different file is discarded...
+        """
+        other = bytes(reversed(self.FPGA))
+        self.mgr.begin_component_upload(self._metadata('fpga', 'usrp.bit', other))
+        self._append('usrp.bit', other, 0, 3000)
+        self._restart()
+        metadata = self._metadata('fpga', 'usrp.bit', self.FPGA)
+        self.assertEqual(self.mgr.begin_component_upload(metadata), 0)
+        self.assertEqual(os.path.getsize(self._path('usrp.bit.part')), 0)
+        # The same, within one session
+        self._append('usrp.bit', self.FPGA, 0, 3000)
+        self.assertEqual(
+            self.mgr.begin_component_upload(self._metadata('fpga', 'usrp.bit', other)), 0)
+        # Partial files without information where they belong to
+        os.remove(self._path('usrp.bit.part.info'))
+        self._restart()
+        self.assertEqual(self.mgr.begin_component_upload(metadata), 0)
+        self._upload('fpga', 'usrp.bit', self.FPGA)
+        self.mgr.install_uploaded_components(['usrp.bit'])
+        self.assertEqual(self.mgr.installed, [('fpga', self.FPGA)])
+
+    def test_bad_chunks(self):
+        """
+        Checking chunks at the wrong offset, with a bad hash, or beyond the
+        size of the file are rejected...
+        """
+        self.mgr.begin_component_upload(self._metadata('fpga', 'usrp.bit', self.FPGA))
+        self._append('usrp.bit', self.FPGA, 0, 1000)
+        for offset in (0, 500, 2000):
+            with self.assertRaises(RuntimeError):
+                self._append('usrp.bit', self.FPGA, offset, offset + 1000)
+        chunk = self.FPGA[1000:2000]
+        with self.assertRaises(RuntimeError):
+            self.mgr.append_component_chunk('usrp.bit', 1000, chunk, _sha256(chunk[1:]))
+        with self.assertRaises(RuntimeError):
+            self._append('usrp.bit', self.FPGA + b"\0", 1000, len(self.FPGA) + 1)
+        self.assertEqual(os.path.getsize(self._path('usrp.bit.part')), 1000)
+        self.assertEqual(self._upload('fpga', 'usrp.bit', self.FPGA), len(self.FPGA))
+        with self.assertRaises(RuntimeError):
+            self.mgr.append_component_chunk('other.bit', 0, b"", _sha256(b""))
+
+    def test_metadata(self):
+        """
+        Checking uploads need a hash, and an updateable component...
+        """
+        with self.assertRaises(RuntimeError):
+            self.mgr.begin_component_upload({'id': 'fpga', 'filename': 'usrp.bit'})
+        with self.assertRaises(KeyError):
+            self.mgr.begin_component_upload(self._metadata('foo', 'usrp.bit', self.FPGA))
+        self.assertEqual(self.mgr._uploads, {})
+
+    def test_verify_all_first(self):
+        """
+        Checking nothing is installed if one of the files fails to verify...
+        """
+        self._upload('fpga', 'usrp.bit', self.FPGA)
+        # The metadata promise a different file than the one uploaded
+        metadata = self._metadata('dts', 'usrp.dts', self.DTS)
+        self.mgr.begin_component_upload(metadata)
+        self._append('usrp.dts', self.DTS, 0, len(self.DTS))
+        metadata['sha256'] = _sha256(self.DTS[1:])
+        with self.assertRaises(RuntimeError):
+            self.mgr.install_uploaded_components(['usrp.bit', 'usrp.dts'])
+        self.assertEqual(self.mgr.installed, [])
+        self.assertFalse(os.path.exists(self._path('usrp.bit')))
+        self.assertFalse(os.path.exists(self._path('usrp.dts')))
+        # The broken file has to be uploaded again, the other one not
+        self.assertFalse(os.path.exists(self._path('usrp.dts.part')))
+        self.assertEqual(self._upload('fpga', 'usrp.bit', self.FPGA), len(self.FPGA))
+        # A file which is too short fails, too
+        self._upload('dts', 'usrp.dts', self.DTS)
+        self.mgr.begin_component_upload(self._metadata('dts', 'usrp.dts', self.DTS))
+        self.mgr._uploads['usrp.dts'].size += 1
+        with self.assertRaises(RuntimeError):
+            self.mgr.install_uploaded_components(['usrp.bit', 'usrp.dts'])
+        self.assertEqual(self.mgr.installed, [])
+
+    def test_abort(self):
+        """
+        Checking aborted uploads leave no files behind...
+        """
+        self.mgr.begin_component_upload(self._metadata('fpga', 'usrp.bit', self.FPGA))
+        self._append('usrp.bit', self.FPGA, 0, 1000)
+        self.mgr.abort_component_upload('usrp.bit')
+        self.assertEqual(os.listdir(self.upload_path), [])
+        with self.assertRaises(RuntimeError):
+            self.mgr.abort_component_upload('usrp.bit')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+#
+# Copyright 2024 Ettus Research, a National Instruments Brand
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Tests for the discovery responder
+"""
+
+import ipaddress
+import logging
+import socket
+import time
+import unittest
+from base_tests import TestBase
+from usrp_mpm import discovery
+from usrp_mpm.discovery import DiscoveryResponder, get_discovery_networks, recv_batch
+from usrp_mpm.mpmtypes import SharedState
+
+class MockSocket:
+    """
+    Records what would have been sent
+    """
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, addr):
+        """ Record data """
+        self.sent.append((data, addr))
+
+class TestDiscovery(TestBase):
+    """
+    Tests for DiscoveryResponder and get_discovery_networks()
+    """
+    def _get_responder(self, networks=None):
+        state = SharedState()
+        state.dev_type.value = b"n3xx"
+        state.dev_serial.value = b"12345"
+        state.changed()
+        log = logging.getLogger("discovery_tests")
+        log.trace = log.debug
+        return DiscoveryResponder(state, log, networks)
+
+    def test_response_cache(self):
+        """
+        Checking the response is regenerated only on changes...
+        """
+        responder = self._get_responder()
+        response = responder.get_response()
+        self.assertIn(b"serial=12345", response)
+        self.assertIn(b"claimed=False", response)
+        responder.state.claim_status.value = True
+        # Not announced yet, so the cached response is still sent
+        self.assertIs(responder.get_response(), response)
+        responder.state.changed()
+        self.assertIn(b"claimed=True", responder.get_response())
+
+    def test_rate_limit(self):
+        """
+        Checking discovery responses are rate limited per source...
+        """
+        responder = self._get_responder()
+        sock = MockSocket()
+        for port in range(discovery.RATE_LIMIT_BURST + 5):
+            responder.handle_request(sock, b"MPM-DISC", ("10.0.0.1", port))
+        responder.handle_request(sock, b"MPM-DISC", ("10.0.0.2", 1))
+        self.assertEqual(len(sock.sent), discovery.RATE_LIMIT_BURST + 1)
+        self.assertEqual(responder.num_rate_limited, 5)
+        # Echo requests are never rate limited
+        responder.handle_request(sock, b"MPM-ECHO", ("10.0.0.1", 1))
+        self.assertEqual(sock.sent[-1], (b"MPM-ECHO", ("10.0.0.1", 1)))
+
+    def test_batch(self):
+        """
+        Checking repeated requests within one batch get one response...
+        """
+        responder = self._get_responder()
+        sock = MockSocket()
+        responder.handle_batch(sock, [(b"MPM-DISC", ("10.0.0.1", 1))] * 3)
+        self.assertEqual(len(sock.sent), 1)
+
+    def test_recv_batch(self):
+        """
+        recv_batch() returns what is queued without waiting for more
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.bind(("127.0.0.1", 0))
+            sender.bind(("127.0.0.1", 0))
+            # If recv_batch() waited for more datagrams, this fails instead
+            # of hanging
+            sock.settimeout(2.0)
+            buf = bytearray(discovery.MAX_SOCK_BUFSIZ)
+            sender.sendto(b"MPM-DISC", sock.getsockname())
+            batch = recv_batch(sock, buf)
+            self.assertEqual(batch, [(b"MPM-DISC", sender.getsockname())])
+            self.assertEqual(sock.gettimeout(), 2.0)
+            for index in range(3):
+                sender.sendto(b"MPM-ECHO" + bytes([index]), sock.getsockname())
+            # Give the datagrams time to arrive
+            time.sleep(0.1)
+            batch = recv_batch(sock, buf)
+            self.assertEqual([data for data, _ in batch],
+                             [b"MPM-ECHO\x00", b"MPM-ECHO\x01", b"MPM-ECHO\x02"])
+        finally:
+            sock.close()
+            sender.close()
+
+    def test_networks(self):
+        """
+        Checking subnet matching...
+        """
+        local = [ipaddress.IPv4Interface("192.168.10.2/24"),
+                 ipaddress.IPv4Interface("10.1.0.2/16")]
+        self.assertIsNone(get_discovery_networks("0.0.0.0", local))
+        networks = get_discovery_networks("192.168.10.255, 10.1.255.255", local)
+        self.assertEqual(set(networks), {
+            ipaddress.IPv4Network("192.168.10.0/24"),
+            ipaddress.IPv4Network("10.1.0.0/16")})
+        self.assertEqual(get_discovery_networks("172.16.0.0/12", local),
+                         [ipaddress.IPv4Network("172.16.0.0/12")])
+        responder = self._get_responder(networks)
+        sock = MockSocket()
+        responder.handle_request(sock, b"MPM-DISC", ("10.1.3.4", 1))
+        responder.handle_request(sock, b"MPM-DISC", ("10.2.3.4", 1))
+        self.assertEqual([addr for _, addr in sock.sent], [("10.1.3.4", 1)])
+        self.assertEqual(responder.num_ignored, 1)
+
+if __name__ == '__main__':
+    unittest.main()
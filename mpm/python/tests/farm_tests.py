@@ -0,0 +1,93 @@
+#
+# Copyright 2024 Ettus Research, a National Instruments Brand
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Tests for the farm of simulated devices
+"""
+
+import logging
+import os
+import tempfile
+import unittest
+from base_tests import TestBase
+from usrp_mpm.mpmtypes import MPM_DISCOVERY_PORT, MPM_RPC_PORT
+from usrp_mpm.simulator.config import CHDR_PORT, Config
+from usrp_mpm.simulator.farm import PORTS_PER_DEVICE, check_device_args, \
+    get_device_endpoints, get_device_serial
+from usrp_mpm.simulator.sample_source import LoopbackSink, LoopbackSource
+
+class TestFarm(TestBase):
+    """
+    Tests for the per device settings of a farm
+    """
+    HARDWARE = "[hardware]\npreset = E320\nserial_num = FA4EDE7\n"
+
+    def _write_config(self, contents):
+        """ Write a simulator config file, and return its path """
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        path = os.path.join(tmp_dir.name, "sim.ini")
+        with open(path, "w") as config_file:
+            config_file.write(contents)
+        return path
+
+    def test_endpoints(self):
+        """
+        Checking devices are told apart by address or port...
+        """
+        self.assertEqual(get_device_endpoints(0, "127.0.0.1"),
+                         ("127.0.0.1", MPM_DISCOVERY_PORT, MPM_RPC_PORT, CHDR_PORT))
+        self.assertEqual(get_device_endpoints(3, "127.0.0.254"),
+                         ("127.0.1.1", MPM_DISCOVERY_PORT, MPM_RPC_PORT, CHDR_PORT))
+        base = 40000 + 2 * PORTS_PER_DEVICE
+        self.assertEqual(get_device_endpoints(2, "127.0.0.1", 40000),
+                         ("127.0.0.1", base, base + 1, base + 2))
+
+    def test_serial(self):
+        """
+        Checking every device gets a serial number which fits...
+        """
+        serials = {get_device_serial(index) for index in range(1000)}
+        self.assertEqual(len(serials), 1000)
+        self.assertLessEqual(max(len(serial) for serial in serials), 8)
+
+    def test_check_device_args(self):
+        """
+        Checking the CHDR transports must fit into the ports of a device...
+        """
+        log = logging.getLogger("farm_tests")
+        path = self._write_config(self.HARDWARE + "num_xports = {}\n".format(PORTS_PER_DEVICE - 2))
+        check_device_args(log, {'config': path}, 40000)
+        check_device_args(log, {}, 40000)
+        path = self._write_config(self.HARDWARE + "num_xports = {}\n".format(PORTS_PER_DEVICE - 1))
+        with self.assertRaises(RuntimeError):
+            check_device_args(log, {'config': path}, 40000)
+        # Devices told apart by address have all ports to themselves
+        check_device_args(log, {'config': path})
+
+    def test_loopback_per_device(self):
+        """
+        Checking devices don't share their loopback rings...
+        """
+        path = self._write_config(
+            self.HARDWARE +
+            "[sample.source]\nclass = LoopbackSource\nchannel = farm_tests\n"
+            "[sample.sink]\nclass = LoopbackSink\nchannel = farm_tests\n")
+        log = logging.getLogger("farm_tests")
+        configs = []
+        for index in range(2):
+            config = Config.from_path(log, path)
+            config.hardware.serial_num = get_device_serial(index)
+            configs.append(config)
+        sinks = [config.get_sink_gen(0)() for config in configs]
+        sources = [config.get_source_gen(0)() for config in configs]
+        self.assertIsInstance(sinks[0], LoopbackSink)
+        self.assertIsInstance(sources[0], LoopbackSource)
+        self.assertIs(sinks[0].ring, sources[0].ring)
+        self.assertIs(sinks[1].ring, sources[1].ring)
+        self.assertIsNot(sinks[0].ring, sinks[1].ring)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+#
+# Copyright 2024 Ettus Research, a National Instruments Brand
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Tests for the log buffer in mpmlog.py
+"""
+
+import logging
+import unittest
+from base_tests import TestBase
+from usrp_mpm import mpmlog
+from usrp_mpm.mpmlog import LogRingBuffer, AsyncLogHandler
+
+class TestLogRingBuffer(TestBase):
+    """
+    Tests for LogRingBuffer
+    """
+    def _get_log(self, maxlen):
+        log_buf = LogRingBuffer(maxlen)
+        log = logging.getLogger("mpmlog_tests.{}".format(id(log_buf)))
+        log.propagate = False
+        log.setLevel(logging.DEBUG)
+        log.addHandler(log_buf)
+        return log, log_buf
+
+    def test_cursors(self):
+        """
+        Checking that readers don't take records from each other...
+        """
+        log, log_buf = self._get_log(10)
+        log.info("one %d", 1)
+        log.warning("two")
+        records, next_seq, lost = log_buf.get_records(0)
+        self.assertEqual([record[4] for record in records], ["one 1", "two"])
+        self.assertEqual((next_seq, lost), (2, 0))
+        # A second reader still gets everything
+        self.assertEqual(len(log_buf.get_records(0)[0]), 2)
+        log.info("three")
+        records, next_seq, _ = log_buf.get_records(next_seq)
+        self.assertEqual([record[0] for record in records], [2])
+        self.assertEqual(next_seq, 3)
+        self.assertEqual(log_buf.get_records(next_seq)[0], [])
+
+    def test_limits(self):
+        """
+        Checking max_records, level filter and overwritten records...
+        """
+        log, log_buf = self._get_log(4)
+        for index in range(6):
+            log.log(logging.WARNING if index % 2 else logging.INFO, str(index))
+        records, next_seq, lost = log_buf.get_records(0, max_records=1)
+        self.assertEqual([record[4] for record in records], ["2"])
+        self.assertEqual((next_seq, lost), (3, 2))
+        records, next_seq, lost = log_buf.get_records(next_seq, min_level=logging.WARNING)
+        self.assertEqual([record[4] for record in records], ["3", "5"])
+        self.assertEqual((next_seq, lost), (6, 0))
+        self.assertEqual(log_buf.get_records(0, max_records=0)[1], 2)
+
+class TestAsyncLogHandler(TestBase):
+    """
+    Tests for AsyncLogHandler
+    """
+    def _get_log(self, max_pending):
+        log_buf = LogRingBuffer(10)
+        handler = AsyncLogHandler([log_buf], max_pending)
+        self.addCleanup(handler.close)
+        log = logging.getLogger("mpmlog_tests.{}".format(id(handler)))
+        log.propagate = False
+        log.setLevel(logging.DEBUG)
+        log.addHandler(handler)
+        self.addCleanup(log.removeHandler, handler)
+        return log, handler, log_buf
+
+    def test_write(self):
+        """
+        Checking records are passed on by the writer...
+        """
+        log, handler, log_buf = self._get_log(10)
+        log.info("one")
+        log.debug("two %s", "2")
+        handler.flush()
+        records = log_buf.get_records(0)[0]
+        self.assertEqual([record[4] for record in records], ["one", "two 2"])
+
+    def test_args(self):
+        """
+        Checking arguments are logged as they were at the logging call...
+        """
+        log, handler, log_buf = self._get_log(10)
+        args = [1]
+        log.info("args %s", args)
+        args.append(2)
+        handler.flush()
+        self.assertEqual(log_buf.get_records(0)[0][0][4], "args [1]")
+
+    def test_drop(self):
+        """
+        Checking records beyond max_pending are dropped and reported...
+        """
+        log, handler, log_buf = self._get_log(0)
+        log.info("one")
+        log.info("two")
+        self.assertEqual(handler.num_dropped, 2)
+        handler.flush()
+        records = log_buf.get_records(0)[0]
+        self.assertIn("dropped 2 log records", records[0][4])
+
+    def test_close(self):
+        """
+        Checking close() writes the queued records and stops the writer...
+        """
+        log, handler, log_buf = self._get_log(10)
+        for i in range(5):
+            log.info("%d", i)
+        self.assertIn(handler, mpmlog._ASYNC_HANDLERS)
+        handler.close()
+        self.assertNotIn(handler, mpmlog._ASYNC_HANDLERS)
+        self.assertEqual(len(log_buf.get_records(0)[0]), 5)
+        # Closed handlers drop records, and can be closed again
+        log.info("late")
+        handler.flush()
+        handler.close()
+        self.assertEqual(len(log_buf.get_records(0)[0]), 5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+#
+# Copyright 2024 Ettus Research, a National Instruments Brand
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Tests for the Replay block of the simulator
+"""
+
+import logging
+import unittest
+from base_tests import TestBase
+from usrp_mpm.simulator.noc_block_regs import ReplayBlock, REPLAY_PORT_OFFSET, \
+    REPLAY_WORD_SIZE, REG_REC_RESTART, REG_REC_BASE_ADDR_LO, REG_REC_BUFFER_SIZE_LO, \
+    REG_REC_FULLNESS_LO, REG_PLAY_BASE_ADDR_LO, REG_PLAY_BUFFER_SIZE_LO, \
+    REG_PLAY_CMD_NUM_WORDS_LO, REG_PLAY_WORDS_PER_PKT, REG_PLAY_CMD, REG_PLAY_POS_LO, \
+    PLAY_CMD_STOP, PLAY_CMD_FINITE, PLAY_CMD_CONTINUOUS, PLAY_CMD_TIMED, PLAY_CMD_NO_EOB
+
+class TestReplayBlock(TestBase):
+    """
+    Tests for ReplayBlock
+    """
+    def setUp(self):
+        self.started = []
+        self.stopped = []
+        self.replay = ReplayBlock(
+            logging.getLogger("replay_tests"), 2, ReplayBlock.create_memory(12),
+            lambda port, spec, source: self.started.append((port, spec, source)),
+            self.stopped.append)
+        self.replay.memory[:] = [i & 0xFF for i in range(len(self.replay.memory))]
+
+    def _write(self, port, reg, value):
+        self.replay.write_ctrl(port * REPLAY_PORT_OFFSET + reg, value)
+
+    def _read(self, port, reg):
+        return self.replay.read_ctrl(port * REPLAY_PORT_OFFSET + reg)
+
+    def _play(self, command, port=1, num_words=3):
+        """ Set up a play buffer of 32 bytes at 0x100 and write command """
+        self._write(port, REG_PLAY_BASE_ADDR_LO, 0x100)
+        self._write(port, REG_PLAY_BUFFER_SIZE_LO, 32)
+        self._write(port, REG_PLAY_CMD_NUM_WORDS_LO, num_words)
+        self._write(port, REG_PLAY_WORDS_PER_PKT, 2)
+        self._write(port, REG_PLAY_CMD, command)
+
+    def test_finite(self):
+        """
+        Checking a finite play command plays the requested number of words...
+        """
+        self._play(PLAY_CMD_FINITE)
+        (port, spec, source), = self.started
+        self.assertEqual(port, 1)
+        self.assertFalse(spec.is_timed)
+        self.assertEqual(spec.packet_samples, 2 * REPLAY_WORD_SIZE)
+        self.assertEqual(bytes(source.next_payload(16)), bytes(range(0, 16)))
+        self.assertEqual(bytes(source.next_payload(16)), bytes(range(16, 24)))
+        self.assertIsNone(source.next_payload(16))
+
+    def test_no_eob(self):
+        """
+        Checking a finite play command without EOB plays like a finite one...
+        """
+        self._play(PLAY_CMD_FINITE | PLAY_CMD_NO_EOB)
+        self._play(PLAY_CMD_FINITE | PLAY_CMD_NO_EOB | PLAY_CMD_TIMED)
+        self.assertEqual(self.stopped, [1])
+        (_, spec, source) = self.started[-1]
+        self.assertTrue(spec.is_timed)
+        self.assertEqual(len(source.next_payload(32)), 3 * REPLAY_WORD_SIZE)
+        self.assertIsNone(source.next_payload(16))
+
+    def test_continuous(self):
+        """
+        Checking a continuous play command wraps around the play buffer...
+        """
+        self._play(PLAY_CMD_CONTINUOUS | PLAY_CMD_TIMED)
+        (_, spec, source), = self.started
+        self.assertTrue(spec.is_timed)
+        self.assertEqual(bytes(source.next_payload(24)), bytes(range(0, 24)))
+        self.assertEqual(bytes(source.next_payload(16)), bytes(range(24, 32)) + bytes(range(8)))
+        self.assertEqual(self._read(1, REG_PLAY_POS_LO), 0x108)
+
+    def test_stop(self):
+        """
+        Checking the stop command ends playback...
+        """
+        self._play(PLAY_CMD_CONTINUOUS)
+        self._write(1, REG_PLAY_CMD, PLAY_CMD_STOP)
+        self.assertEqual(self.stopped, [1])
+        self.assertIsNone(self.replay.ports[1].player)
+        # Stopping a port which doesn't play does nothing
+        self._write(1, REG_PLAY_CMD, PLAY_CMD_STOP)
+        self.assertEqual(self.stopped, [1])
+        with self.assertRaises(RuntimeError):
+            self._play(3)
+        self.assertEqual(len(self.started), 1)
+
+    def test_record(self):
+        """
+        Checking recording stops at the end of the record buffer...
+        """
+        self._write(0, REG_REC_BASE_ADDR_LO, 0x10)
+        self._write(0, REG_REC_BUFFER_SIZE_LO, 8)
+        self.assertEqual(self.replay.record(0, b"\xAA" * 6), 6)
+        self.assertEqual(self.replay.record(0, b"\xBB" * 6), 2)
+        self.assertEqual(bytes(self.replay.memory[0x10:0x18]), b"\xAA" * 6 + b"\xBB" * 2)
+        self.assertEqual(self._read(0, REG_REC_FULLNESS_LO), 8)
+        self._write(0, REG_REC_RESTART, 0)
+        self.assertEqual(self._read(0, REG_REC_FULLNESS_LO), 0)
+
+    def test_invalid_port(self):
+        """
+        Checking accesses to ports which don't exist are ignored...
+        """
+        self._write(2, REG_PLAY_CMD, PLAY_CMD_CONTINUOUS)
+        self.assertEqual(self._read(2, REG_REC_BASE_ADDR_LO), 0)
+        self.assertEqual(self.started, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,247 @@
+#
+# Copyright 2024 Ettus Research, a National Instruments Brand
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Tests for the RPC server
+"""
+
+import sys
+import time
+import types
+import unittest
+from unittest import mock
+import gevent
+from base_tests import TestBase
+from usrp_mpm.mpmlog import get_original
+from usrp_mpm.mpmtypes import SharedState
+from usrp_mpm.rpc_server import MPMServer, TOKEN_LEN
+from usrp_mpm.rpc_utils import cached, clear_cache, no_claim, RpcJob
+
+class _PeriphManager:
+    """
+    The parts of a periph manager which MPMServer uses. Its methods count
+    how often they ran, and wait() and tear_down() block until release is
+    set.
+    """
+    dboards = []
+    cache_invalidating_methods = ['set_gain']
+    updateable_components = {}
+    clear_rpc_registry_on_unclaim = False
+    # Set by the test, these are real threading.Event()s because jobs run
+    # in a worker thread
+    release = None
+    entered = None
+
+    def __init__(self, default_args):
+        self.default_args = default_args
+        self.claimed = False
+        self.num_calls = 0
+        self.gain = 0
+
+    def _block(self):
+        self.entered.set()
+        self.release.wait(TestRpcServer.TIMEOUT)
+
+    @cached(0)
+    def get_device_info(self):
+        " Expires immediately, so only ever cached values are stale "
+        self.num_calls += 1
+        return {'type': 'sim', 'serial': 'SIM{}'.format(self.num_calls)}
+
+    @no_claim
+    @cached(0)
+    def get_temp(self):
+        " A cached query "
+        self.num_calls += 1
+        return self.num_calls
+
+    @no_claim
+    def get_state(self):
+        " A query which isn't cached "
+        self.num_calls += 1
+        return self.num_calls
+
+    def set_gain(self, gain):
+        " A claimed call "
+        self.gain = gain
+        return gain
+
+    def fail(self):
+        " A claimed call which always fails "
+        raise ValueError("Broken")
+
+    def wait(self):
+        " A claimed call which blocks "
+        self._block()
+        return True
+
+    def tear_down(self):
+        " Blocks, so the test can call while the periph manager is reset "
+        self._block()
+
+    def clear_caches(self):
+        " Drop the cached values "
+        clear_cache(self)
+
+    def claim(self):
+        " Nothing to do "
+
+    def unclaim(self):
+        " Nothing to do "
+
+    def deinit(self):
+        " Nothing to do "
+
+    def set_connection_type(self, conn_type):
+        " Nothing to do "
+
+class TestRpcServer(TestBase):
+    """
+    Tests for MPMServer, with a fake periph manager
+    """
+    # Seconds to wait for something which should happen right away
+    TIMEOUT = 5.0
+
+    def setUp(self):
+        _PeriphManager.release = get_original('threading', 'Event')()
+        _PeriphManager.entered = get_original('threading', 'Event')()
+        self.addCleanup(_PeriphManager.release.set)
+        self.state = SharedState()
+        module = types.ModuleType('usrp_mpm.periph_manager')
+        module.periph_manager = _PeriphManager
+        with mock.patch.dict(sys.modules, {'usrp_mpm.periph_manager': module}):
+            self.server = MPMServer(self.state, {})
+        self.addCleanup(lambda: self.server._timer.kill())
+        # This looks at the network interfaces of the host
+        patcher = mock.patch('usrp_mpm.rpc_server._is_connection_local', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mgr = self.server.periph_manager
+
+    def _claim(self):
+        """ Claim the device without a session, and return the token """
+        token = b"T" * TOKEN_LEN
+        self.state.claim_token.value = token
+        self.state.claim_status.value = True
+        return token
+
+    def _wait_for(self, condition):
+        for _ in range(int(self.TIMEOUT / 0.01)):
+            if condition():
+                return
+            gevent.sleep(0.01)
+        self.fail("Timed out")
+
+    def _start_blocking_job(self, method):
+        """ Start a job which blocks until released, once it's running """
+        job_id = self.server.start_job(self._claim(), method, [])
+        self._wait_for(_PeriphManager.entered.is_set)
+        self.assertEqual(self.server.poll_job(job_id)['state'], RpcJob.RUNNING)
+        return job_id
+
+    def test_safe_calls_during_job(self):
+        """
+        Checking that safe calls don't wait for jobs...
+        """
+        num_calls = self.mgr.num_calls
+        job_id = self._start_blocking_job('wait')
+        self.assertEqual(self.server.get_temp(), num_calls + 1)
+        self.assertEqual(self.server.get_state(), num_calls + 2)
+        self.assertEqual(self.server.get_device_info()['serial'],
+                         'SIM{}'.format(num_calls + 3))
+        self.assertEqual(self.server.poll_job(job_id)['state'], RpcJob.RUNNING)
+        _PeriphManager.release.set()
+        info = self.server.wait_job(job_id, self.TIMEOUT)
+        self.assertEqual(info['state'], RpcJob.DONE)
+
+    def test_safe_calls_during_reset(self):
+        """
+        Checking that safe calls return cached values while the periph
+        manager is reset, or wait...
+        """
+        temp = self.server.get_temp()
+        num_calls = self.mgr.num_calls
+        job_id = self._start_blocking_job('reset_timer_and_mgr')
+        # Expired, but still served from the cache
+        self.assertEqual(self.server.get_temp(), temp)
+        self.assertEqual(self.server.get_device_info()['type'], 'sim')
+        self.assertEqual(self.mgr.num_calls, num_calls)
+        # Everything else waits for the new periph manager
+        gevent.spawn_later(0.1, _PeriphManager.release.set)
+        start = time.monotonic()
+        state = self.server.get_state()
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        self.assertEqual(self.server.poll_job(job_id)['state'], RpcJob.DONE)
+        self.assertIsNot(self.server.periph_manager, self.mgr)
+        self.assertEqual(state, self.server.periph_manager.num_calls)
+        self.assertEqual(self.mgr.num_calls, num_calls)
+
+    def test_multicall(self):
+        """
+        Checking that multicall runs all calls and reports errors per call...
+        """
+        token = self._claim()
+        num_calls = self.mgr.num_calls
+        results = self.server.multicall(token, [
+            ('set_gain', [3]),
+            ('fail', []),
+            ('get_state', []),
+            ('ping', ['x']),
+            ('foo', []),
+        ])
+        self.assertEqual(results[0], (True, 3))
+        self.assertEqual(results[1], (False, "Broken"))
+        self.assertEqual(results[2], (True, num_calls + 1))
+        self.assertEqual(results[3], (True, 'x'))
+        self.assertFalse(results[4][0])
+        self.assertIn("Unknown method", results[4][1])
+        self.assertEqual(self.mgr.gain, 3)
+        self.assertEqual(self.server.multicall(token, []), [])
+
+    def test_multicall_rejected(self):
+        """
+        Checking that multicall refuses private methods and nested
+        multicalls...
+        """
+        token = self._claim()
+        results = self.server.multicall(token, [
+            ('_check_token_valid', [token]),
+            ('_unclaim', []),
+            ('multicall', [token, [('set_gain', [1])]]),
+        ])
+        for success, msg in results:
+            self.assertFalse(success)
+            self.assertIn("Unknown method", msg)
+        self.assertTrue(self.state.claim_status.value)
+        self.assertEqual(self.mgr.gain, 0)
+
+    def test_multicall_token(self):
+        """
+        Checking that multicall checks the token before claimed calls...
+        """
+        token = self._claim()
+        bad_token = b"F" * TOKEN_LEN
+        with self.assertRaises(RuntimeError):
+            self.server.multicall(bad_token, [('get_state', []), ('set_gain', [1])])
+        self.assertEqual(self.mgr.gain, 0)
+        # Safe calls need no claim
+        num_calls = self.mgr.num_calls
+        self.assertEqual(self.server.multicall(bad_token, [('get_state', [])]),
+                         [(True, num_calls + 1)])
+        # The claim is released halfway through the batch
+        results = self.server.multicall(token, [
+            ('set_gain', [1]),
+            ('unclaim', []),
+            ('set_gain', [2]),
+            ('get_state', []),
+        ])
+        self.assertEqual(results[:2], [(True, 1), (True, True)])
+        self.assertEqual(results[2], (False, "Lost claim before calling `set_gain'"))
+        self.assertTrue(results[3][0])
+        self.assertEqual(self.mgr.gain, 1)
+        self.assertFalse(self.state.claim_status.value)
+
+if __name__ == '__main__':
+    unittest.main()
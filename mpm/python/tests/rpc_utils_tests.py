@@ -0,0 +1,374 @@
+#
+# Copyright 2024 Ettus Research, a National Instruments Brand
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Tests for the helpers in rpc_utils.py
+"""
+
+import logging
+import threading
+import unittest
+import gevent
+from gevent.event import Event
+from base_tests import TestBase
+from usrp_mpm.rpc_utils import RpcStats
+from usrp_mpm.rpc_utils import job_context, report_progress, JobCancelled
+from usrp_mpm.rpc_utils import disable_cancel, JobRunner, RpcJob
+from usrp_mpm.rpc_utils import cached, clear_cache, get_cache_stats, get_cached_value
+
+class TestRpcStats(TestBase):
+    """
+    Tests for RpcStats
+    """
+    def test_record(self):
+        """
+        Checking counters and histogram...
+        """
+        stats = RpcStats()
+        stats.record('get_foo', 500)
+        stats.record('get_foo', 3000)
+        stats.record('get_foo', 5000, failed=True)
+        method = stats.get_stats()['methods']['get_foo']
+        self.assertEqual(method['calls'], 3)
+        self.assertEqual(method['errors'], 1)
+        self.assertEqual(method['total_us'], 8)
+        self.assertEqual(method['mean_us'], 2)
+        self.assertEqual(method['max_us'], 5)
+        # 0.5 us falls into [0, 1), 3 us into [2, 4), 5 us into [4, 8)
+        self.assertEqual(method['histogram'], [(1, 1), (4, 1), (8, 1)])
+        self.assertEqual(method['p50_us'], 4)
+        self.assertEqual(method['p99_us'], 8)
+
+    def test_slow_call(self):
+        """
+        Checking that slow calls end up in the last bucket...
+        """
+        stats = RpcStats()
+        stats.record('init', 10 ** 13)
+        method = stats.get_stats()['methods']['init']
+        self.assertEqual(method['histogram'], [(1 << (RpcStats.NUM_BUCKETS - 1), 1)])
+
+    def test_reset(self):
+        """
+        Checking reset()...
+        """
+        stats = RpcStats()
+        stats.record('get_foo', 1000)
+        since = stats.get_stats()['since']
+        stats.reset()
+        self.assertEqual(stats.get_stats()['methods'], {})
+        self.assertGreaterEqual(stats.get_stats()['since'], since)
+
+class _FakeJob:
+    " Has the attributes of a job which report_progress() uses "
+    def __init__(self):
+        self.job_id = 1
+        self.cancel_requested = False
+        self.cancellable = True
+        self.progress = 0.0
+        self.status = ""
+
+class TestReportProgress(TestBase):
+    """
+    Tests for job_context() and report_progress()
+    """
+    def test_progress(self):
+        """
+        Checking that progress ends up in the job...
+        """
+        job = _FakeJob()
+        with job_context(job):
+            report_progress(0.5, "Halfway")
+        self.assertEqual(job.progress, 0.5)
+        self.assertEqual(job.status, "Halfway")
+        # Outside of the context, nothing happens
+        report_progress(1.0, "Done")
+        self.assertEqual(job.progress, 0.5)
+
+    def test_cancel(self):
+        """
+        Checking that cancelled jobs raise...
+        """
+        job = _FakeJob()
+        job.cancel_requested = True
+        with job_context(job):
+            with self.assertRaises(JobCancelled):
+                report_progress(0.5)
+
+    def test_disable_cancel(self):
+        """
+        Checking that jobs run on once cancelling was disabled...
+        """
+        job = _FakeJob()
+        job.cancel_requested = True
+        with job_context(job):
+            disable_cancel()
+            report_progress(0.5)
+        self.assertFalse(job.cancellable)
+        self.assertEqual(job.progress, 0.5)
+
+class TestJobRunner(TestBase):
+    """
+    Tests for running jobs with JobRunner
+    """
+    # Seconds to wait for something which should happen right away
+    TIMEOUT = 5.0
+
+    def setUp(self):
+        self.runner = JobRunner(logging.getLogger("rpc_utils_tests"))
+        self.done_jobs = []
+        # Lets the job functions wait for the test
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+
+    def _start(self, function, *args):
+        return self.runner.start("test", function, args, self.done_jobs.append)
+
+    def _wait(self, job):
+        self.assertTrue(job.done_event.wait(self.TIMEOUT))
+        return job.get_info()
+
+    def _wait_for(self, condition):
+        for _ in range(int(self.TIMEOUT / 0.01)):
+            if condition():
+                return
+            gevent.sleep(0.01)
+        self.fail("Timed out")
+
+    def _blocking_job(self, result=None):
+        report_progress(0.5, "Waiting")
+        self.release.wait(self.TIMEOUT)
+        return result
+
+    def test_poll_wait(self):
+        """
+        Checking the states, progress and result of a job...
+        """
+        job = self._start(self._blocking_job, 42)
+        self.assertEqual(self.runner.get(job.job_id).state, RpcJob.PENDING)
+        self._wait_for(lambda: job.progress == 0.5)
+        info = job.get_info()
+        self.assertEqual(info['state'], RpcJob.RUNNING)
+        self.assertEqual(info['status'], "Waiting")
+        self.assertFalse(job.done_event.wait(0.05))
+        self.release.set()
+        info = self._wait(job)
+        self.assertEqual(info['state'], RpcJob.DONE)
+        self.assertEqual(info['result'], 42)
+        self.assertEqual(self.done_jobs, [job])
+        self.assertFalse(self.runner.cancel(job.job_id))
+        with self.assertRaises(RuntimeError):
+            self.runner.get(job.job_id + 1)
+
+    def test_failure(self):
+        """
+        Checking a job which raises...
+        """
+        def fail():
+            raise ValueError("Broken")
+        info = self._wait(self._start(fail))
+        self.assertEqual(info['state'], RpcJob.FAILED)
+        self.assertEqual(info['error'], "Broken")
+
+    def test_cancel(self):
+        """
+        Checking cancelling running and pending jobs...
+        """
+        def run_until_cancelled():
+            while True:
+                report_progress(0.0)
+                self.release.wait(0.01)
+        ran = []
+        running_job = self._start(run_until_cancelled)
+        pending_job = self._start(ran.append, True)
+        self._wait_for(lambda: running_job.state == RpcJob.RUNNING)
+        self.assertTrue(self.runner.cancel(pending_job.job_id))
+        self.assertTrue(self.runner.cancel(running_job.job_id))
+        self.assertEqual(self._wait(running_job)['state'], RpcJob.CANCELLED)
+        self.assertEqual(self._wait(pending_job)['state'], RpcJob.CANCELLED)
+        self.assertEqual(ran, [])
+
+    def test_disable_cancel(self):
+        """
+        Checking that jobs can't be cancelled once they disabled it...
+        """
+        def install():
+            disable_cancel()
+            self._blocking_job()
+            report_progress(1.0, "Resetting")
+            return True
+        job = self._start(install)
+        self._wait_for(lambda: job.progress == 0.5)
+        self.assertFalse(self.runner.cancel(job.job_id))
+        self.runner.cancel_all()
+        self.release.set()
+        info = self._wait(job)
+        self.assertEqual(info['state'], RpcJob.DONE)
+        self.assertEqual(info['status'], "Resetting")
+
+    def test_calls_wait_for_jobs(self):
+        """
+        Checking that calls and jobs don't run at the same time...
+        """
+        events = []
+        def call():
+            with self.runner.call():
+                events.append("call")
+        job = self._start(self._blocking_job)
+        self._wait_for(lambda: job.progress == 0.5)
+        caller = gevent.spawn(call)
+        gevent.sleep(0.05)
+        self.assertEqual(events, [])
+        self.release.set()
+        self._wait(job)
+        caller.join(self.TIMEOUT)
+        self.assertEqual(events, ["call"])
+        # A job waits for the calls in progress
+        call_done = Event()
+        def long_call():
+            with self.runner.call():
+                call_done.wait()
+        caller = gevent.spawn(long_call)
+        gevent.sleep(0)
+        job = self._start(events.append, "job")
+        gevent.sleep(0.05)
+        self.assertEqual(job.state, RpcJob.PENDING)
+        call_done.set()
+        self.assertEqual(self._wait(job)['state'], RpcJob.DONE)
+        self.assertEqual(events, ["call", "job"])
+
+    def test_calls_without_waiting(self):
+        """
+        Checking calls which don't wait for jobs...
+        """
+        events = []
+        job = self._start(self._blocking_job)
+        self._wait_for(lambda: job.progress == 0.5)
+        self.assertTrue(self.runner.has_unfinished(["test"]))
+        self.assertFalse(self.runner.has_unfinished(["init"]))
+        with self.runner.call(wait=False):
+            events.append("call")
+        self.assertEqual(job.state, RpcJob.RUNNING)
+        self.release.set()
+        self._wait(job)
+        self.assertFalse(self.runner.has_unfinished(["test"]))
+        # They still keep jobs from starting
+        call_done = Event()
+        def long_call():
+            with self.runner.call(wait=False):
+                call_done.wait()
+        caller = gevent.spawn(long_call)
+        gevent.sleep(0)
+        job = self._start(events.append, "job")
+        gevent.sleep(0.05)
+        self.assertEqual(job.state, RpcJob.PENDING)
+        call_done.set()
+        self.assertEqual(self._wait(job)['state'], RpcJob.DONE)
+        self.assertEqual(events, ["call", "job"])
+
+class _Device:
+    " Counts how often its cached methods actually run "
+    def __init__(self):
+        self.num_calls = 0
+
+    @cached(60)
+    def get_sources(self, kind=None):
+        " Cached for a minute "
+        self.num_calls += 1
+        return [kind, self.num_calls]
+
+    @cached(60)
+    def get_clearing(self):
+        " Clears the cache while it runs, like a concurrent call would "
+        self.num_calls += 1
+        clear_cache(self)
+        return self.num_calls
+
+    @cached(0)
+    def get_state(self):
+        " Expires immediately "
+        self.num_calls += 1
+        return self.num_calls
+
+class TestCached(TestBase):
+    """
+    Tests for the @cached decorator
+    """
+    def test_hits(self):
+        """
+        Checking that cached values are returned until cleared...
+        """
+        device = _Device()
+        self.assertEqual(device.get_sources('clock'), ['clock', 1])
+        self.assertEqual(device.get_sources('clock'), ['clock', 1])
+        # Different arguments are cached separately
+        self.assertEqual(device.get_sources('time'), ['time', 2])
+        clear_cache(device)
+        self.assertEqual(device.get_sources('clock'), ['clock', 3])
+        stats = get_cache_stats(device)
+        self.assertEqual(stats['clears'], 1)
+        self.assertEqual(stats['methods']['get_sources']['hits'], 1)
+        self.assertEqual(stats['methods']['get_sources']['misses'], 3)
+
+    def test_copies(self):
+        """
+        Checking that callers can't modify cached values...
+        """
+        device = _Device()
+        device.get_sources('clock').append('modified')
+        sources = device.get_sources('clock')
+        self.assertEqual(sources, ['clock', 1])
+        sources.append('modified')
+        self.assertEqual(device.get_sources('clock'), ['clock', 1])
+
+    def test_clear_during_call(self):
+        """
+        Checking that a value computed across a clear isn't cached...
+        """
+        device = _Device()
+        self.assertEqual(device.get_clearing(), 1)
+        self.assertEqual(device.get_clearing(), 2)
+        self.assertEqual(get_cache_stats(device)['clears'], 2)
+
+    def test_get_cached_value(self):
+        """
+        Checking cached values can be looked up without calling...
+        """
+        device = _Device()
+        self.assertEqual(get_cached_value(device.get_state, ()), (False, None))
+        device.get_state()
+        # Expired, but still there
+        self.assertEqual(get_cached_value(device.get_state, ()), (True, 1))
+        self.assertEqual(get_cached_value(device.get_sources, ('clock',)), (False, None))
+        device.get_sources('clock')
+        found, sources = get_cached_value(device.get_sources, ['clock'])
+        self.assertTrue(found)
+        sources.append('modified')
+        self.assertEqual(device.get_sources('clock'), ['clock', 2])
+        self.assertEqual(device.num_calls, 2)
+        self.assertEqual(get_cached_value(device.get_sources, (['clock'],)), (False, None))
+        self.assertEqual(get_cached_value(len, ()), (False, None))
+        clear_cache(device)
+        self.assertEqual(get_cached_value(device.get_state, ()), (False, None))
+
+    def test_not_cached(self):
+        """
+        Checking calls which bypass the cache...
+        """
+        device = _Device()
+        self.assertEqual(device.get_state(), 1)
+        self.assertEqual(device.get_state(), 2)
+        # Unhashable arguments and keyword arguments
+        device.get_sources(['clock'])
+        device.get_sources(['clock'])
+        device.get_sources(kind='clock')
+        self.assertEqual(device.num_calls, 5)
+        # Caches are per object
+        self.assertEqual(get_cache_stats(_Device()), {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,6 +13,16 @@ import argparse
 from compatnum_tests import TestCompatNum
 from sys_utils_tests import TestNet
 from mpm_utils_tests import TestMpmUtils
+from rpc_utils_tests import TestRpcStats, TestReportProgress, TestCached, TestJobRunner
+from rpc_server_tests import TestRpcServer
+from discovery_tests import TestDiscovery
+from mpmlog_tests import TestLogRingBuffer, TestAsyncLogHandler
+from shadow_regs_tests import TestShadowRegs
+from sample_source_tests import TestPeriodicSource, TestMmapFile, TestLoopback
+from farm_tests import TestFarm
+from replay_tests import TestReplayBlock
+from component_upload_tests import TestComponentUpload
+from capture_tests import TestPcapRecorder
 from eeprom_tests import TestEeprom
 from x440_clock_tests import TestX440ClockConfig
 from usrp_mpm import __simulated__
@@ -25,6 +35,22 @@ TESTS = {
     '__all__': {
         TestNet,
         TestMpmUtils,
+        TestRpcStats,
+        TestReportProgress,
+        TestCached,
+        TestJobRunner,
+        TestRpcServer,
+        TestDiscovery,
+        TestLogRingBuffer,
+        TestAsyncLogHandler,
+        TestShadowRegs,
+        TestPeriodicSource,
+        TestMmapFile,
+        TestLoopback,
+        TestFarm,
+        TestReplayBlock,
+        TestComponentUpload,
+        TestPcapRecorder,
         TestEeprom,
         TestCompatNum,
         TestX440ClockConfig
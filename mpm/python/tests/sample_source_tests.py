@@ -0,0 +1,284 @@
+#
+# Copyright 2024 Ettus Research, a National Instruments Brand
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Tests for the sample sources and sinks of the simulator
+"""
+
+import os
+import tempfile
+import unittest
+import numpy as np
+from base_tests import TestBase
+from usrp_mpm.simulator.sample_source import LoopbackRing, LoopbackSink, LoopbackSource, \
+    MmapFileSink, MmapFileSource, PeriodicSource, PrbsSource, RampSource, from_words, \
+    to_sc16, to_words
+
+class _Packet:
+    """
+    Just enough of a ChdrPacket for the sample sinks
+    """
+    def __init__(self, payload):
+        self.payload = payload
+
+    def get_payload_bytes(self):
+        """ Return the payload """
+        return self.payload
+
+def _impulse(length, index, amplitude=0.5):
+    """ Return sc16 words which are zero, except for one sample """
+    samples = np.zeros(length, dtype=np.complex128)
+    samples[index] = amplitude
+    return to_words(to_sc16(samples))
+
+def _iq(payload):
+    """ Unpack a payload of sc16 words into an (N, 2) array of I/Q pairs """
+    words = np.frombuffer(payload, dtype='<u4')
+    return np.stack(((words >> 16).astype(np.uint16).view(np.int16),
+                     (words & 0xFFFF).astype(np.uint16).view(np.int16)), axis=1)
+
+class TestPeriodicSource(TestBase):
+    """
+    Tests for PeriodicSource and the waveforms derived from it
+    """
+    def test_wraparound(self):
+        """
+        Checking payloads continue the waveform across its period...
+        """
+        period = np.array([[1, -1], [2, -2], [3, -3]], dtype=np.int16)
+        source = PeriodicSource(period)
+        payload = np.concatenate([_iq(source.next_payload(size)) for size in (8, 12, 4)])
+        np.testing.assert_array_equal(payload, np.tile(period, (2, 1)))
+        # Payloads longer than the precomputed buffer
+        payload = _iq(source.next_payload(3 * 4000))
+        np.testing.assert_array_equal(payload, np.tile(period, (1000, 1)))
+        payload = _iq(source.next_payload(4))
+        np.testing.assert_array_equal(payload, period[:1])
+
+    def test_to_sc16(self):
+        """
+        Checking quantization rounds and clips to the int16 range...
+        """
+        iq = to_sc16([0.5 - 0.25j, 2 - 2j, -1.5 + 1.5j], amplitude=1.0)
+        np.testing.assert_array_equal(iq, [[16384, -8192], [32767, -32768], [-32768, 32767]])
+        iq = to_sc16([1.0], amplitude=0.5)
+        np.testing.assert_array_equal(iq, [[16384, 0]])
+        # I goes into the upper half-word
+        self.assertEqual(list(to_words(np.array([[1, -1]], dtype=np.int16))), [0x0001FFFF])
+
+    def test_prbs(self):
+        """
+        Checking the PRBS is a maximum length sequence...
+        """
+        for order in (7, 9, 11):
+            bits = PrbsSource.prbs(order)
+            self.assertEqual(len(bits), (1 << order) - 1)
+            # A maximum length sequence has one more 1 than 0
+            self.assertEqual(int(bits.sum()), 1 << (order - 1))
+            first, second = PrbsSource.TAPS[order]
+            extended = np.concatenate((bits, bits))
+            np.testing.assert_array_equal(
+                extended[first:], extended[:-first] ^ extended[first - second:-second])
+        with self.assertRaises(RuntimeError):
+            PrbsSource.prbs(8)
+        source = PrbsSource(order=7, amplitude=1.0)
+        first = _iq(source.next_payload(127 * 4))
+        second = _iq(source.next_payload(127 * 4))
+        np.testing.assert_array_equal(first, second)
+        self.assertEqual(set(np.abs(first.ravel())), {23170})
+        np.testing.assert_array_equal(first[:, 0] < 0, PrbsSource.prbs(7) == 1)
+
+    def test_ramp(self):
+        """
+        Checking the ramp counts and wraps around...
+        """
+        source = RampSource()
+        iq = _iq(source.next_payload(4 * 4))
+        np.testing.assert_array_equal(iq, [[0, -1], [1, -2], [2, -3], [3, -4]])
+        source.next_payload((32768 - 4) * 4)
+        iq = _iq(source.next_payload(2 * 4))
+        np.testing.assert_array_equal(iq, [[-32768, 32767], [-32767, 32766]])
+        source.next_payload((32768 - 2) * 4)
+        np.testing.assert_array_equal(_iq(source.next_payload(4)), [[0, -1]])
+        source = RampSource(step=3)
+        np.testing.assert_array_equal(_iq(source.next_payload(2 * 4)), [[0, -1], [3, -4]])
+
+class TestMmapFile(TestBase):
+    """
+    Tests for MmapFileSource and MmapFileSink
+    """
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = os.path.join(tmp_dir.name, "samples.dat")
+
+    def _write_file(self, data):
+        with open(self.path, "wb") as file:
+            file.write(data)
+
+    def test_source(self):
+        """
+        Checking playback stops at the end of the file...
+        """
+        self._write_file(bytes(range(10)))
+        source = MmapFileSource(self.path)
+        self.assertEqual(bytes(source.next_payload(4)), bytes(range(4)))
+        self.assertEqual(bytes(source.next_payload(4)), bytes(range(4, 8)))
+        self.assertEqual(bytes(source.next_payload(4)), bytes(range(8, 10)))
+        self.assertIsNone(source.next_payload(4))
+        source.close()
+
+    def test_source_repeat(self):
+        """
+        Checking payloads wrap around the end of the file with repeat...
+        """
+        self._write_file(bytes(range(10)))
+        source = MmapFileSource(self.path, repeat="True")
+        self.assertEqual(bytes(source.next_payload(4)), bytes(range(4)))
+        self.assertEqual(bytes(source.next_payload(4)), bytes(range(4, 8)))
+        self.assertEqual(bytes(source.next_payload(4)), bytes([8, 9, 0, 1]))
+        self.assertEqual(bytes(source.next_payload(8)), bytes([2, 3, 4, 5, 6, 7, 8, 9]))
+        # Payloads longer than the file
+        self.assertEqual(bytes(source.next_payload(25)), bytes(range(10)) * 2 + bytes(range(5)))
+        self.assertEqual(bytes(source.next_payload(2)), bytes([5, 6]))
+        source.close()
+
+    def test_source_empty(self):
+        """
+        Checking an empty file ends playback right away...
+        """
+        self._write_file(b"")
+        for repeat in (False, True):
+            source = MmapFileSource(self.path, repeat)
+            self.assertIsNone(source.next_payload(4))
+            self.assertIsNone(source.fill_packet(None, 4))
+            source.close()
+
+    def test_sink(self):
+        """
+        Checking the sink grows the file, and truncates it on close...
+        """
+        sink = MmapFileSink(self.path, chunk_size=16)
+        self.assertEqual(os.path.getsize(self.path), 16)
+        sink.write(bytes(range(10)))
+        sink.accept_packet(_Packet(bytes(range(10, 30))))
+        self.assertEqual(os.path.getsize(self.path), 32)
+        sink.write(bytes(range(30, 50)))
+        self.assertEqual(os.path.getsize(self.path), 64)
+        sink.close()
+        with open(self.path, "rb") as file:
+            self.assertEqual(file.read(), bytes(range(50)))
+
+class TestLoopback(TestBase):
+    """
+    Tests for LoopbackRing, LoopbackSink and LoopbackSource
+    """
+    def _get_loopback(self, **kwargs):
+        """
+        Return a LoopbackSink and LoopbackSource on a channel of their own
+        """
+        channel = self.id()
+        return LoopbackSink(channel), LoopbackSource(channel, **kwargs)
+
+    @staticmethod
+    def _read(source, num_samples):
+        """ Return the next num_samples samples of source as complex values """
+        return from_words(np.frombuffer(source.next_payload(num_samples * 4), dtype='<u4'))
+
+    def test_passthrough(self):
+        """
+        Checking samples pass through without impairments unchanged...
+        """
+        sink, source = self._get_loopback()
+        words = np.arange(0, 1 << 32, 1 << 20, dtype=np.uint64).astype('<u4')
+        sink.accept_packet(_Packet(words.tobytes()))
+        self.assertTrue(source.passthrough)
+        self.assertEqual(bytes(source.next_payload(len(words) * 4)), words.tobytes())
+
+    def test_integer_delay(self):
+        """
+        Checking an integer delay shifts an impulse...
+        """
+        for delay in (1, 5, 20):
+            sink, source = self._get_loopback(delay=delay)
+            sink.accept_packet(_Packet(_impulse(64, 3).tobytes()))
+            samples = self._read(source, 64)
+            self.assertEqual(np.argmax(np.abs(samples)), 3 + delay)
+            self.assertAlmostEqual(samples[3 + delay].real, 0.5, places=3)
+            samples[3 + delay] = 0
+            self.assertLess(np.max(np.abs(samples)), 1e-3)
+
+    def test_fractional_delay(self):
+        """
+        Checking a fractional delay interpolates an impulse...
+        """
+        sink, source = self._get_loopback(delay=20.5)
+        sink.accept_packet(_Packet(_impulse(64, 3).tobytes()))
+        samples = self._read(source, 64).real
+        self.assertAlmostEqual(samples[23], samples[24], places=3)
+        self.assertGreater(samples[23], 0.3)
+        # The energy is centered on the delayed position
+        centroid = np.sum(np.arange(64) * samples ** 2) / np.sum(samples ** 2)
+        self.assertAlmostEqual(centroid, 23.5, places=1)
+
+    def test_continuity(self):
+        """
+        Checking impairments continue seamlessly across packets...
+        """
+        sink, source = self._get_loopback(freq_offset=0.01)
+        sink.accept_packet(_Packet(to_words(to_sc16(np.full(128, 0.5))).tobytes()))
+        samples = np.concatenate((self._read(source, 50), self._read(source, 78)))
+        expected = 0.5 * np.exp(2j * np.pi * 0.01 * np.arange(128))
+        self.assertLess(np.max(np.abs(samples - expected)), 1e-4)
+        # An impulse near the end of one packet comes out in the next one
+        sink, source = self._get_loopback(delay=10)
+        sink.accept_packet(_Packet(_impulse(128, 60).tobytes()))
+        first = self._read(source, 64)
+        second = self._read(source, 64)
+        self.assertLess(np.max(np.abs(first)), 1e-3)
+        self.assertEqual(np.argmax(np.abs(second)), 70 - 64)
+
+    def test_iq_imbalance(self):
+        """
+        Checking IQ gain and phase imbalance...
+        """
+        sink, source = self._get_loopback(iq_gain=20 * np.log10(2))
+        sink.accept_packet(_Packet(to_words(to_sc16(np.full(16, 0.2 + 0.25j))).tobytes()))
+        samples = self._read(source, 16)
+        np.testing.assert_allclose(samples.real, 0.2, atol=1e-4)
+        np.testing.assert_allclose(samples.imag, 0.5, atol=1e-4)
+        sink, source = self._get_loopback(iq_phase=30)
+        sink.accept_packet(_Packet(to_words(to_sc16(np.full(16, 0.5 + 0.0j))).tobytes()))
+        samples = self._read(source, 16)
+        np.testing.assert_allclose(samples.real, 0.5, atol=1e-4)
+        np.testing.assert_allclose(samples.imag, -0.25, atol=1e-4)
+
+    def test_ring(self):
+        """
+        Checking the ring overwrites its oldest samples and underruns...
+        """
+        ring = LoopbackRing(8)
+        out = np.zeros(8, dtype='<u4')
+        self.assertEqual(ring.read(out), 0)
+        ring.write(np.arange(6, dtype='<u4'))
+        ring.write(np.arange(6, 12, dtype='<u4'))
+        self.assertEqual(ring.num_dropped, 4)
+        self.assertEqual(ring.read(out), 8)
+        self.assertEqual(list(out), list(range(4, 12)))
+        # More than the capacity in one go
+        ring.write(np.arange(20, dtype='<u4'))
+        self.assertEqual(ring.num_dropped, 16)
+        self.assertEqual(ring.read(out[:5]), 5)
+        self.assertEqual(list(out[:5]), list(range(12, 17)))
+        self.assertEqual(ring.read(out), 3)
+        self.assertEqual(list(out[:3]), list(range(17, 20)))
+        # A source fills the gaps with zeros
+        sink, source = self._get_loopback()
+        sink.accept_packet(_Packet(np.arange(1, 3, dtype='<u4').tobytes()))
+        words = np.frombuffer(source.next_payload(16), dtype='<u4')
+        self.assertEqual(list(words), [1, 2, 0, 0])
+
+if __name__ == '__main__':
+    unittest.main()
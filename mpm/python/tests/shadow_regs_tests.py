@@ -0,0 +1,136 @@
+#
+# Copyright 2024 Ettus Research, a National Instruments Brand
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Tests for the shadow register cache of the clock chip drivers
+"""
+
+import unittest
+from base_tests import TestBase
+from usrp_mpm.chips.shadow_regs import ShadowRegs
+
+class MockRegsIface:
+    """
+    Records register writes, and which of them were done in bulk
+    """
+    def __init__(self, fail=False):
+        self.regs = {}
+        self.writes = []
+        self.bulk_writes = []
+        self.fail = fail
+
+    def peek8(self, addr):
+        """ Read back a register """
+        return self.regs.get(addr, 0)
+
+    def poke8(self, addr, val):
+        """ Write a register """
+        if self.fail:
+            raise RuntimeError("SPI transfer failed")
+        self.regs[addr] = val
+        self.writes.append((addr, val))
+
+    def pokes8(self, addr_vals):
+        """ Write a series of registers """
+        self.bulk_writes.append(list(addr_vals))
+        for addr, val in addr_vals:
+            self.poke8(addr, val)
+
+class MockRegsIfaceNoBulk:
+    """
+    Register interface without a bulk write method
+    """
+    def __init__(self):
+        self.writes = []
+
+    def peek8(self, _addr):
+        """ Read back a register """
+        return 0
+
+    def poke8(self, addr, val):
+        """ Write a register """
+        self.writes.append((addr, val))
+
+class TestShadowRegs(TestBase):
+    """
+    Tests for ShadowRegs
+    """
+    def test_skip_unchanged(self):
+        """
+        Writes which don't change a register are skipped
+        """
+        regs_iface = MockRegsIface()
+        shadow_regs = ShadowRegs(regs_iface)
+        shadow_regs.poke(0x10, 0x01)
+        shadow_regs.poke(0x10, 0x01)
+        shadow_regs.poke(0x10, 0x02)
+        self.assertEqual(regs_iface.writes, [(0x10, 0x01), (0x10, 0x02)])
+        self.assertEqual(shadow_regs.get(0x10), 0x02)
+        self.assertIsNone(shadow_regs.get(0x11))
+        self.assertEqual(shadow_regs.get_stats(), {'writes': 2, 'skipped': 1})
+
+    def test_volatile(self):
+        """
+        Volatile registers are always written
+        """
+        regs_iface = MockRegsIface()
+        shadow_regs = ShadowRegs(regs_iface, volatile_regs=(0x143,))
+        shadow_regs.pokes(((0x143, 0x11), (0x143, 0x11), (0x144, 0xFF)))
+        shadow_regs.pokes(((0x143, 0x11), (0x144, 0xFF)))
+        self.assertEqual(regs_iface.writes, [
+            (0x143, 0x11), (0x143, 0x11), (0x144, 0xFF), (0x143, 0x11)])
+
+    def test_reset(self):
+        """
+        Writing a reset register or invalidating forgets all values
+        """
+        regs_iface = MockRegsIface()
+        shadow_regs = ShadowRegs(regs_iface, reset_regs=(0x00,))
+        shadow_regs.pokes(((0x00, 0x80), (0x00, 0x00), (0x10, 0x01)))
+        shadow_regs.pokes(((0x00, 0x80), (0x10, 0x01)))
+        self.assertEqual(regs_iface.writes, [
+            (0x00, 0x80), (0x00, 0x00), (0x10, 0x01),
+            (0x00, 0x80), (0x10, 0x01)])
+        shadow_regs.invalidate((0x11,))
+        shadow_regs.poke(0x10, 0x01)
+        self.assertEqual(len(regs_iface.writes), 5)
+        shadow_regs.invalidate((0x10,))
+        shadow_regs.poke(0x10, 0x01)
+        self.assertEqual(len(regs_iface.writes), 6)
+        shadow_regs.invalidate()
+        self.assertIsNone(shadow_regs.get(0x10))
+
+    def test_bulk(self):
+        """
+        Multiple writes go out with one bulk write, in order
+        """
+        regs_iface = MockRegsIface()
+        shadow_regs = ShadowRegs(regs_iface)
+        shadow_regs.pokes(((0x10, 0x01), (0x11, 0x02), (0x10, 0x03)))
+        shadow_regs.pokes(((0x10, 0x03), (0x12, 0x04)))
+        self.assertEqual(regs_iface.bulk_writes, [
+            [(0x10, 0x01), (0x11, 0x02), (0x10, 0x03)]])
+        self.assertEqual(regs_iface.regs, {0x10: 0x03, 0x11: 0x02, 0x12: 0x04})
+        regs_iface = MockRegsIfaceNoBulk()
+        shadow_regs = ShadowRegs(regs_iface)
+        shadow_regs.pokes(((0x10, 0x01), (0x11, 0x02)))
+        self.assertEqual(regs_iface.writes, [(0x10, 0x01), (0x11, 0x02)])
+
+    def test_failed_write(self):
+        """
+        A failed write forgets all values, so they are written again
+        """
+        regs_iface = MockRegsIface()
+        shadow_regs = ShadowRegs(regs_iface)
+        shadow_regs.poke(0x10, 0x01)
+        regs_iface.fail = True
+        with self.assertRaises(RuntimeError):
+            shadow_regs.pokes(((0x11, 0x02), (0x12, 0x03)))
+        regs_iface.fail = False
+        shadow_regs.poke(0x10, 0x01)
+        self.assertEqual(regs_iface.writes, [(0x10, 0x01), (0x10, 0x01)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,523 @@
+#
+# Copyright 2024 Ettus Research, a National Instruments Brand
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Throughput and latency benchmarks of the simulator's CHDR path
+
+A ChdrEndpoint is driven over loopback UDP by a synthetic CHDR client,
+which is built from uhd.chdr and takes UHD's place. The client sets up
+the simulated NoC core with management and control packets like UHD
+does, then measures one of:
+
+ctrl -> Round trips of control port register reads
+rx   -> Streaming from the simulator to the client (ChdrOutputStream)
+tx   -> Streaming from the client to the simulator (ChdrInputStream)
+
+Every flow control window costs one round trip: in rx mode, the client
+acknowledges a whole window at a time, so the simulator stalls until
+the client's STRS arrives. In tx mode, the simulator's STRS cadence is
+set by the client's STRC. The latency figures are these round trips.
+
+Run standalone to sweep configurations and store the results as JSON,
+which can be compared against the results of another commit:
+
+    python3 sim_benchmark.py --spp 64 256 1000 --streams 1 4 -o new.json
+    python3 sim_benchmark.py --compare old.json new.json
+
+Running it through unittest or pytest runs a few short configurations.
+"""
+
+import argparse
+import importlib.util
+import json
+import logging
+import platform
+import socket
+import subprocess
+import sys
+import time
+import unittest
+from collections import deque
+
+HAVE_UHD = importlib.util.find_spec("uhd") is not None
+if HAVE_UHD:
+    from uhd.chdr import ChdrPacket, ChdrHeader, PacketType, CtrlPayload, CtrlStatus, \
+        CtrlOpCode, MgmtPayload, MgmtHop, MgmtOp, MgmtOpCode, MgmtOpCfg, MgmtOpSelDest, \
+        StrsPayload, StrsStatus, StrcPayload, StrcOpCode
+    from usrp_mpm.mpmlog import get_main_logger
+    from usrp_mpm.simulator.async_engine import AsyncChdrEndpoint
+    from usrp_mpm.simulator.chdr_endpoint import ChdrEndpoint, CHDR_WIDTHS, CHDR_HEADER, \
+        CHDR_HEADER_PKT_TYPE_OFFSET, DATA_PKT_TYPES
+    from usrp_mpm.simulator.chdr_stream import DataPacketTemplate
+    from usrp_mpm.simulator.config import Config, HardwareDescriptor
+    from usrp_mpm.simulator.hardware_presets import presets
+    from usrp_mpm.simulator.noc_block_regs import PROTOVER_ADDR, RADIO_BASE_ADDR, \
+        REG_RX_MAX_WORDS_PER_PKT, REG_RX_CMD, RX_CMD_CONTINUOUS, RX_CMD_STOP
+    from usrp_mpm.simulator.sample_source import NullSamples
+    from usrp_mpm.simulator.stream_ep_regs import REG_EPID_SELF, REG_OSTRM_CTRL_STATUS, \
+        REG_OSTRM_DST_EPID, REG_ISTRM_CTRL_STATUS
+
+MODES = ("ctrl", "rx", "tx")
+HOST_EPID = 1
+# Stream endpoint n gets EPID SEP_EPID_BASE + n
+SEP_EPID_BASE = 2
+PROTO_VER = 0x100
+# The simulator has one control endpoint, so NoC block n sits on
+# control port 2 + n (see NocBlockRegs.block_index_from_port())
+FIRST_BLOCK_CTRL_PORT = 2
+# The cfg_start bit of the stream endpoint control/status registers
+CFG_START = 1
+# Sample rate of rx streams. It is high enough that flow control, not
+# the simulator's pacing, limits the packet rate.
+RX_RATE = 1e12
+BYTES_PER_SAMPLE = 4
+MAX_MTU = 8000
+RECV_TIMEOUT = 2.0
+
+def percentile(values, fraction):
+    """Return the nearest rank percentile of a sorted list, or None if
+    it is empty
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+def get_free_port():
+    """Return a UDP port on the loopback interface which is free right now"""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class SimClient:
+    """A minimal CHDR host, talking to a simulated device on xport 0
+
+    It configures the device's crossbar and stream endpoints with
+    management packets (see mgmt_portal.cpp in UHD) and its radios with
+    control packets. Data packets are parsed only as far as needed.
+    """
+    def __init__(self, chdr_w, port):
+        self.chdr_w = chdr_w
+        self.dest = ("127.0.0.1", port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self.sock.settimeout(RECV_TIMEOUT)
+        self.buf = bytearray(MAX_MTU)
+        self.ctrl_seq_num = 0
+        # Packets which arrived while wait_for() was looking for another type
+        self.backlog = deque()
+
+    def close(self):
+        """Close the client's socket"""
+        self.sock.close()
+
+    def send(self, packet):
+        """Send a ChdrPacket to the device"""
+        self.sock.sendto(bytes(packet.serialize()), self.dest)
+
+    def recv_into_buf(self, block=True):
+        """Receive a datagram into self.buf and return its length, or
+        None if block is False and nothing is pending
+        """
+        try:
+            return self.sock.recv_into(self.buf, 0, 0 if block else socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            return None
+        except socket.timeout:
+            raise RuntimeError("The simulator stopped responding")
+
+    def wait_for(self, pkt_type):
+        """Wait for a packet of type pkt_type and return it. Other
+        packets are kept for later calls.
+        """
+        for index, packet in enumerate(self.backlog):
+            if packet.get_header().pkt_type == pkt_type:
+                del self.backlog[index]
+                return packet
+        while True:
+            n_bytes = self.recv_into_buf()
+            packet = ChdrPacket.deserialize(self.chdr_w, bytes(self.buf[:n_bytes]))
+            if packet.get_header().pkt_type == pkt_type:
+                return packet
+            self.backlog.append(packet)
+
+    def configure_sep(self, sep, writes):
+        """Route traffic between the client and stream endpoint sep,
+        then write the (address, value) pairs in writes to its
+        registers. Waits for the device to acknowledge.
+        """
+        sep_epid = SEP_EPID_BASE + sep
+        # Crossbar port 0 is xport 0, the stream endpoints follow
+        xbar_port = 1 + sep
+        payload = MgmtPayload()
+        payload.set_header(HOST_EPID, PROTO_VER, self.chdr_w)
+        xport_hop = MgmtHop()
+        xport_hop.add_op(MgmtOp(MgmtOpCode.ADVERTISE))
+        xbar_hop = MgmtHop()
+        xbar_hop.add_op(MgmtOp(MgmtOpCode.CFG_WR_REQ, MgmtOpCfg(HOST_EPID, 0)))
+        xbar_hop.add_op(MgmtOp(MgmtOpCode.CFG_WR_REQ, MgmtOpCfg(sep_epid, xbar_port)))
+        xbar_hop.add_op(MgmtOp(MgmtOpCode.SEL_DEST, MgmtOpSelDest(xbar_port)))
+        sep_hop = MgmtHop()
+        for addr, value in [(REG_EPID_SELF, sep_epid)] + writes:
+            sep_hop.add_op(MgmtOp(MgmtOpCode.CFG_WR_REQ, MgmtOpCfg(addr, value)))
+        sep_hop.add_op(MgmtOp(MgmtOpCode.RETURN))
+        for hop in (xport_hop, xbar_hop, sep_hop):
+            payload.add_hop(hop)
+        header = ChdrHeader()
+        header.dst_epid = sep_epid
+        header.pkt_type = PacketType.MGMT
+        self.send(ChdrPacket(self.chdr_w, header, payload))
+        self.wait_for(PacketType.MGMT)
+
+    def ctrl_transaction(self, sep, port, op_code, addr, data=0):
+        """Send a control request through stream endpoint sep to a
+        control port, and return the data of the response
+        """
+        header = ChdrHeader()
+        header.dst_epid = SEP_EPID_BASE + sep
+        header.pkt_type = PacketType.CTRL
+        payload = CtrlPayload()
+        payload.dst_port = port
+        payload.src_port = 0
+        payload.seq_num = self.ctrl_seq_num
+        payload.src_epid = HOST_EPID
+        payload.address = addr
+        payload.byte_enable = 0xF
+        payload.op_code = op_code
+        payload.status = CtrlStatus.OKAY
+        payload.is_ack = False
+        payload.set_data([data])
+        self.ctrl_seq_num = (self.ctrl_seq_num + 1) & 0x3F
+        self.send(ChdrPacket(self.chdr_w, header, payload))
+        return self.wait_for(PacketType.CTRL).get_payload_ctrl().get_data()[0]
+
+    def write_radio(self, radio, reg, value):
+        """Write a register of channel 0 of a radio"""
+        self.ctrl_transaction(radio, FIRST_BLOCK_CTRL_PORT + radio, CtrlOpCode.WRITE,
+                              RADIO_BASE_ADDR + reg, value)
+
+    def send_strs(self, sep, capacity_pkts, capacity_bytes, xfer_pkts, xfer_bytes):
+        """Send a stream status to the output stream of sep"""
+        header = ChdrHeader()
+        header.dst_epid = SEP_EPID_BASE + sep
+        header.pkt_type = PacketType.STRS
+        payload = StrsPayload()
+        payload.src_epid = HOST_EPID
+        payload.status = StrsStatus.OKAY
+        payload.capacity_pkts = capacity_pkts
+        payload.capacity_bytes = capacity_bytes
+        payload.xfer_count_pkts = xfer_pkts
+        payload.xfer_count_bytes = xfer_bytes
+        self.send(ChdrPacket(self.chdr_w, header, payload))
+
+    def send_strc_init(self, sep, fc_freq_pkts, fc_freq_bytes):
+        """Initialize the flow control of the input stream of sep"""
+        header = ChdrHeader()
+        header.dst_epid = SEP_EPID_BASE + sep
+        header.pkt_type = PacketType.STRC
+        payload = StrcPayload()
+        payload.src_epid = HOST_EPID
+        payload.op_code = StrcOpCode.INIT
+        payload.num_pkts = fc_freq_pkts
+        payload.num_bytes = fc_freq_bytes
+        self.send(ChdrPacket(self.chdr_w, header, payload))
+
+class StreamState:
+    """Flow control and timing state of one stream in the client"""
+    def __init__(self, sep):
+        self.sep = sep
+        self.num_packets = 0
+        self.num_bytes = 0
+        self.acked_packets = 0
+        self.acked_bytes = 0
+        # rx: when the last STRS was sent. tx: (packet count, send time)
+        # of the packets which haven't been acknowledged yet
+        self.strs_time = None
+        self.send_times = deque()
+
+def bench_ctrl(client, num_streams, spp, duration, fc_window):
+    """Measure register read round trips"""
+    # pylint: disable=unused-argument
+    client.configure_sep(0, [])
+    latencies = []
+    start = time.perf_counter()
+    end = start + duration
+    now = start
+    while now < end:
+        sent = time.perf_counter()
+        client.ctrl_transaction(0, 0, CtrlOpCode.READ, PROTOVER_ADDR)
+        now = time.perf_counter()
+        latencies.append(now - sent)
+    return len(latencies), 0, len(latencies), latencies, now - start
+
+def bench_rx(client, num_streams, spp, duration, fc_window):
+    """Measure streaming from the simulator to the client"""
+    max_pkt_bytes = spp * BYTES_PER_SAMPLE + 64
+    capacity_bytes = fc_window * max_pkt_bytes
+    for sep in range(num_streams):
+        client.configure_sep(sep, [(REG_OSTRM_DST_EPID, HOST_EPID),
+                                   (REG_OSTRM_CTRL_STATUS, CFG_START)])
+        client.wait_for(PacketType.STRC)
+        client.send_strs(sep, fc_window, capacity_bytes, 0, 0)
+        client.write_radio(sep, REG_RX_MAX_WORDS_PER_PKT, spp)
+    streams = {SEP_EPID_BASE + sep: StreamState(sep) for sep in range(num_streams)}
+    latencies = []
+    num_fc = 0
+    for sep in range(num_streams):
+        client.write_radio(sep, REG_RX_CMD, RX_CMD_CONTINUOUS)
+    start = time.perf_counter()
+    end = start + duration
+    now = start
+    while now < end:
+        n_bytes = client.recv_into_buf()
+        now = time.perf_counter()
+        header, = CHDR_HEADER.unpack_from(client.buf)
+        if ((header >> CHDR_HEADER_PKT_TYPE_OFFSET) & 0x7) not in DATA_PKT_TYPES:
+            continue
+        stream = streams[header & 0xFFFF]
+        stream.num_packets += 1
+        stream.num_bytes += n_bytes
+        if stream.strs_time is not None:
+            latencies.append(now - stream.strs_time)
+            stream.strs_time = None
+        if stream.num_packets - stream.acked_packets >= fc_window:
+            client.send_strs(stream.sep, fc_window, capacity_bytes,
+                             stream.num_packets, stream.num_bytes)
+            stream.acked_packets = stream.num_packets
+            stream.strs_time = time.perf_counter()
+            num_fc += 1
+    elapsed = now - start
+    for sep in range(num_streams):
+        # Unblock the stream, so it sees the stop command
+        stream = streams[SEP_EPID_BASE + sep]
+        client.send_strs(sep, fc_window, capacity_bytes, stream.num_packets, stream.num_bytes)
+        client.write_radio(sep, REG_RX_CMD, RX_CMD_STOP)
+    return (sum(s.num_packets for s in streams.values()),
+            sum(s.num_bytes for s in streams.values()), num_fc, latencies, elapsed)
+
+def bench_tx(client, num_streams, spp, duration, fc_window):
+    """Measure streaming from the client to the simulator"""
+    streams = {SEP_EPID_BASE + sep: StreamState(sep) for sep in range(num_streams)}
+    templates = {epid: DataPacketTemplate(client.chdr_w, epid) for epid in streams}
+    payload = bytes(spp * BYTES_PER_SAMPLE)
+    pkt_len = len(templates[SEP_EPID_BASE].pack(0, 0)) + len(payload)
+    capacity_pkts = capacity_bytes = None
+    for sep in range(num_streams):
+        client.configure_sep(sep, [(REG_ISTRM_CTRL_STATUS, CFG_START)])
+        # The first STRS reports the simulator's buffer size. Then the
+        # window is shrunk to what fits, so the simulator never waits
+        # for more packets than the client may send.
+        client.send_strc_init(sep, fc_window, 0xFFFFFFFFFF)
+        strs = client.wait_for(PacketType.STRS).get_payload_strs()
+        capacity_pkts, capacity_bytes = strs.capacity_pkts, strs.capacity_bytes
+        if pkt_len > capacity_bytes:
+            raise RuntimeError("A {} byte packet doesn't fit into the simulator's {} byte "
+                               "buffer".format(pkt_len, capacity_bytes))
+        client.send_strc_init(sep, min(fc_window, capacity_pkts, capacity_bytes // pkt_len),
+                              0xFFFFFFFFFF)
+        client.wait_for(PacketType.STRS)
+    latencies = []
+    num_fc = 0
+    start = time.perf_counter()
+    end = start + duration
+    now = start
+    while now < end:
+        sent_any = False
+        for epid, stream in streams.items():
+            if stream.num_bytes - stream.acked_bytes + pkt_len > capacity_bytes or \
+                    stream.num_packets - stream.acked_packets >= capacity_pkts:
+                continue
+            header = templates[epid].pack(stream.num_packets & 0xFFFF, len(payload))
+            client.sock.sendmsg([header, payload], (), 0, client.dest)
+            stream.num_packets += 1
+            stream.num_bytes += pkt_len
+            stream.send_times.append((stream.num_packets, time.perf_counter()))
+            sent_any = True
+        # Block only when no stream has room left
+        n_bytes = client.recv_into_buf(block=not sent_any)
+        while n_bytes is not None:
+            now = time.perf_counter()
+            packet = ChdrPacket.deserialize(client.chdr_w, bytes(client.buf[:n_bytes]))
+            if packet.get_header().pkt_type == PacketType.STRS:
+                strs = packet.get_payload_strs()
+                stream = streams[strs.src_epid]
+                stream.acked_packets = strs.xfer_count_pkts
+                stream.acked_bytes = strs.xfer_count_bytes
+                num_fc += 1
+                while stream.send_times and stream.send_times[0][0] <= stream.acked_packets:
+                    count, sent = stream.send_times.popleft()
+                    if count == stream.acked_packets:
+                        latencies.append(now - sent)
+            n_bytes = client.recv_into_buf(block=False)
+        now = time.perf_counter()
+    return (sum(s.num_packets for s in streams.values()),
+            sum(s.num_bytes for s in streams.values()), num_fc, latencies, now - start)
+
+BENCHMARKS = {
+    "ctrl": bench_ctrl,
+    "rx": bench_rx,
+    "tx": bench_tx,
+}
+
+def run_benchmark(mode, spp=256, chdr_width=64, num_streams=1, duration=2.0,
+                  engine="threads", fc_window=32):
+    """Run one benchmark configuration against a new simulated device
+    and return its results as a dict
+    """
+    port = get_free_port()
+    hardware = HardwareDescriptor.from_dict(dict(
+        presets['E320'], serial_num="BENCH", num_channels=num_streams,
+        chdr_width=chdr_width))
+    config = Config(NullSamples, NullSamples, hardware, engine,
+                    chdr_addr="127.0.0.1", chdr_port=port)
+    log = get_main_logger(use_logbuf=False).getChild("bench")
+    endpoint_cls = AsyncChdrEndpoint if engine == "asyncio" else ChdrEndpoint
+    endpoint = endpoint_cls(log, config)
+    endpoint.set_sample_rate(RX_RATE)
+    client = SimClient(CHDR_WIDTHS[chdr_width], port)
+    try:
+        num_packets, num_bytes, num_fc, latencies, elapsed = \
+            BENCHMARKS[mode](client, num_streams, spp, duration, fc_window)
+    finally:
+        client.close()
+    latencies.sort()
+    def to_us(value):
+        return None if value is None else round(value * 1e6, 1)
+    return {
+        'mode': mode,
+        'engine': engine,
+        'chdr_width': chdr_width,
+        'spp': spp,
+        'streams': num_streams,
+        'fc_window': fc_window,
+        'duration': round(elapsed, 3),
+        'packets': num_packets,
+        'bytes': num_bytes,
+        'packets_per_sec': round(num_packets / elapsed, 1),
+        'bytes_per_sec': round(num_bytes / elapsed, 1),
+        'fc_round_trips': num_fc,
+        'latency_us': {
+            'count': len(latencies),
+            'p50': to_us(percentile(latencies, 0.5)),
+            'p99': to_us(percentile(latencies, 0.99)),
+            'max': to_us(latencies[-1] if latencies else None),
+        },
+    }
+
+def get_config_key(result):
+    """The parameters which identify a configuration in the results"""
+    return (result['mode'], result['engine'], result['chdr_width'], result['spp'],
+            result['streams'], result['fc_window'])
+
+def get_metadata():
+    """Describe what the benchmarks ran on"""
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'host': platform.node(),
+    }
+
+def compare(old_path, new_path):
+    """Print the relative change of the throughput and latency of every
+    configuration which is in both result files
+    """
+    with open(old_path) as old_file, open(new_path) as new_file:
+        old = {get_config_key(result): result for result in json.load(old_file)['results']}
+        new = json.load(new_file)['results']
+    def change(old_value, new_value):
+        if not old_value or new_value is None:
+            return "n/a"
+        return "{:+.1f}%".format((new_value - old_value) / old_value * 100)
+    for result in new:
+        key = get_config_key(result)
+        if key not in old:
+            continue
+        print("{:4} {:7} W{:<3} spp={:<5} streams={:<2} window={:<3} "
+              "pkts/s {:>12.1f} ({:>7})  p99 {:>9} us ({:>7})".format(
+                  *key, result['packets_per_sec'],
+                  change(old[key]['packets_per_sec'], result['packets_per_sec']),
+                  result['latency_us']['p99'],
+                  change(old[key]['latency_us']['p99'], result['latency_us']['p99'])))
+
+def parse_args():
+    """Parse arguments when running this as a script"""
+    parser = argparse.ArgumentParser(description="Benchmark the MPM simulator's CHDR path")
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--spp', nargs='+', type=int, default=[64, 256, 1000])
+    parser.add_argument('--chdr-width', nargs='+', type=int, default=[64])
+    parser.add_argument('--streams', nargs='+', type=int, default=[1])
+    parser.add_argument('--engine', nargs='+', choices=("threads", "asyncio"),
+                        default=["threads"])
+    parser.add_argument('--fc-window', type=int, default=32,
+                        help="Packets per flow control window")
+    parser.add_argument('--duration', type=float, default=2.0,
+                        help="Seconds per configuration")
+    parser.add_argument('-o', '--output', help="Write the results to this JSON file")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help="Compare two result files instead of running benchmarks")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="Show the simulator's log messages")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+    if not HAVE_UHD:
+        sys.exit("The benchmarks need the uhd Python module")
+    if not args.verbose:
+        get_main_logger(use_logbuf=False).setLevel(logging.WARNING)
+    results = []
+    for mode in args.modes:
+        for engine in args.engine:
+            for chdr_width in args.chdr_width:
+                for num_streams in args.streams:
+                    # spp doesn't apply to control transactions
+                    for spp in (args.spp if mode != "ctrl" else args.spp[:1]):
+                        result = run_benchmark(mode, spp, chdr_width, num_streams,
+                                               args.duration, engine, args.fc_window)
+                        print(json.dumps(result))
+                        results.append(result)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({'metadata': get_metadata(), 'results': results}, output, indent=2)
+
+@unittest.skipUnless(HAVE_UHD, "The benchmarks need the uhd Python module")
+class TestSimBenchmark(unittest.TestCase):
+    """
+    Runs every benchmark for a short time, checking that traffic flows
+    """
+    DURATION = 0.2
+
+    def check_result(self, result):
+        """Check that a benchmark moved traffic and measured latencies"""
+        self.assertGreater(result['packets'], 0)
+        self.assertGreater(result['latency_us']['count'], 0)
+        print(json.dumps(result))
+
+    def test_ctrl(self):
+        """Control transactions"""
+        self.check_result(run_benchmark("ctrl", duration=self.DURATION))
+
+    def test_rx(self):
+        """Streaming to the client, on both engines"""
+        for engine in ("threads", "asyncio"):
+            self.check_result(run_benchmark("rx", 256, num_streams=2,
+                                            duration=self.DURATION, engine=engine))
+
+    def test_tx(self):
+        """Streaming from the client"""
+        self.check_result(run_benchmark("tx", 256, duration=self.DURATION))
+
+if __name__ == "__main__":
+    main()
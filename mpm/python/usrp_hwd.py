@@ -16,6 +16,7 @@ import usrp_mpm as mpm
 import usrp_mpm.rpc_server
 import usrp_mpm.discovery
 from usrp_mpm.mpmtypes import SharedState
+from usrp_mpm.startup_profiler import startup_span, format_startup_profile
 from usrp_mpm.sys_utils import watchdog
 
 # pylint: disable=wrong-import-order
@@ -42,6 +43,12 @@ def setup_arg_parser():
         help="Do not send log messages to UHD",
         action="store_false",
     )
+    parser.add_argument(
+        '--async-logging',
+        help="Write log messages from a separate thread (see the log_async " \
+             "pref)",
+        action="store_true",
+    )
     parser.add_argument(
         '--daemon',
         help="Run as daemon",
@@ -52,6 +59,12 @@ def setup_arg_parser():
         help="Don't start the RPC server, terminate after running initialization",
         action="store_true",
     )
+    parser.add_argument(
+        '--profile-startup',
+        help="Log how long the phases of startup take, once the RPC server " \
+             "is ready (or after initialization with --init-only)",
+        action="store_true",
+    )
     parser.add_argument(
         '--override-db-pids',
         help="Provide a comma-separated list of daughterboard PIDs that are " \
@@ -60,8 +73,9 @@ def setup_arg_parser():
     )
     parser.add_argument(
         '--discovery-addr',
-        help="Bind discovery socket to this address only. Defaults to all " \
-             "addresses.",
+        help="Only answer discovery requests from the subnets of this " \
+             "address (comma-separated list, may be a broadcast address or " \
+             "a subnet in CIDR notation). Defaults to all subnets.",
         default="0.0.0.0",
     )
     parser.add_argument(
@@ -70,6 +84,26 @@ def setup_arg_parser():
              "used as defaults for device initialization.",
         default=None
     )
+    parser.add_argument(
+        '--farm',
+        help="Run this many simulated devices in one process instead of a " \
+             "single device. Only useful with the simulator.",
+        type=int,
+        default=None
+    )
+    parser.add_argument(
+        '--farm-addr',
+        help="Address of the first device of a farm. Unless --farm-port-base " \
+             "is given, every further device uses the next address.",
+        default="127.0.0.1",
+    )
+    parser.add_argument(
+        '--farm-port-base',
+        help="Run all devices of a farm on --farm-addr, telling them apart " \
+             "by port. Device n uses the ports from this one plus 16 * n on.",
+        type=int,
+        default=None
+    )
     parser.add_argument(
         '-v',
         '--verbose',
@@ -141,11 +175,13 @@ def init_only(log, default_args):
     from usrp_mpm.periph_manager import periph_manager
     log.info("Spawning periph manager...")
     ctor_time_start = time.time()
-    mgr = periph_manager(default_args)
+    with startup_span("periph_manager construction"):
+        mgr = periph_manager(default_args)
     ctor_duration = time.time() - ctor_time_start
     log.info("Ctor Duration: {:.02f} s".format(ctor_duration))
     init_time_start = time.time()
-    init_result = mgr.init(default_args)
+    with startup_span("init"):
+        init_result = mgr.init(default_args)
     init_duration = time.time() - init_time_start
     if init_result:
         log.info("Initialization successful! Duration: {:.02f} s"
@@ -153,10 +189,31 @@ def init_only(log, default_args):
     else:
         log.warning("Initialization failed! Duration: {:.02f} s"
                     .format(init_duration))
+    if default_args.get('profile_startup'):
+        log.info("Startup profile (start, duration, phase):")
+        for line in format_startup_profile():
+            log.info(line)
     log.info("Terminating on user request before launching RPC server.")
     mgr.deinit()
     return init_result
 
+def spawn_farm(log, args):
+    """
+    Launch a farm of simulated devices and hang until completion.
+    """
+    from usrp_mpm.simulator.farm import spawn_farm_process
+    log.info("Spawning farm process with %d devices...", args.farm)
+    _PROCESSES.append(spawn_farm_process(
+        args.farm, args.default_args, args.farm_addr, args.farm_port_base))
+    log.debug("Farm process has PID: %d", _PROCESSES[-1].pid)
+    Thread(target=kill_thread, daemon=False).start()
+    signal.signal(signal.SIGTERM, kill_time)
+    signal.signal(signal.SIGINT, kill_time)
+    if JOIN_PROCESSES:
+        for proc in _PROCESSES:
+            proc.join()
+    return True
+
 def spawn_processes(log, args):
     """
     Launch the subprocesses and hang until completion.
@@ -195,7 +252,8 @@ def main():
     args = parse_args()
     log = mpm.get_main_logger(
         use_logbuf=args.use_logbuf,
-        log_default_delta=args.verbose-args.quiet
+        log_default_delta=args.verbose-args.quiet,
+        use_async=args.async_logging or None
     ).getChild('main')
     version_string = mpm.__version__
     if mpm.__githash__:
@@ -205,11 +263,15 @@ def main():
         # If --init-only is provided, we force disable init during boot time so
         # we can properly time it in init_only().
         args.default_args['skip_boot_init'] = "1"
+    if args.profile_startup:
+        args.default_args['profile_startup'] = "1"
     if args.override_db_pids is not None:
         log.warning('Overriding daughterboard PIDs!')
         args.default_args['override_db_pids'] = args.override_db_pids
     if args.init_only:
         return init_only(log, args.default_args)
+    if args.farm is not None:
+        return spawn_farm(log, args)
     return spawn_processes(log, args)
 
 if __name__ == '__main__':
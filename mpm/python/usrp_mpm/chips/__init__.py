@@ -5,11 +5,30 @@
 #
 """
 Chips submodule
+
+The chip drivers are imported on first use, so a device only loads the ones
+it needs.
 """
 
-from .adf400x import ADF400x
-from .lmk04828 import LMK04828
-from .lmk04832 import LMK04832
-from .lmk03328 import LMK03328
-from .lmk05318 import LMK05318
-from . import ic_reg_maps
+import importlib
+
+# Maps the public classes of this package to the modules they live in
+_CLASS_MODULES = {
+    'ADF400x': 'adf400x',
+    'LMK04828': 'lmk04828',
+    'LMK04832': 'lmk04832',
+    'LMK03328': 'lmk03328',
+    'LMK05318': 'lmk05318',
+}
+
+def __getattr__(name):
+    """
+    Import the chip drivers on first access
+    """
+    if name == 'ic_reg_maps':
+        return importlib.import_module('.ic_reg_maps', __name__)
+    if name not in _CLASS_MODULES:
+        raise AttributeError("module {} has no attribute {}".format(__name__, name))
+    value = getattr(importlib.import_module('.' + _CLASS_MODULES[name], __name__), name)
+    globals()[name] = value
+    return value
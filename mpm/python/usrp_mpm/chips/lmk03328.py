@@ -8,12 +8,15 @@ LMK03328 parent driver class
 """
 
 from usrp_mpm.mpmlog import get_logger
+from usrp_mpm.chips.shadow_regs import ShadowRegs
 
 class LMK03328():
     """
     Generic driver class for LMK03328 access.
     """
     LMK_CHIP_ID = 0x32
+    # Register 12 holds the soft reset bit
+    RESET_REGS = (12,)
 
     def __init__(self, regs_iface, parent_log=None):
         self.log = \
@@ -22,16 +25,17 @@ class LMK03328():
         self.regs_iface = regs_iface
         assert hasattr(self.regs_iface, 'peek8')
         assert hasattr(self.regs_iface, 'poke8')
-        self.poke8 = regs_iface.poke8
+        self.shadow_regs = ShadowRegs(regs_iface, reset_regs=self.RESET_REGS)
+        self.poke8 = self.shadow_regs.poke
         self.peek8 = regs_iface.peek8
 
     def pokes8(self, addr_vals):
         """
         Apply a series of pokes.
         pokes8([(0,1),(0,2)]) is the same as calling poke8(0,1), poke8(0,2).
+        Writes which don't change a register are skipped, see ShadowRegs.
         """
-        for addr, val in addr_vals:
-            self.poke8(addr, val)
+        self.shadow_regs.pokes(addr_vals)
 
     def get_chip_id(self):
         """
@@ -9,6 +9,7 @@ LMK04832 parent driver class
 
 import time
 from usrp_mpm.mpmlog import get_logger
+from usrp_mpm.chips.shadow_regs import ShadowRegs
 
 class LMK04832:
     """
@@ -26,6 +27,13 @@ class LMK04832:
     # PLL2 Prescaler is in range from 2, 8
     PLL2_PRESCALER = range(2,9)
 
+    # Writing these does more than setting a value: SYSREF pulser, dynamic
+    # digital delay step, SYNC, PLL2 VCO calibration (PLL2_N), PLL1 R divider
+    # reset, clearing lock lost flags, SPI lock
+    VOLATILE_REGS = (0x13E, 0x142, 0x143, 0x168, 0x177, 0x182, 0x183,
+                     0x1FFD, 0x1FFE, 0x1FFF)
+    RESET_REGS = (0x000,)
+
     def __init__(self, regs_iface, parent_log=None):
         self.log = \
             parent_log.getChild("LMK04832") if parent_log is not None \
@@ -33,7 +41,9 @@ class LMK04832:
         self.regs_iface = regs_iface
         assert hasattr(self.regs_iface, 'peek8')
         assert hasattr(self.regs_iface, 'poke8')
-        self.poke8 = regs_iface.poke8
+        self.shadow_regs = ShadowRegs(
+            regs_iface, self.VOLATILE_REGS, self.RESET_REGS)
+        self.poke8 = self.shadow_regs.poke
         self.peek8 = regs_iface.peek8
         self.enable_3wire_spi = False
 
@@ -41,9 +51,9 @@ class LMK04832:
         """
         Apply a series of pokes.
         pokes8([(0,1),(0,2)]) is the same as calling poke8(0,1), poke8(0,2).
+        Writes which don't change a register are skipped, see ShadowRegs.
         """
-        for addr, val in addr_vals:
-            self.poke8(addr, val)
+        self.shadow_regs.pokes(addr_vals)
 
     def get_chip_id(self):
         """
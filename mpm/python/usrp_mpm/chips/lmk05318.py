@@ -10,6 +10,7 @@ LMK05318 parent driver class
 import time
 import datetime
 from usrp_mpm.mpmlog import get_logger
+from usrp_mpm.chips.shadow_regs import ShadowRegs
 
 class LMK05318:
     """
@@ -22,6 +23,12 @@ class LMK05318:
     LMK_EEPROM_REG_COMMIT   = "register_commit"
     LMK_EEPROM_DIRECT_WRITE = "direct_write"
 
+    # Writing DEV_CTL (0x0C) may reset the chip
+    RESET_REGS = (0x0C,)
+    # Registers with bits which must not be modified (see poke8()), and the
+    # EEPROM control registers
+    MASKED_REGS = (0x0C, 0x9D, 0xA4) + tuple(range(0x161, 0x1B3))
+
     def __init__(self, regs_iface, parent_log=None):
         self.log = \
             parent_log.getChild("LMK05318") if parent_log is not None \
@@ -29,45 +36,67 @@ class LMK05318:
         self.regs_iface = regs_iface
         assert hasattr(self.regs_iface, 'peek8')
         assert hasattr(self.regs_iface, 'poke8')
+        self.shadow_regs = ShadowRegs(
+            regs_iface, self.MASKED_REGS, self.RESET_REGS)
         self.peek8 = regs_iface.peek8
 
-    def poke8(self, addr, val, overwrite_mask=False):
+    def _apply_mask(self, addr, val):
         """
-        Write val to addr via register interface
+        Return the value to write to addr, with the masked bits set to their
+        current values
         """
         # TI LMK UserGuide chapter 9.5.5 states that some register require bit masks
         # to be applied to bits to avoid writing to them
         # mask is in the form that a 1 means that the bit shall not be modified
+        mask = None
+        if addr == 0x0C:
+            mask = 0xA7
+        elif addr == 0x9D:
+            mask = 0xFF
+        elif addr == 0xA4:
+            mask = 0xFF
+        elif addr in range(0x161, 0x1B3):
+            mask = 0xFF
+
+        if mask is not None:
+            current_val = self.peek8(addr)
+            val = val & ~mask
+            val = val | current_val
+            self.log.trace(
+                "Attention: writing to register {:02x} with masked bits, "
+                "mask 0x{:02x} was applied, resulting in value {:02x}"
+                .format(addr, mask, val))
+        return val
+
+    def poke8(self, addr, val, overwrite_mask=False):
+        """
+        Write val to addr via register interface
+        """
         # in order to write to the address without the mask applied
         # the overwrite_mask parameter can be set to True
         if not overwrite_mask:
-            mask = None
-            if addr == 0x0C:
-                mask = 0xA7
-            elif addr == 0x9D:
-                mask = 0xFF
-            elif addr == 0xA4:
-                mask = 0xFF
-            elif addr in range(0x161, 0x1B3):
-                mask = 0xFF
-
-            if mask is not None:
-                current_val = self.peek8(addr)
-                val = val & ~mask
-                val = val | current_val
-                self.log.trace(
-                    "Attention: writing to register {:02x} with masked bits, "
-                    "mask 0x{:02x} was applied, resulting in value {:02x}"
-                    .format(addr, mask, val))
-        self.regs_iface.poke8(addr, val)
+            val = self._apply_mask(addr, val)
+        self.shadow_regs.poke(addr, val)
 
     def pokes8(self, addr_vals, overwrite_mask=False):
         """
         Apply a series of pokes.
         pokes8((0,1),(0,2)) is the same as calling poke8(0,1), poke8(0,2).
-        """
+        Writes which don't change a register are skipped, see ShadowRegs.
+        """
+        if overwrite_mask:
+            self.shadow_regs.pokes(addr_vals)
+            return
+        # Masked registers are read before they are written, so all writes
+        # before them need to go out first
+        batch = []
         for addr, val in addr_vals:
-            self.poke8(addr, val, overwrite_mask)
+            if addr in self.MASKED_REGS:
+                self.shadow_regs.pokes(batch)
+                batch = []
+                val = self._apply_mask(addr, val)
+            batch.append((addr, val))
+        self.shadow_regs.pokes(batch)
 
     def get_vendor_id(self):
         """ Read back the chip's vendor ID"""
@@ -157,6 +186,7 @@ class LMK05318:
         read register cfg from eeprom and store it into registers
         """
         self.poke8(0x9D, 0x08, overwrite_mask=True)
+        self.shadow_regs.invalidate()
 
     def get_eeprom_prog_cycles(self):
         """
@@ -11,6 +11,7 @@ import math
 from builtins import object
 from usrp_mpm.mpmlog import get_logger
 from usrp_mpm.chips.ic_reg_maps import lmx2572_regs_t
+from usrp_mpm.chips.shadow_regs import ShadowRegs
 
 NUMBER_OF_LMX2572_REGISTERS = 126
 
@@ -20,6 +21,9 @@ class LMX2572(object):
     """
 
     READ_ONLY_REGISTERS = [107, 108, 109, 110, 111, 112, 113]
+    # R0 resets the chip, starts the VCO calibration and latches the double
+    # buffered registers, and it selects what MUXOUT reads back
+    VOLATILE_REGS = [0]
 
     def __init__(self, regs_iface, parent_log = None):
         self.log = parent_log
@@ -27,7 +31,8 @@ class LMX2572(object):
         self.regs_iface = regs_iface
         assert hasattr(self.regs_iface, 'peek16')
         assert hasattr(self.regs_iface, 'poke16')
-        self._poke16 = regs_iface.poke16
+        self.shadow_regs = ShadowRegs(regs_iface, self.VOLATILE_REGS, width=16)
+        self._poke16 = self.shadow_regs.poke
         self._peek16 = regs_iface.peek16
 
         self._lmx2572_regs = lmx2572_regs_t()
@@ -51,6 +56,7 @@ class LMX2572(object):
         self._lmx2572_regs = lmx2572_regs_t()
         self._lmx2572_regs.reset = lmx2572_regs_t.reset_t.RESET_RESET
         self._poke16(0, self._lmx2572_regs.get_reg(0))
+        self.shadow_regs.invalidate()
         self._lmx2572_regs.reset = lmx2572_regs_t.reset_t.RESET_NORMAL_OPERATION
         self._set_default_values()
         self._power_up_sequence()
@@ -149,9 +155,9 @@ class LMX2572(object):
         """
         Apply a series of pokes.
         pokes16((0,1),(0,2)) is the same as calling poke16(0,1), poke16(0,2).
+        Writes which don't change a register are skipped, see ShadowRegs.
         """
-        for addr, val in addr_vals:
-            self._poke16(addr, val)
+        self.shadow_regs.pokes(addr_vals)
 
     def _set_output_a_enable(self, enable_output):
         """
@@ -0,0 +1,99 @@
+#
+# Copyright 2024 Ettus Research, a National Instruments Brand
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Register access through a shadow copy of a chip's register file
+"""
+
+class ShadowRegs:
+    """
+    Writes the registers of a chip through a shadow copy of its register
+    file, which holds the last value written to every register.
+
+    A write is skipped if the shadow copy says the register already has that
+    value. Registers which were never written are unknown, writes to them
+    always go out. Registers in volatile_regs are always written, because
+    writing them has side effects (e.g., it starts a calibration or
+    generates a sync pulse). Writing one of the reset_regs is assumed to
+    reset the chip, which forgets all register values. The drivers must call
+    invalidate() when the chip gets reset or power cycled in any other way.
+    Reads always go to the chip.
+
+    pokes() sends all writes which weren't skipped with a single call to the
+    pokes8() method of the regs_iface, if it has one (the SPI regs_iface
+    then does all of them with one spidev transfer). Writes go out in the
+    order given either way.
+    """
+    def __init__(self, regs_iface, volatile_regs=(), reset_regs=(), width=8):
+        self.regs_iface = regs_iface
+        self.reset_regs = frozenset(reset_regs)
+        self.volatile_regs = frozenset(volatile_regs) | self.reset_regs
+        self.peek = getattr(regs_iface, 'peek{}'.format(width))
+        self._poke = getattr(regs_iface, 'poke{}'.format(width))
+        self._bulk_poke = getattr(regs_iface, 'pokes{}'.format(width), None)
+        self._shadow = {}
+        self.num_writes = 0
+        self.num_skipped = 0
+
+    def get(self, addr):
+        """
+        Return the value last written to addr, or None if it is not known
+        """
+        return self._shadow.get(addr)
+
+    def invalidate(self, addrs=None):
+        """
+        Forget the values of the registers in addrs (default: all of them),
+        so they will be written again
+        """
+        if addrs is None:
+            self._shadow.clear()
+        else:
+            for addr in addrs:
+                self._shadow.pop(addr, None)
+
+    def poke(self, addr, val):
+        """
+        Write val to addr, unless it already has that value
+        """
+        self.pokes(((addr, val),))
+
+    def pokes(self, addr_vals):
+        """
+        Write a series of (addr, val) pairs, skipping the ones which don't
+        change anything
+        """
+        writes = []
+        for addr, val in addr_vals:
+            if addr not in self.volatile_regs and self._shadow.get(addr) == val:
+                self.num_skipped += 1
+                continue
+            writes.append((addr, val))
+            if addr in self.reset_regs:
+                self._shadow.clear()
+            else:
+                self._shadow[addr] = val
+        if not writes:
+            return
+        try:
+            if self._bulk_poke is not None and len(writes) > 1:
+                self._bulk_poke(writes)
+            else:
+                for addr, val in writes:
+                    self._poke(addr, val)
+        except BaseException:
+            # We don't know which writes made it
+            self._shadow.clear()
+            raise
+        self.num_writes += len(writes)
+
+    def get_stats(self):
+        """
+        Return the number of register writes done and skipped
+        """
+        return {
+            'writes': self.num_writes,
+            'skipped': self.num_skipped,
+        }
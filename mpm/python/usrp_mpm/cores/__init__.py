@@ -5,7 +5,24 @@
 #
 """
 Cores submodule
+
+The cores are imported on first use, so a device only loads the ones it needs.
 """
 
-from .tdc_sync import ClockSynchronizer
-from .white_rabbit import WhiteRabbitRegsControl
+import importlib
+
+# Maps the public classes of this package to the modules they live in
+_CLASS_MODULES = {
+    'ClockSynchronizer': 'tdc_sync',
+    'WhiteRabbitRegsControl': 'white_rabbit',
+}
+
+def __getattr__(name):
+    """
+    Import the cores on first access
+    """
+    if name not in _CLASS_MODULES:
+        raise AttributeError("module {} has no attribute {}".format(__name__, name))
+    value = getattr(importlib.import_module('.' + _CLASS_MODULES[name], __name__), name)
+    globals()[name] = value
+    return value
@@ -5,21 +5,81 @@
 #
 """
 dboards module __init__.py
+
+The dboard classes are imported on first use (see __getattr__()), so a device
+only loads the modules of the daughterboards it actually has.
 """
+import importlib
 from .base import DboardManagerBase
 from usrp_mpm import __simulated__
-if not __simulated__:
-    from .magnesium import Magnesium
-    from .rhodium import Rhodium
-    from .ad936x_db import AD936xDboard
-    from .neon import Neon
-    from .e31x_db import E31x_db
-    from .empty_slot import EmptySlot
-    from .zbx import ZBX
-    from .fbx import FBX
-    from .test import test
-    from .unknown import unknown
-    from .dboard_iface import DboardIface
-    from .x4xx_db_iface import X4xxDboardIface
-    from .x4xx_debug_db import X4xxDebugDboard
-    from .x4xx_if_test_cca import X4xxIfTestCCA
+
+# Maps the public classes of this package to the modules they live in
+_CLASS_MODULES = {} if __simulated__ else {
+    'Magnesium': 'magnesium',
+    'Rhodium': 'rhodium',
+    'AD936xDboard': 'ad936x_db',
+    'Neon': 'neon',
+    'E31x_db': 'e31x_db',
+    'EmptySlot': 'empty_slot',
+    'ZBX': 'zbx',
+    'FBX': 'fbx',
+    'test': 'test',
+    'unknown': 'unknown',
+    'DboardIface': 'dboard_iface',
+    'X4xxDboardIface': 'x4xx_db_iface',
+    'X4xxDebugDboard': 'x4xx_debug_db',
+    'X4xxIfTestCCA': 'x4xx_if_test_cca',
+}
+
+# Maps dboard PIDs to their classes, so get_dboard_class() only needs to import
+# the one module. This must match the pids attributes of the classes. Classes
+# which are missing here are still found, but only after importing all of them.
+_PID_CLASSES = {
+    0x0: 'EmptySlot',
+    0x0110: 'E31x_db',
+    0x150: 'Magnesium',
+    0x152: 'Rhodium',
+    0x4001: 'X4xxDebugDboard',
+    0x4002: 'ZBX',
+    0x4006: 'X4xxIfTestCCA',
+    0x4007: 'FBX',
+    0xe320: 'Neon',
+}
+
+def __getattr__(name):
+    """
+    Import the dboard classes on first access
+    """
+    if name not in _CLASS_MODULES:
+        raise AttributeError("module {} has no attribute {}".format(__name__, name))
+    module = importlib.import_module('.' + _CLASS_MODULES[name], __name__)
+    value = getattr(module, name)
+    # Cache it, this also replaces the module attributes of the test and
+    # unknown submodules with the classes of the same name
+    globals()[name] = value
+    return value
+
+def _get_class(name):
+    value = globals().get(name)
+    # test and unknown are also submodules, which may already be imported
+    if not isinstance(value, type):
+        value = __getattr__(name)
+    return value
+
+def _is_dboard_class_for(member, pid):
+    return issubclass(member, DboardManagerBase) and \
+        pid in getattr(member, 'pids', [])
+
+def get_dboard_class(pid):
+    """
+    Return the dboard class for a PID, or None if there is none
+    """
+    if pid in _PID_CLASSES:
+        db_class = _get_class(_PID_CLASSES[pid])
+        if _is_dboard_class_for(db_class, pid):
+            return db_class
+    for name in _CLASS_MODULES:
+        db_class = _get_class(name)
+        if _is_dboard_class_for(db_class, pid):
+            return db_class
+    return None
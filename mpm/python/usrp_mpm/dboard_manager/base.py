@@ -7,8 +7,10 @@
 dboard base implementation module
 """
 
+from contextlib import contextmanager
 from usrp_mpm.mpmlog import get_logger
 from usrp_mpm.mpmutils import to_native_str
+from usrp_mpm.rpc_utils import cached
 
 class DboardManagerBase:
     """
@@ -38,6 +40,15 @@ class DboardManagerBase:
     # also be used to amend already existing updateable components, such as the
     # FPGA.
     updateable_components = {}
+    # Set this to True if the constructors of daughterboards in different
+    # slots may run concurrently (see the parallel_db_init arg of
+    # PeriphManagerBase). Constructors of other classes run one at a time.
+    parallel_init_safe = False
+    # Resources which the constructors of daughterboards in different slots
+    # share, like an I2C device on a board that's shared between slots. When
+    # constructing in parallel, every name in here gets a lock, which the
+    # constructor holds while it uses the resource, see _shared_resource().
+    shared_init_resources = ()
     ### End of overridables #################################################
 
     def __init__(self, slot_idx, **kwargs):
@@ -57,7 +68,21 @@ class DboardManagerBase:
             self.spi_chipselect
         )
         self.log.debug("spidev device node map: {}".format(self._spi_nodes))
+        self._init_locks = kwargs.get('init_locks', {})
 
+    @contextmanager
+    def _shared_resource(self, name):
+        """
+        Hold the lock of a resource listed in shared_init_resources, if the
+        periph manager provided one (that is, if daughterboards are being
+        constructed in parallel).
+        """
+        lock = self._init_locks.get(name)
+        if lock is None:
+            yield
+            return
+        with lock:
+            yield
 
     def _init_spi_nodes(self, spi_devices, chip_select_map):
         """
@@ -166,6 +191,7 @@ class DboardManagerBase:
     ##########################################################################
     # Sensors
     ##########################################################################
+    @cached(10.0)
     def get_sensors(self, direction, chan=0):
         """
         Return a list of RX daughterboard sensor names.
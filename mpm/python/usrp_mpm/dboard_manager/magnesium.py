@@ -111,6 +111,8 @@ class Magnesium(BfrfsEEPROM, DboardManagerBase):
         },
     }
     default_master_clock_rate = 125e6
+    # Every slot has its own SPI bus, I2C channel, and C++ driver instance
+    parallel_init_safe = True
     default_time_source = 'internal'
     default_current_jesd_rate = 2500e6
 
@@ -166,6 +166,10 @@ class Rhodium(BfrfsEEPROM, DboardManagerBase):
         },
     }
     default_master_clock_rate = 245.76e6
+    # Every slot has its own SPI bus and I2C channel. The LO distribution
+    # board is shared, though.
+    parallel_init_safe = True
+    shared_init_resources = ('lo_dist',)
     default_time_source = 'internal'
     default_current_jesd_rate = 4915.2e6
 
@@ -243,11 +247,12 @@ class Rhodium(BfrfsEEPROM, DboardManagerBase):
             }
         self._port_expander = TCA6408(_get_i2c_dev())
         self._daughterboard_gpio = FPGAtoDbGPIO(self.slot_idx)
-        if FPGAtoLoDist.lo_dist_present(_get_i2c_dev()):
-            self.log.info("Enabling LO distribution board")
-            self._lo_dist = FPGAtoLoDist(_get_i2c_dev())
-        else:
-            self.log.debug("No LO distribution board detected")
+        with self._shared_resource('lo_dist'):
+            if FPGAtoLoDist.lo_dist_present(_get_i2c_dev()):
+                self.log.info("Enabling LO distribution board")
+                self._lo_dist = FPGAtoLoDist(_get_i2c_dev())
+            else:
+                self.log.debug("No LO distribution board detected")
         self.log.debug("Turning on Module and RF power supplies")
         self._power_on()
         BfrfsEEPROM.__init__(self)
@@ -38,6 +38,8 @@ class ZBX(X4xxDbMixin, DboardManagerBase):
         'rfdc_rate': 'get_rfdc_rate_sensor',
     }
     has_db_flash = True
+    # The CPLD of every slot has its own ctrlport interface
+    parallel_init_safe = True
     # ZBX depends on two types of RF core implementations which each have
     # compat versions.
     updateable_components = {
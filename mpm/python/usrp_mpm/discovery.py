@@ -7,6 +7,8 @@
 Code to run the discovery port
 """
 
+import ipaddress
+import time
 from multiprocessing import Process
 import socket
 from usrp_mpm.mpmtypes import MPM_DISCOVERY_PORT
@@ -22,6 +24,15 @@ MAX_SOCK_BUFSIZ = 9000
 # For setsockopt
 IP_MTU_DISCOVER = 10
 IP_PMTUDISC_DO = 2
+# Number of datagrams which are read from the socket before any of them are
+# answered
+RECV_BATCH_SIZE = 64
+# Every source may get this many discovery responses per second, with bursts
+# of up to RATE_LIMIT_BURST responses. Requests beyond that are ignored.
+RATE_LIMIT = 10
+RATE_LIMIT_BURST = 20
+# Rate limiting state is kept for at most this many sources
+MAX_RATE_LIMITED_SOURCES = 1024
 
 def spawn_discovery_process(shared_state, discovery_addr):
     """
@@ -40,57 +51,204 @@ def spawn_discovery_process(shared_state, discovery_addr):
     return proc
 
 
+def create_response_string(state):
+    " Generate the string that gets sent back to the requester. "
+    return RESPONSE_SEP.join(
+        [RESPONSE_PREAMBLE] + \
+        [b"type="+state.dev_type.value] + \
+        [b"product="+state.dev_product.value] + \
+        [b"serial="+state.dev_serial.value] + \
+        [b"name="+state.dev_name.value] + \
+        [b"fpga="+state.dev_fpga_type.value] + \
+        [RESPONSE_CLAIMED_KEY+to_binary_str("={}".format(state.claim_status.value))]
+    )
+
+def get_discovery_networks(discovery_addr, local_networks):
+    """
+    Return the list of networks (ipaddress.IPv4Network) from which discovery
+    requests are answered, or None if requests from anywhere are answered.
+
+    Arguments:
+    discovery_addr -- Comma-separated list of addresses. Every entry selects
+                      the subnets of the local interfaces which contain it,
+                      so it can be the address of an interface or the
+                      broadcast address of its subnet. 0.0.0.0 selects all
+                      subnets. Entries in CIDR notation (192.168.10.0/24)
+                      select that subnet.
+    local_networks -- List of ipaddress.IPv4Interface of the local interfaces
+    """
+    networks = []
+    for entry in discovery_addr.split(','):
+        entry = entry.strip()
+        if '/' in entry:
+            networks.append(ipaddress.IPv4Network(entry, strict=False))
+            continue
+        addr = ipaddress.IPv4Address(entry)
+        if addr.is_unspecified:
+            return None
+        matches = [iface.network for iface in local_networks
+                   if addr in iface.network]
+        if not matches:
+            # No interface is up on this subnet (yet). Assume a /24, which is
+            # what discovery used to match.
+            matches = [ipaddress.IPv4Network("{}/24".format(addr), strict=False)]
+        networks.extend(matches)
+    return list(set(networks))
+
+class DiscoveryResponder:
+    """
+    Answers discovery and echo requests.
+
+    The discovery response is only regenerated when the shared state
+    changes, otherwise the cached bytes are sent. Discovery responses are
+    rate limited per source address (see RATE_LIMIT), echo requests are
+    not, because UHD uses them to probe the MTU and needs every one of them
+    answered. Requests from outside of the discovery networks are ignored.
+    """
+    def __init__(self, state, log, networks=None):
+        self.state = state
+        self.log = log
+        self.networks = networks
+        self._response = None
+        self._generation = None
+        # Maps a source address to (tokens, time of last refill)
+        self._buckets = {}
+        self.num_responses = 0
+        self.num_rate_limited = 0
+        self.num_ignored = 0
+
+    def get_response(self):
+        """
+        Return the discovery response for the current shared state
+        """
+        generation = self.state.generation.value
+        if generation != self._generation:
+            with self.state.lock:
+                self._generation = self.state.generation.value
+                self._response = create_response_string(self.state)
+            self.log.trace("New discovery response: %s", self._response)
+        return self._response
+
+    def is_allowed(self, sender_addr):
+        """
+        Returns True if requests from sender_addr are answered
+        """
+        if self.networks is None:
+            return True
+        sender_addr = ipaddress.IPv4Address(sender_addr)
+        return any(sender_addr in network for network in self.networks)
+
+    def _take_token(self, sender_addr, now):
+        """
+        Returns True if sender_addr may get another response
+        """
+        tokens, last = self._buckets.get(sender_addr, (RATE_LIMIT_BURST, now))
+        tokens = min(RATE_LIMIT_BURST, tokens + (now - last) * RATE_LIMIT)
+        if tokens < 1:
+            self._buckets[sender_addr] = (tokens, now)
+            return False
+        if sender_addr not in self._buckets \
+                and len(self._buckets) >= MAX_RATE_LIMITED_SOURCES:
+            # Sources whose buckets are full again need no state
+            self._buckets = {
+                addr: (bucket_tokens, bucket_last)
+                for addr, (bucket_tokens, bucket_last) in self._buckets.items()
+                if bucket_tokens + (now - bucket_last) * RATE_LIMIT < RATE_LIMIT_BURST
+            }
+        self._buckets[sender_addr] = (tokens - 1, now)
+        return True
+
+    def handle_batch(self, sock, batch):
+        """
+        Answer a batch of (data, sender) requests which were received on
+        sock. Repeated discovery requests from one sender within a batch
+        only get one response.
+        """
+        now = time.monotonic()
+        answered = set()
+        for data, sender in batch:
+            if not self.is_allowed(sender[0]):
+                self.num_ignored += 1
+                continue
+            if data.strip(b"\0") == b"MPM-DISC":
+                if sender in answered:
+                    continue
+                answered.add(sender)
+                if not self._take_token(sender[0], now):
+                    self.num_rate_limited += 1
+                    continue
+                self.log.debug("Sending discovery response to %s port: %d",
+                               sender[0], sender[1])
+                self._send(sock, self.get_response(), sender)
+            elif data.startswith(b"MPM-ECHO"):
+                self.log.debug("Received echo request ({len} bytes) from {sender}"
+                               .format(len=len(data), sender=sender[0]))
+                self._send(sock, data, sender)
+
+    def handle_request(self, sock, data, sender):
+        """
+        Answer a discovery or echo request which was received on sock.
+        """
+        self.handle_batch(sock, [(data, sender)])
+
+    def _send(self, sock, data, sender):
+        try:
+            sock.sendto(data, sender)
+            self.num_responses += 1
+        except OSError as ex:
+            self.log.debug("Send error to %s: %s", sender[0], str(ex))
+
+def recv_batch(sock, buf):
+    """
+    Wait for a datagram on sock, then also read the ones which are already
+    queued, up to RECV_BATCH_SIZE. buf must be a bytearray of at least
+    MAX_SOCK_BUFSIZ bytes. Returns a list of (data, sender).
+    """
+    view = memoryview(buf)
+    nbytes, sender = sock.recvfrom_into(buf)
+    batch = [(bytes(view[:nbytes]), sender)]
+    # The queued datagrams are read with a timeout of 0 rather than with
+    # MSG_DONTWAIT: A gevent socket waits for the next datagram instead of
+    # raising if there is none, unless its timeout is 0.
+    timeout = sock.gettimeout()
+    sock.settimeout(0)
+    try:
+        while len(batch) < RECV_BATCH_SIZE:
+            try:
+                nbytes, sender = sock.recvfrom_into(buf)
+            except BlockingIOError:
+                break
+            batch.append((bytes(view[:nbytes]), sender))
+    finally:
+        sock.settimeout(timeout)
+    return batch
+
 def _discovery_process(state, discovery_addr):
     """
     The actual process for device discovery. Is spawned by
     spawn_discovery_process().
     """
     log = get_main_logger().getChild('discovery')
-    def create_response_string(state):
-        " Generate the string that gets sent back to the requester. "
-        return RESPONSE_SEP.join(
-            [RESPONSE_PREAMBLE] + \
-            [b"type="+state.dev_type.value] + \
-            [b"product="+state.dev_product.value] + \
-            [b"serial="+state.dev_serial.value] + \
-            [b"name="+state.dev_name.value] + \
-            [b"fpga="+state.dev_fpga_type.value] + \
-            [RESPONSE_CLAIMED_KEY+to_binary_str("={}".format(state.claim_status.value))]
-        )
 
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    # FIXME really, we should only bind to the subnet but I haven't gotten that
-    # working yet
+    # Bind to all addresses, otherwise we won't see broadcast requests.
+    # Requests from other subnets are filtered by the responder.
     sock.bind((("0.0.0.0", MPM_DISCOVERY_PORT)))
     sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
 
-    # TODO yeah I know that's not how you do this
-    discovery_addr_prefix = discovery_addr.replace('.255', '')
-    if discovery_addr == '0.0.0.0':
-        discovery_addr_prefix = ''
+    from usrp_mpm.sys_utils.net import get_local_ip_networks
+    networks = get_discovery_networks(discovery_addr, get_local_ip_networks())
+    if networks is not None:
+        log.debug("Answering discovery requests from: %s",
+                  ", ".join(str(network) for network in networks))
+    responder = DiscoveryResponder(state, log, networks)
+    buf = bytearray(MAX_SOCK_BUFSIZ)
 
     try:
         while True:
-            data, sender = sock.recvfrom(MAX_SOCK_BUFSIZ)
-            log.debug("Got poked by: %s", sender[0])
-            # TODO this is still part of the awful subnet identification
-            if not sender[0].startswith(discovery_addr_prefix):
-                continue
-            if data.strip(b"\0") == b"MPM-DISC":
-                log.debug("Sending discovery response to %s port: %d",
-                          sender[0], sender[1])
-                resp_str = create_response_string(state)
-                send_data = resp_str
-                log.trace("Return data: %s", send_data)
-                sock.sendto(send_data, sender)
-            elif data.startswith(b"MPM-ECHO"):
-                log.debug("Received echo request ({len} bytes) from {sender}"
-                          .format(len=len(data), sender=sender[0]))
-                send_data = data
-                try:
-                    sock.sendto(send_data, sender)
-                except OSError as ex:
-                    log.debug("ECHO send error: %s", str(ex))
+            batch = recv_batch(sock, buf)
+            log.trace("Got poked %d times", len(batch))
+            responder.handle_batch(sock, batch)
     except Exception as err:
         log.error("Unexpected error: `%s' Type: `%s'", str(err), type(err))
         sock.close()
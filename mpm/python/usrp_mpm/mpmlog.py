@@ -9,10 +9,14 @@ MPM Logging
 
 from __future__ import print_function
 import copy
+import importlib
 import logging
+import os
+import sys
+import weakref
 from logging import CRITICAL, ERROR, WARNING, INFO, DEBUG
-from logging import handlers
 import collections
+import itertools
 from builtins import str
 
 # Colors
@@ -55,16 +59,224 @@ class ColorStreamHandler(logging.StreamHandler):
         record_.msg = BOLD + color + str(record_.msg) + RESET
         logging.StreamHandler.emit(self, record_)
 
-class LossyQueueHandler(handlers.QueueHandler):
+class LogRingBuffer(logging.Handler):
     """
-    Like QueueHandler, except it'll try and keep the youngest, not oldest,
-    entries.
+    Keeps the most recent log records in a ring buffer and numbers them.
+
+    Reading doesn't remove records, so any number of readers can follow the
+    log, each with their own cursor (the sequence number of the next record
+    they want, see get_records()). Records are stored as compact tuples
+    (seq, created, levelno, name, message), the message is formatted only
+    once.
+    """
+    def __init__(self, maxlen):
+        logging.Handler.__init__(self)
+        self._buf = collections.deque(maxlen=maxlen)
+        # Sequence number of the next record
+        self._next_seq = 0
+
+    def emit(self, record):
+        """
+        Store record. Called with the handler lock held.
+        """
+        try:
+            message = record.getMessage()
+        except Exception: # pylint: disable=broad-except
+            self.handleError(record)
+            return
+        self._buf.append(
+            (self._next_seq, record.created, record.levelno, record.name, message))
+        self._next_seq += 1
+
+    def get_records(self, since_seq=0, max_records=None, min_level=0):
+        """
+        Return a tuple (records, next_seq, lost):
+        - records: The stored records with a sequence number of since_seq or
+          higher and a level of min_level or higher, oldest first, at most
+          max_records of them.
+        - next_seq: Pass this as since_seq for the next call.
+        - lost: Number of records since since_seq which were overwritten
+          before they could be read.
+        """
+        with self.lock:
+            first_seq = self._next_seq - len(self._buf)
+            lost = max(first_seq - since_seq, 0)
+            start = min(max(since_seq - first_seq, 0), len(self._buf))
+            records = itertools.islice(self._buf, start, None)
+            if min_level:
+                records = (record for record in records if record[2] >= min_level)
+            records = list(itertools.islice(records, max_records))
+            if max_records is None or len(records) < max_records:
+                next_seq = self._next_seq
+            elif records:
+                next_seq = records[-1][0] + 1
+            else:
+                next_seq = max(since_seq, first_seq)
+        return records, next_seq, lost
+
+def get_original(module_name, item_name):
+    """
+    Return module_name.item_name as it was before gevent's monkey patching,
+    if any. E.g., a function which starts a thread instead of a greenlet.
     """
-    def enqueue(self, record):
+    if 'gevent.monkey' in sys.modules:
+        from gevent import monkey
+        return monkey.get_original(module_name, item_name)
+    return getattr(importlib.import_module(module_name), item_name)
+
+class AsyncLogHandler(logging.Handler):
+    """
+    Passes records on to other handlers from a writer thread.
+
+    Logging then only costs the calling thread the creation of the record
+    and the merging of its arguments into the message (like
+    logging.handlers.QueueHandler.prepare() does, so later changes to the
+    arguments don't show up in the log). The formatting and I/O of all the
+    handlers happen in the writer thread. If the writer falls more than
+    max_pending records behind, new records are dropped and counted, and
+    the writer logs how many once it catches up.
+
+    This is like logging.handlers.QueueListener, but the writer is a real
+    thread even when gevent has monkey patched threading and queue (as it
+    does in the RPC server process), and it gets restarted in processes
+    forked from this one. The writer blocks on a queue.SimpleQueue from
+    before the monkey patching, which is implemented in C with real locks.
+    close() (which logging.shutdown() calls, too) writes the queued records
+    and stops the writer.
+    """
+    # How long flush() and close() wait for the writer to catch up
+    FLUSH_TIMEOUT = 1.0
+
+    def __init__(self, handlers, max_pending):
+        logging.Handler.__init__(self)
+        self.handlers = handlers
+        self.max_pending = max_pending
+        self.num_dropped = 0
+        self._num_reported = 0
+        self._queue_type = get_original('queue', 'SimpleQueue')
+        self._allocate_lock = get_original('_thread', 'allocate_lock')
+        # The handlers are only called from the writer thread, so they need
+        # a lock which works across real threads
+        for handler in handlers:
+            handler.lock = get_original('threading', 'RLock')()
+        self._pending = None
+        self._stopped = None
+        self._start_writer()
+        _ASYNC_HANDLERS.add(self)
+
+    def handle(self, record):
+        """
+        Queue record. Unlike logging.Handler.handle(), this takes no lock.
+        """
+        if self.filter(record):
+            self.emit(record)
+            return True
+        return False
+
+    def emit(self, record):
+        """
+        Queue record, or count it as dropped if the queue is full
         """
-        Replaces logging.handlers.QueueHandler.enqueue()
+        if self._stopped is None:
+            return
+        if self._pending.qsize() >= self.max_pending:
+            self.num_dropped += 1
+            return
+        try:
+            self._pending.put(self.prepare(record))
+        except Exception: # pylint: disable=broad-except
+            self.handleError(record)
+
+    def prepare(self, record):
+        """
+        Return a copy of record with its arguments merged into the message,
+        and its exception (if any) formatted
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def flush(self):
+        """
+        Wait (for a bit) until the writer has written all queued records
         """
-        self.queue.appendleft(record)
+        if self._stopped is not None:
+            marker = self._allocate_lock()
+            marker.acquire()
+            self._pending.put(marker)
+            marker.acquire(timeout=self.FLUSH_TIMEOUT)
+        for handler in self.handlers:
+            handler.flush()
+
+    def close(self):
+        """
+        Write the queued records, and stop the writer thread
+        """
+        stopped, self._stopped = self._stopped, None
+        if stopped is not None:
+            _ASYNC_HANDLERS.discard(self)
+            self._pending.put(None)
+            stopped.acquire(timeout=self.FLUSH_TIMEOUT)
+        logging.Handler.close(self)
+
+    def _start_writer(self):
+        self._pending = self._queue_type()
+        # Held by the writer thread until it stops
+        self._stopped = self._allocate_lock()
+        self._stopped.acquire()
+        get_original('_thread', 'start_new_thread')(
+            self._writer_worker, (self._pending, self._stopped))
+
+    def _after_fork(self):
+        # The parent writes whatever it queued, and its writer thread
+        # doesn't exist in the child
+        self._start_writer()
+
+    def _writer_worker(self, pending, stopped):
+        while True:
+            record = pending.get()
+            if record is None:
+                break
+            if isinstance(record, logging.LogRecord):
+                self._write_record(record)
+            if self.num_dropped != self._num_reported and pending.empty():
+                self._report_dropped()
+            if not isinstance(record, logging.LogRecord):
+                # A marker lock from flush()
+                record.release()
+        if self.num_dropped != self._num_reported:
+            self._report_dropped()
+        stopped.release()
+
+    def _write_record(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _report_dropped(self):
+        num_dropped = self.num_dropped
+        self._write_record(logging.makeLogRecord({
+            'name': LOGGER.name if LOGGER is not None else 'MPM',
+            'levelno': WARNING,
+            'levelname': logging.getLevelName(WARNING),
+            'msg': "Log queue overrun: dropped %d log records",
+            'args': (num_dropped - self._num_reported,),
+        }))
+        self._num_reported = num_dropped
+
+# The AsyncLogHandlers which are running, to restart their writers in forked
+# processes
+_ASYNC_HANDLERS = weakref.WeakSet()
+
+def _restart_async_handlers():
+    for handler in list(_ASYNC_HANDLERS):
+        handler._after_fork() # pylint: disable=protected-access
+
+os.register_at_fork(after_in_child=_restart_async_handlers)
 
 class MPMLogger(logging.getLoggerClass()):
     """
@@ -79,34 +291,26 @@ class MPMLogger(logging.getLoggerClass()):
         except ImportError:
             pass
         from usrp_mpm import prefs
-        self.py_log_buf = collections.deque(
-            maxlen=prefs.get_prefs().getint('mpm', 'log_buf_size')
+        self.py_log_buf = LogRingBuffer(
+            prefs.get_prefs().getint('mpm', 'log_buf_size')
         )
 
     def trace(self, *args, **kwargs):
         """ Extends logging for super-high verbosity """
         self.log(TRACE, *args, **kwargs)
 
-    def get_log_buf(self):
+    def get_log_buf(self, since_seq=0, max_records=None, min_level=0):
         """
-        Return the contents of the logging queue, formatted as a list of
-        dictionaries.
+        Return the log records since since_seq without removing them from
+        the log buffer. min_level may be a level number or name (e.g.
+        'WARNING'). See LogRingBuffer.get_records() for details.
         """
-        records = []
-        # Note: This loop does not guarantee that all log items will be
-        # returned. The while loop is set up to be bounded, and to return as
-        # soon as is sensible.
-        while len(records) < self.py_log_buf.maxlen:
-            try:
-                records.append(self.py_log_buf.pop())
-            except IndexError:
-                break
-        return [{
-            'name': record.name,
-            'message': record.message,
-            'levelname': record.levelname,
-            'msecs': int(record.msecs),
-        } for record in records]
+        if isinstance(min_level, str):
+            level_name = min_level
+            min_level = logging.getLevelName(level_name.upper())
+            if not isinstance(min_level, int):
+                raise ValueError("Invalid log level: {}".format(level_name))
+        return self.py_log_buf.get_records(since_seq, max_records, min_level)
 
 
 LOGGER = None # Logger singleton
@@ -115,11 +319,15 @@ def get_main_logger(
         use_journal=False,
         use_logbuf=True,
         console_color=True,
-        log_default_delta=0
+        log_default_delta=0,
+        use_async=None
     ):
     """
     Returns the top-level logger object. This is the only API call from this
     file that should be used outside.
+
+    With use_async, all handlers run in a writer thread (see
+    AsyncLogHandler). If it's None, the log_async pref decides.
     """
     global LOGGER
     if LOGGER is not None:
@@ -127,23 +335,31 @@ def get_main_logger(
     logging.addLevelName(TRACE, 'TRACE')
     logging.setLoggerClass(MPMLogger)
     LOGGER = logging.getLogger('MPM')
+    from usrp_mpm import prefs
+    mpm_prefs = prefs.get_prefs()
+    log_handlers = []
     if use_console:
         console_handler = ColorStreamHandler() if console_color else logging.StreamHandler()
         console_formatter = logging.Formatter("[%(name)s] [%(levelname)s] %(message)s")
         console_handler.setFormatter(console_formatter)
-        LOGGER.addHandler(console_handler)
+        log_handlers.append(console_handler)
     if use_journal:
         from systemd.journal import JournalHandler
         journal_handler = JournalHandler(SYSLOG_IDENTIFIER='usrp_hwd')
         journal_formatter = logging.Formatter('[%(levelname)s] [%(module)s] %(message)s')
         journal_handler.setFormatter(journal_formatter)
-        LOGGER.addHandler(journal_handler)
+        log_handlers.append(journal_handler)
     if use_logbuf:
-        queue_handler = LossyQueueHandler(LOGGER.py_log_buf)
-        LOGGER.addHandler(queue_handler)
+        log_handlers.append(LOGGER.py_log_buf)
+    if use_async is None:
+        use_async = mpm_prefs.getboolean('mpm', 'log_async')
+    if use_async:
+        LOGGER.addHandler(AsyncLogHandler(
+            log_handlers, mpm_prefs.getint('mpm', 'log_queue_size')))
+    else:
+        for handler in log_handlers:
+            LOGGER.addHandler(handler)
     # Set default level:
-    from usrp_mpm import prefs
-    mpm_prefs = prefs.get_prefs()
     default_log_level = int(min(
         mpm_prefs.get_log_level() - log_default_delta * 10,
         CRITICAL
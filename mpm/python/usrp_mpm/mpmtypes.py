@@ -32,3 +32,13 @@ class SharedState:
         self.dev_name = Array(ctypes.c_char, 21, lock=self.lock)
         self.dev_product = Array(ctypes.c_char, 16, lock=self.lock)
         self.dev_fpga_type = Array(ctypes.c_char, 8, lock=self.lock)
+        # Incremented on every change of the values above, so readers can
+        # tell if their copy is stale without comparing all the values
+        self.generation = Value(ctypes.c_uint32, 0, lock=self.lock)
+
+    def changed(self):
+        """
+        Call this after changing any of the values
+        """
+        with self.lock:
+            self.generation.value = (self.generation.value + 1) & 0xFFFFFFFF
@@ -272,15 +272,7 @@ def get_dboard_class_from_pid(pid):
     Given a PID, return a dboard class initializer callable.
     """
     from usrp_mpm import dboard_manager
-    for member in dboard_manager.__dict__.values():
-        try:
-            if issubclass(member, dboard_manager.DboardManagerBase) and \
-                    hasattr(member, 'pids') and \
-                    pid in member.pids:
-                return member
-        except (TypeError, AttributeError):
-            continue
-    return None
+    return dboard_manager.get_dboard_class(pid)
 
 # pylint: disable=too-few-public-methods
 class LogWrapper:
@@ -9,8 +9,9 @@ Mboard implementation base class
 """
 
 import os
+import threading
 from enum import Enum
-from hashlib import md5
+from hashlib import md5, sha256
 from time import sleep
 from concurrent import futures
 from usrp_mpm.mpmlog import get_logger
@@ -22,10 +23,132 @@ from usrp_mpm.sys_utils.udev import get_spidev_nodes
 from usrp_mpm.sys_utils import dtoverlay
 from usrp_mpm.sys_utils import net
 from usrp_mpm.xports import XportAdapterMgr
-from usrp_mpm.rpc_utils import no_claim, no_rpc
+from usrp_mpm.rpc_utils import no_claim, no_rpc, report_progress, disable_cancel
+from usrp_mpm.rpc_utils import cached, clear_cache, get_cache_stats
 from usrp_mpm.mpmutils import get_dboard_class_from_pid
+from usrp_mpm.mpmutils import str2bool
 from usrp_mpm import eeprom
 from usrp_mpm import prefs
+from usrp_mpm.startup_profiler import startup_span
+
+# Component files are stored here before they are installed
+UPLOAD_PATH = os.path.join(os.sep, "tmp", "uploads")
+
+class ComponentUpload:
+    """
+    A component file which is uploaded in chunks, see
+    PeriphManagerBase.begin_component_upload().
+
+    The chunks are appended to a partial file next to the final one, and
+    hashed on the way, so the file never needs to be held in memory. If a
+    partial file already exists, it is hashed once and the upload resumes
+    at its end. The hash and size of the whole file are stored next to the
+    partial file, so a partial file which was left over by an upload of a
+    different file is discarded instead of being resumed.
+    """
+    # Block size for hashing an existing partial file
+    READ_SIZE = 1024 * 1024
+
+    def __init__(self, metadata, filepath):
+        if not metadata.get('sha256'):
+            raise RuntimeError(
+                "Upload of {} has no 'sha256' metadata".format(filepath))
+        self.metadata = metadata
+        self.filepath = filepath
+        self.part_path = filepath + '.part'
+        self.info_path = filepath + '.part.info'
+        self.size = int(metadata['size']) if 'size' in metadata else None
+        self.hash = sha256()
+        self.offset = 0
+        if os.path.exists(self.part_path) and self._read_info() == self._info():
+            with open(self.part_path, 'rb') as part_file:
+                for block in iter(lambda: part_file.read(self.READ_SIZE), b''):
+                    self.hash.update(block)
+                    self.offset += len(block)
+        if self.size is not None and self.offset > self.size:
+            self.hash = sha256()
+            self.offset = 0
+        if self.offset == 0:
+            with open(self.info_path, 'w') as info_file:
+                info_file.write(self._info())
+        self.part_file = open(self.part_path, 'ab' if self.offset else 'wb')
+
+    def _info(self):
+        """
+        Return what identifies the file which is uploaded
+        """
+        return "{} {}".format(self.metadata['sha256'].lower(), self.size)
+
+    def _read_info(self):
+        """
+        Return what identifies the file which the partial file belongs to
+        """
+        try:
+            with open(self.info_path, 'r') as info_file:
+                return info_file.read()
+        except OSError:
+            return None
+
+    def matches(self, metadata):
+        """
+        Check if metadata describe the file which is uploaded
+        """
+        return metadata.get('sha256', '').lower() == self.metadata['sha256'].lower() \
+            and metadata.get('size') == self.metadata.get('size')
+
+    def append(self, offset, data, chunk_hash):
+        """
+        Append a chunk of data, which must start at the end of the partial
+        file, and match the SHA-256 hex digest chunk_hash. Returns the new
+        size of the partial file.
+        """
+        if offset != self.offset:
+            raise RuntimeError(
+                "Chunk at offset {} of {} does not continue the upload at offset {}"
+                .format(offset, self.filepath, self.offset))
+        if self.size is not None and offset + len(data) > self.size:
+            raise RuntimeError(
+                "Chunk at offset {} of {} exceeds the file size of {}"
+                .format(offset, self.filepath, self.size))
+        if sha256(data).hexdigest() != chunk_hash:
+            raise RuntimeError(
+                "Chunk hash mismatch at offset {} of {}".format(offset, self.filepath))
+        self.part_file.write(data)
+        self.part_file.flush()
+        self.hash.update(data)
+        self.offset += len(data)
+        return self.offset
+
+    def verify(self):
+        """
+        Check the size and hash of the whole file. If they don't match, the
+        partial file is deleted, so the next upload starts over.
+        """
+        self.part_file.close()
+        comp_hash = self.hash.hexdigest()
+        given_hash = self.metadata['sha256']
+        if given_hash.lower() != comp_hash or \
+                (self.size is not None and self.size != self.offset):
+            self.abort()
+            raise RuntimeError(
+                "Component file {} mismatch: calculated hash {} and size {}, given {} and {}"
+                .format(self.filepath, comp_hash, self.offset, given_hash, self.size))
+
+    def finish(self):
+        """
+        Move the verified partial file to its final path
+        """
+        os.replace(self.part_path, self.filepath)
+        os.remove(self.info_path)
+
+    def abort(self):
+        """
+        Delete the partial file
+        """
+        self.part_file.close()
+        for path in (self.part_path, self.info_path):
+            if os.path.exists(path):
+                os.remove(path)
 
 # We need to disable the no-self-use check, because we might require self to
 # become an RPC method, but PyLint doesnt' know that. We'll also disable
@@ -133,6 +256,13 @@ class PeriphManagerBase:
     # dboards, but if it's shorter, it simply won't instantiate list SPI nodes
     # for those dboards.
     dboard_spimaster_addrs = []
+    # RPC calls after which the values of the @cached methods of the periph
+    # manager and its dboards may have changed. The RPC server calls
+    # clear_caches() after these, as well as after init() and deinit().
+    cache_invalidating_methods = [
+        'set_clock_source', 'set_time_source', 'set_sync_source',
+        'set_mb_eeprom', 'set_db_eeprom', 'set_clock_source_out',
+    ]
     # Dictionary containing valid IDs for the update_component function for a
     # specific implementation. Each PeriphManagerBase-derived class should list
     # information required to update the component, like a callback function
@@ -246,18 +376,21 @@ class PeriphManagerBase:
         # Set up logging
         self.log = get_logger('PeriphManager')
         self.claimed = False
+        # Chunked uploads by filename, see begin_component_upload()
+        self._uploads = {}
         try:
-            self.mboard_info = self._get_mboard_info()
-            self.log.info("Device serial number: {}"
-                          .format(self.mboard_info.get('serial', 'n/a')))
-            self.dboard_infos = self._get_dboard_info()
-            self.device_info = \
-                    self.generate_device_info(
-                        self._eeprom_head,
-                        self.mboard_info,
-                        self.dboard_infos
-                    )
-            self._aux_board_infos = self._get_aux_board_info()
+            with startup_span("EEPROM reads"):
+                self.mboard_info = self._get_mboard_info()
+                self.log.info("Device serial number: {}"
+                              .format(self.mboard_info.get('serial', 'n/a')))
+                self.dboard_infos = self._get_dboard_info()
+                self.device_info = \
+                        self.generate_device_info(
+                            self._eeprom_head,
+                            self.mboard_info,
+                            self.dboard_infos
+                        )
+                self._aux_board_infos = self._get_aux_board_info()
         except BaseException as ex:
             self.log.error("Failed to initialize device: %s", str(ex))
             self._device_initialized = False
@@ -268,7 +401,8 @@ class PeriphManagerBase:
         """
         Apply FPGA overlay
         """
-        self._init_mboard_overlays()
+        with startup_span("overlay apply"):
+            self._init_mboard_overlays()
 
     def init_dboards(self, args):
         """
@@ -285,11 +419,12 @@ class PeriphManagerBase:
             ]
         else:
             override_db_pids = []
-        self._init_dboards(
-            self.dboard_infos,
-            override_db_pids,
-            self._default_args
-        )
+        with startup_span("dboard construction"):
+            self._init_dboards(
+                self.dboard_infos,
+                override_db_pids,
+                self._default_args
+            )
         self._device_initialized = True
         self._initialization_status = "No errors."
 
@@ -622,8 +757,13 @@ class PeriphManagerBase:
         dboard_infos -- List of dictionaries as returned from
                        _get_dboard_info()
         override_dboard_pids -- List of dboard PIDs to force
-        default_args -- Default args
+        default_args -- Default args. With parallel_db_init, the dboards of
+                        all slots are constructed in parallel, see
+                        _construct_dboards().
         """
+        parallel = str2bool(default_args.get('parallel_db_init', False))
+        # (slot, class, kwargs) of the dboards to construct in parallel
+        dboard_args = []
         if override_dboard_pids:
             self.log.warning("Overriding daughterboard PIDs with: {}"
                              .format(",".join(override_dboard_pids)))
@@ -655,10 +795,70 @@ class PeriphManagerBase:
             # the corresponding DB Iface to the dboard class
             if self.db_iface is not None:
                 dboard_info['db_iface'] = self.db_iface(dboard_idx, self, dboard_info)
+            if parallel:
+                dboard_args.append((dboard_idx, db_class, dboard_info))
+                continue
             # This will actually instantiate the dboard class:
             self.dboards.append(db_class(dboard_idx, **dboard_info))
+        if dboard_args:
+            self.dboards.extend(self._construct_dboards(dboard_args))
         self.log.info("Initialized %d daughterboard(s).", len(self.dboards))
 
+    def _construct_dboards(self, dboard_args):
+        """
+        Instantiate the dboard classes of several slots in parallel, and
+        return the dboards in slot order.
+
+        Only classes with parallel_init_safe run concurrently, the others run
+        one at a time. The locks for the shared_init_resources of the classes
+        are handed to every dboard as the init_locks kwarg. If any dboard
+        fails, all errors are logged, and the first one is raised once all
+        slots are done.
+
+        dboard_args -- List of (slot, dboard class, kwargs) tuples
+        """
+        init_locks = self._get_dboard_init_locks(
+            [db_class for _, db_class, _ in dboard_args])
+        serial_lock = threading.Lock()
+        def construct(dboard_idx, db_class, dboard_info):
+            " Instantiate the dboard class of one slot "
+            dboard_info = dict(dboard_info, init_locks=init_locks)
+            if db_class.parallel_init_safe:
+                return db_class(dboard_idx, **dboard_info)
+            with serial_lock:
+                return db_class(dboard_idx, **dboard_info)
+        self.log.debug("Constructing %d dboards in parallel...", len(dboard_args))
+        with futures.ThreadPoolExecutor(max_workers=len(dboard_args)) as executor:
+            construct_futures = [
+                executor.submit(construct, *args) for args in dboard_args
+            ]
+        dboards = []
+        errors = []
+        for (dboard_idx, _, _), future in zip(dboard_args, construct_futures):
+            try:
+                dboards.append(future.result())
+            except Exception as ex:
+                self.log.error("Failed to initialize dboard %d: %s",
+                               dboard_idx, str(ex))
+                errors.append(ex)
+        if errors:
+            raise errors[0]
+        return dboards
+
+    def _get_dboard_init_locks(self, db_classes):
+        """
+        Return a dictionary of locks for the shared_init_resources of the
+        given dboard classes, by resource name (see _construct_dboards()).
+
+        Override this to hand the dboards locks for resources which the
+        motherboard uses, too, like its clocking chain.
+        """
+        return {
+            name: threading.Lock()
+            for db_class in db_classes
+            for name in db_class.shared_init_resources
+        }
+
     def _add_public_methods(self, src, prefix="", filter_cb=None, allow_overwrite=False):
         """
         Add public methods (=API) of src to self. To avoid naming conflicts and
@@ -877,6 +1077,7 @@ class PeriphManagerBase:
         return dtoverlay.list_overlays()
 
     @no_rpc
+    @cached(1.0)
     def get_device_info(self):
         """
         Return the device_info dict and add a claimed field.
@@ -913,18 +1114,40 @@ class PeriphManagerBase:
         is reset.
         """
         assert conn_type in ('remote', 'local', None)
+        clear_cache(self)
         if conn_type is None:
             self.device_info.pop('rpc_connection', None)
         else:
             self.device_info['rpc_connection'] = conn_type
 
     @no_claim
+    @cached(10.0)
     def get_dboard_info(self):
         """
         Returns a list of dicts. One dict per dboard.
         """
         return [dboard.device_info for dboard in self.dboards]
 
+    def clear_caches(self):
+        """
+        Drop the cached values of the @cached methods of the motherboard and
+        all daughterboards, so the next calls read them from the hardware
+        """
+        clear_cache(self)
+        for dboard in self.dboards:
+            clear_cache(dboard)
+
+    @no_claim
+    def get_cache_stats(self):
+        """
+        Return hits, misses, and hit rates of the cached device queries of
+        the motherboard, and of every daughterboard (as db_<slot>).
+        """
+        stats = {'mb': get_cache_stats(self)}
+        for slot, dboard in enumerate(self.dboards):
+            stats['db_{}'.format(slot)] = get_cache_stats(dboard)
+        return stats
+
     ###########################################################################
     # Component updating
     ###########################################################################
@@ -946,15 +1169,11 @@ class PeriphManagerBase:
         assert (len(metadata_l) == len(data_l)),\
             "update_component arguments must be the same length"
         # Iterate through the components, updating each in turn
-        basepath = os.path.join(os.sep, "tmp", "uploads")
+        basepath = UPLOAD_PATH
         for metadata, data in zip(metadata_l, data_l):
             id_str = metadata['id']
             filename = os.path.basename(metadata['filename'])
-            if id_str not in self.updateable_components:
-                self.log.error("{0} not an updateable component ({1})".format(
-                    id_str, self.updateable_components.keys()
-                ))
-                raise KeyError("Update component not implemented for {}".format(id_str))
+            self._check_updateable(id_str)
             self.log.trace("Downloading component: {}".format(id_str))
             if 'md5' in metadata:
                 given_hash = metadata['md5']
@@ -983,16 +1202,116 @@ class PeriphManagerBase:
             with open(filepath, 'wb') as comp_file:
                 comp_file.write(data)
 
-        # do the actual installation on the device
-        for metadata in metadata_l:
+        self._install_components(metadata_l)
+        return True
+
+    def begin_component_upload(self, metadata):
+        """
+        Begin uploading a component file in chunks, as an alternative to
+        update_component() for large files. The upload works like this:
+        - begin_component_upload() returns the offset to upload from. This is
+          0, unless an earlier upload of the same file was interrupted, in
+          which case it resumes there.
+        - append_component_chunk() appends the chunks, in order
+        - The RPC server's commit_component_upload() checks the hash of the
+          files, and installs them like update_component() does
+
+        :param metadata: Dictionary of strings containing metadata, like the
+                         ones of update_component(). Its 'sha256' key is the
+                         hex digest of the whole file, and is required. Its
+                         optional 'size' key is the size of the file.
+        """
+        id_str = metadata['id']
+        self._check_updateable(id_str)
+        filename = os.path.basename(metadata['filename'])
+        if filename in self._uploads and not self._uploads[filename].matches(metadata):
+            self._uploads.pop(filename).abort()
+        if filename in self._uploads:
+            self._uploads[filename].metadata = metadata
+        else:
+            if not os.path.isdir(UPLOAD_PATH):
+                self.log.trace("Creating directory {}".format(UPLOAD_PATH))
+                os.makedirs(UPLOAD_PATH)
+            self._uploads[filename] = \
+                ComponentUpload(metadata, os.path.join(UPLOAD_PATH, filename))
+        offset = self._uploads[filename].offset
+        self.log.trace("Uploading component {} from offset {}".format(id_str, offset))
+        return offset
+
+    def append_component_chunk(self, filename, offset, data, chunk_hash):
+        """
+        Append a chunk to an upload started with begin_component_upload().
+        Returns the number of bytes uploaded so far.
+
+        :param filename: The filename from the metadata of the upload
+        :param offset: Offset of the chunk in the file
+        :param data: The chunk
+        :param chunk_hash: SHA-256 hex digest of the chunk
+        """
+        return self._get_upload(filename).append(offset, data, chunk_hash)
+
+    def abort_component_upload(self, filename):
+        """
+        Abort an upload started with begin_component_upload(), and delete
+        the data uploaded so far
+        """
+        self._get_upload(filename).abort()
+        del self._uploads[os.path.basename(filename)]
+
+    @no_rpc
+    def install_uploaded_components(self, filenames):
+        """
+        Finish the uploads of the given files, and install them. Returns the
+        list of their metadata. All files are verified before any of them is
+        moved into place, so either all of them are installed, or none.
+        """
+        uploads = [self._get_upload(filename) for filename in filenames]
+        for filename, upload in zip(filenames, uploads):
+            try:
+                upload.verify()
+            except RuntimeError:
+                del self._uploads[os.path.basename(filename)]
+                raise
+        for filename, upload in zip(filenames, uploads):
+            del self._uploads[os.path.basename(filename)]
+            upload.finish()
+        metadata_l = [upload.metadata for upload in uploads]
+        self._install_components(metadata_l)
+        return metadata_l
+
+    def _get_upload(self, filename):
+        filename = os.path.basename(filename)
+        if filename not in self._uploads:
+            raise RuntimeError("No upload of {} in progress".format(filename))
+        return self._uploads[filename]
+
+    def _check_updateable(self, id_str):
+        """
+        Raise a KeyError if id_str is not an updateable component
+        """
+        if id_str not in self.updateable_components:
+            self.log.error("{0} not an updateable component ({1})".format(
+                id_str, self.updateable_components.keys()
+            ))
+            raise KeyError("Update component not implemented for {}".format(id_str))
+
+    def _install_components(self, metadata_l):
+        """
+        Install the component files in UPLOAD_PATH on the device
+        """
+        # Files which go together (like a bitfile and its device tree) must
+        # all be installed, and the periph manager reset after them
+        disable_cancel()
+        for index, metadata in enumerate(metadata_l):
             id_str = metadata['id']
+            report_progress(index / len(metadata_l),
+                            "Installing component {}".format(id_str))
             filename = os.path.basename(metadata['filename'])
-            filepath = os.path.join(basepath, filename)
+            filepath = os.path.join(UPLOAD_PATH, filename)
             update_func = \
                 getattr(self, self.updateable_components[id_str]['callback'])
             self.log.info("Installing component `%s'", id_str)
             update_func(filepath, metadata)
-        return True
 
     @no_claim
     def get_component_info(self, component_name):
@@ -1015,6 +1334,7 @@ class PeriphManagerBase:
     ##########################################################################
     # Mboard Sensors
     ##########################################################################
+    @cached(10.0)
     def get_mb_sensors(self):
         """
         Return a list of sensor names.
@@ -1107,6 +1427,7 @@ class PeriphManagerBase:
     #######################################################################
     # Transport API
     #######################################################################
+    @cached(10.0)
     def get_chdr_link_types(self):
         """
         Return a list of ways how the UHD session can connect to this device to
@@ -1125,6 +1446,7 @@ class PeriphManagerBase:
         """
         return list(self._xport_mgrs.keys())
 
+    @cached(2.0)
     def get_chdr_link_options(self, xport_type):
         """
         Returns a list of dictionaries. Every dictionary contains information
@@ -1346,6 +1668,7 @@ class PeriphManagerBase:
             "clock_source": self.get_clock_source(),
         }
 
+    @cached(10.0)
     def get_clock_sources(self):
         """
         Returns a list of valid clock sources. This is a list of strings.
@@ -1353,6 +1676,7 @@ class PeriphManagerBase:
         self.log.warning("get_clock_sources() was not specified for this device!")
         return []
 
+    @cached(10.0)
     def get_time_sources(self):
         """
         Returns a list of valid time sources. This is a list of strings.
@@ -1360,6 +1684,7 @@ class PeriphManagerBase:
         self.log.warning("get_time_sources() was not specified for this device!")
         return []
 
+    @cached(10.0)
     def get_sync_sources(self):
         """
         Returns a list of valid sync sources. This is a list of dictionaries.
@@ -16,7 +16,7 @@ from usrp_mpm.dboard_manager import E31x_db
 from usrp_mpm.gpsd_iface import GPSDIfaceExtension
 from usrp_mpm.mpmutils import assert_compat_number, str2bool
 from usrp_mpm.periph_manager import PeriphManagerBase
-from usrp_mpm.rpc_utils import no_rpc, get_map_for_rpc
+from usrp_mpm.rpc_utils import no_rpc, cached, get_map_for_rpc
 from usrp_mpm.sys_utils import dtoverlay
 from usrp_mpm.sys_utils.sysfs_thermal import read_sysfs_sensors_value
 from usrp_mpm.sys_utils.udev import get_spidev_nodes
@@ -491,6 +491,7 @@ class e31x(ZynqComponents, PeriphManagerBase):
     ###########################################################################
     # Clock/Time API
     ###########################################################################
+    @cached(10.0)
     def get_clock_sources(self):
         " Lists all available clock sources. "
         self.log.trace("Listing available clock sources...")
@@ -509,6 +510,7 @@ class e31x(ZynqComponents, PeriphManagerBase):
         assert clock_source in self.get_clock_sources(), \
             "Cannot set to invalid clock source: {}".format(clock_source)
 
+    @cached(10.0)
     def get_time_sources(self):
         " Returns list of valid time sources "
         return ['internal', 'external', 'gpsdo']
@@ -527,6 +529,7 @@ class e31x(ZynqComponents, PeriphManagerBase):
         self._time_source = time_source
         self.mboard_regs_control.set_time_source(time_source)
 
+    @cached(10.0)
     def get_sync_sources(self):
         """
         List sync sources.
@@ -18,7 +18,7 @@ from usrp_mpm.dboard_manager import Neon
 from usrp_mpm.gpsd_iface import GPSDIfaceExtension
 from usrp_mpm.mpmutils import assert_compat_number, str2bool
 from usrp_mpm.periph_manager import PeriphManagerBase
-from usrp_mpm.rpc_utils import no_rpc, get_map_for_rpc
+from usrp_mpm.rpc_utils import no_rpc, cached, get_map_for_rpc
 from usrp_mpm.sys_utils import dtoverlay
 from usrp_mpm.sys_utils.sysfs_thermal import read_thermal_sensor_value, read_thermal_sensors_value
 from usrp_mpm.sys_utils.udev import get_spidev_nodes
@@ -361,6 +361,7 @@ class e320(ZynqComponents, PeriphManagerBase):
     ###########################################################################
     # Clock/Time API
     ###########################################################################
+    @cached(10.0)
     def get_clock_sources(self):
         " Lists all available clock sources. "
         self.log.trace("Listing available clock sources...")
@@ -418,6 +419,7 @@ class e320(ZynqComponents, PeriphManagerBase):
         # elif clock_source == "external":
         return self._ext_clock_freq
 
+    @cached(10.0)
     def get_time_sources(self):
         " Returns list of valid time sources "
         return ['internal', 'external', 'gpsdo']
@@ -435,6 +437,7 @@ class e320(ZynqComponents, PeriphManagerBase):
         self._time_source = time_source
         self.mboard_regs_control.set_time_source(time_source, self.get_ref_clock_freq())
 
+    @cached(10.0)
     def get_sync_sources(self):
         """
         List sync sources.
@@ -18,7 +18,7 @@ from usrp_mpm.components import ZynqComponents
 from usrp_mpm.gpsd_iface import GPSDIfaceExtension
 from usrp_mpm.periph_manager import PeriphManagerBase
 from usrp_mpm.mpmutils import assert_compat_number, str2bool, poll_with_timeout
-from usrp_mpm.rpc_utils import no_rpc, get_map_for_rpc
+from usrp_mpm.rpc_utils import no_rpc, cached, get_map_for_rpc
 from usrp_mpm.sys_utils import dtoverlay
 from usrp_mpm.sys_utils import i2c_dev
 from usrp_mpm.sys_utils.sysfs_thermal import read_thermal_sensor_value
@@ -508,6 +508,7 @@ class n3xx(ZynqComponents, PeriphManagerBase):
     ###########################################################################
     # Clock/Time API
     ###########################################################################
+    @cached(10.0)
     def get_clock_sources(self):
         " Lists all available clock sources. "
         if self._gps_enabled:
@@ -536,6 +537,7 @@ class n3xx(ZynqComponents, PeriphManagerBase):
                  }
         self.set_sync_source(source)
 
+    @cached(10.0)
     def get_time_sources(self):
         " Returns list of valid time sources "
         if self._gps_enabled:
@@ -565,6 +567,7 @@ class n3xx(ZynqComponents, PeriphManagerBase):
                  }
         self.set_sync_source(source)
 
+    @cached(10.0)
     def get_sync_sources(self):
         """
         Enumerate permissible time/clock source combinations for sync
@@ -13,10 +13,11 @@ configuration by using the cmake flag -DMPM_DEVICE=sim
 from pyroute2 import IPRoute
 from usrp_mpm.xports import XportMgrUDP
 from usrp_mpm.mpmlog import get_logger
-from usrp_mpm.rpc_utils import no_claim
+from usrp_mpm.rpc_utils import no_claim, cached
 from usrp_mpm.periph_manager import PeriphManagerBase
 from usrp_mpm.simulator.sim_dboard import registry as dboards
 from usrp_mpm.simulator.chdr_endpoint import ChdrEndpoint
+from usrp_mpm.simulator.async_engine import AsyncChdrEndpoint
 from usrp_mpm.simulator.config import Config
 
 CLOCK_SOURCE_INTERNAL = "internal"
@@ -70,7 +71,10 @@ class sim(PeriphManagerBase):
     #########################################################################
     # Overridables
     #########################################################################
-    mboard_sensor_callback_map = {}
+    mboard_sensor_callback_map = {
+        'tx_packet_rate': 'get_tx_packet_rate_sensor',
+        'tx_packet_rate_target': 'get_tx_packet_rate_target_sensor',
+    }
 
     ###########################################################################
     # Ctor and device initialization tasks
@@ -86,6 +90,14 @@ class sim(PeriphManagerBase):
         else:
             config_log.warn("No config specified, using default")
             self.config = Config.default()
+        # Per device overrides, these let several simulated devices share
+        # one config file (see simulator/farm.py)
+        if 'sim_serial' in args:
+            self.config.hardware.serial_num = args['sim_serial']
+        if 'sim_chdr_addr' in args:
+            self.config.chdr_addr = args['sim_chdr_addr']
+        if 'sim_chdr_port' in args:
+            self.config.chdr_port = int(args['sim_chdr_port'])
 
         self.device_id = 1
         self.description = self.config.hardware.description
@@ -96,7 +108,10 @@ class sim(PeriphManagerBase):
         # This uses the description, mboard_info, and pids
         super().__init__()
 
-        self.chdr_endpoint = ChdrEndpoint(self.log, self.config)
+        if self.config.engine == "asyncio":
+            self.chdr_endpoint = AsyncChdrEndpoint(self.log, self.config)
+        else:
+            self.chdr_endpoint = ChdrEndpoint(self.log, self.config)
 
         # Unlike the real hardware drivers, if there is an exception here,
         # we just crash. No use missing an error when testing.
@@ -105,6 +120,16 @@ class sim(PeriphManagerBase):
         if not args.get('skip_boot_init', False):
             self.init(args)
 
+    def tear_down(self):
+        """
+        Tear down all members that need to be specially handled before
+        deconstruction.
+        For the simulator, this means the CHDR endpoint and its capture.
+        """
+        self.log.trace("Tearing down simulated device...")
+        self.chdr_endpoint.close()
+        super().tear_down()
+
     def _simulator_sample_rate(self, freq):
         self.log.debug("Setting Simulator Sample Rate to {}".format(freq))
         self.chdr_endpoint.set_sample_rate(freq)
@@ -165,6 +190,37 @@ class sim(PeriphManagerBase):
         self.dboards.append(dboard_class(E320_DBOARD_SLOT_IDX, self._simulator_sample_rate))
         self.log.info("Found %d daughterboard(s).", len(self.dboards))
 
+    ###########################################################################
+    # Sensors
+    ###########################################################################
+    def get_tx_packet_rate_sensor(self):
+        """
+        Return the packet rate the simulated TX streams achieved, summed
+        over all streams.
+        """
+        rate = sum(stats['actual_rate']
+                   for stats in self.chdr_endpoint.get_tx_rate_stats())
+        return {
+            'name': 'tx_packet_rate',
+            'type': 'REALNUM',
+            'unit': 'packets/sec',
+            'value': str(rate),
+        }
+
+    def get_tx_packet_rate_target_sensor(self):
+        """
+        Return the packet rate the simulated TX streams were asked for,
+        summed over all streams.
+        """
+        rate = sum(stats['target_rate']
+                   for stats in self.chdr_endpoint.get_tx_rate_stats())
+        return {
+            'name': 'tx_packet_rate_target',
+            'type': 'REALNUM',
+            'unit': 'packets/sec',
+            'value': str(rate),
+        }
+
     ###########################################################################
     # Device info
     ###########################################################################
@@ -207,7 +263,7 @@ class sim(PeriphManagerBase):
         """
         Return RFNoC CHDR width
         """
-        return 64
+        return self.config.hardware.chdr_width
 
     ###########################################################################
     # Transport API
@@ -230,12 +286,21 @@ class sim(PeriphManagerBase):
         - ipv4 (IP Address)
         - port (UDP port)
         - link_rate (bps of the link, e.g. 10e9 for 10GigE)
+
+        Every simulated xport listens on its own UDP port, counting up
+        from the port of the first one. If the CHDR sockets are bound to
+        a single address, that is the only address offered.
         """
         if xport_type not in self._xport_mgrs:
             self.log.warning("Can't get link options for unknown link type: '{}'."
                              .format(xport_type))
             return []
-        return self._xport_mgrs[xport_type].get_chdr_link_options()
+        link_options = self._xport_mgrs[xport_type].get_chdr_link_options()
+        if self.config.chdr_addr != "0.0.0.0" and link_options:
+            link_options = [dict(link_options[0], ipv4=self.config.chdr_addr)]
+        return [dict(option, port=str(self.config.chdr_port + xport))
+                for xport in range(self.config.hardware.num_xports)
+                for option in link_options]
 
     #######################################################################
     # Timekeeper API
@@ -299,10 +364,12 @@ class sim(PeriphManagerBase):
             }
         ]
 
+    @cached(10.0)
     def get_time_sources(self):
         " Returns list of valid time sources "
         return (CLOCK_SOURCE_INTERNAL,)
 
+    @cached(10.0)
     def get_clock_sources(self):
         " Lists all available clock sources. "
         return (CLOCK_SOURCE_INTERNAL,)
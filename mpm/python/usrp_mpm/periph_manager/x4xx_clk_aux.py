@@ -479,6 +479,8 @@ class ClockingAuxBrdControl:
         else:
             self.log.trace("disable LMK05318 power")
             self._nsync_power_ctrl.set(0)
+        # The register values are lost in power down
+        self._nsync_pll.shadow_regs.invalidate()
 
     def write_nsync_lmk_cfg_regs_to_eeprom(self, method):
         """program the current LMK config to LMK eeprom"""
@@ -64,6 +64,7 @@ class LMK03328X4xx(LMK03328):
         if hard:
             # The powerdown pin is active low
             self._pll_pwrdown_n.set(not value)
+            self.shadow_regs.invalidate()
         else:
             self.soft_reset(value)
 
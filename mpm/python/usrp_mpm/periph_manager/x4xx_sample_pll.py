@@ -102,6 +102,7 @@ class LMK04832X4xx(LMK04832):
         """
         if hard:
             self._sclk_pll_reset.set(value)
+            self.shadow_regs.invalidate()
         else:
             self.soft_reset(value)
 
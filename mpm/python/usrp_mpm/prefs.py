@@ -17,6 +17,8 @@ _PREFS = None
 MPM_DEFAULT_CONFFILE_PATH = '/etc/uhd/mpm.conf'
 MPM_DEFAULT_LOG_LEVEL = 'info'
 MPM_DEFAULT_LOG_BUF_SIZE = 100 # Number of log records to buf
+MPM_DEFAULT_LOG_ASYNC = False
+MPM_DEFAULT_LOG_QUEUE_SIZE = 10000 # Number of log records to queue if async
 
 # ConfigParser has too many parents for PyLint's liking, but we don't control
 # that, so disable that warning
@@ -39,6 +41,8 @@ class _MPMPrefs(configparser.ConfigParser):
         'mpm': {
             'log_level': MPM_DEFAULT_LOG_LEVEL,
             'log_buf_size': MPM_DEFAULT_LOG_BUF_SIZE,
+            'log_async': str(MPM_DEFAULT_LOG_ASYNC),
+            'log_queue_size': MPM_DEFAULT_LOG_QUEUE_SIZE,
         },
         'overrides': {
             'override_db_pids': '',
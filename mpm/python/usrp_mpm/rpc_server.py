@@ -14,8 +14,11 @@ from random import choice
 from string import ascii_letters, digits
 from multiprocessing import Process
 from multiprocessing import RLock
+import logging
 import threading
 import sys
+import time
+import functools
 from gevent.server import StreamServer
 from gevent.pool import Pool
 from gevent import signal
@@ -26,15 +29,21 @@ monkey.patch_all()
 from contextlib import contextmanager
 from mprpc import RPCServer
 from usrp_mpm.mpmlog import get_main_logger
-from usrp_mpm.mpmutils import to_binary_str
+from usrp_mpm.startup_profiler import startup_span, finish_startup, \
+    get_startup_profile, format_startup_profile
+from usrp_mpm.mpmutils import to_binary_str, str2bool
 from usrp_mpm.sys_utils import watchdog
 from usrp_mpm.sys_utils import net
-from usrp_mpm.rpc_utils import get_map_for_rpc
+from usrp_mpm.rpc_utils import get_map_for_rpc, get_cached_value, RpcStats
+from usrp_mpm.rpc_utils import JobRunner, RpcJob, get_current_job, report_progress
 
 
 TIMEOUT_INTERVAL = 5.0 # Seconds before claim expires (default value)
 LOCK_ACQ_TIMEOUT = 1 # Seconds to wait for acquiring shared lock (default value)
 TOKEN_LEN = 16 # Length of the token string
+# Maximum number of concurrent connections to an RPC server. UHD sessions
+# keep their connections open, so this bounds the number of clients.
+MAX_CONNECTIONS = 1000
 # Compatibility number for MPM
 MPM_COMPAT_NUM = (5, 3)
 
@@ -45,7 +54,16 @@ class MPMServer(RPCServer):
     """
     # This is a list of methods in this class which require a claim
     default_claimed_methods = ['init', 'update_component', 'reclaim', 'unclaim',
-                               'get_log_buf']
+                               'get_log_buf', 'reset_rpc_stats', 'start_job',
+                               'cancel_job', 'commit_component_upload']
+    # Methods of this class which can run as jobs, see start_job(). The
+    # periph_manager and dboard methods which require a claim can run as jobs
+    # as well.
+    job_methods = ['init', 'update_component', 'commit_component_upload',
+                   'reset_timer_and_mgr']
+    # Jobs which may reset the periph manager, see _call_safe_function()
+    mgr_resetting_methods = ['update_component', 'commit_component_upload',
+                             'reset_timer_and_mgr']
 
     ###########################################################################
     # RPC Server Initialization
@@ -57,14 +75,22 @@ class MPMServer(RPCServer):
         self._state = state
         self._timer = Greenlet()
         self._timer_lock = RLock()
-        # Setting this to True will disable an unclaim on timeout. Use with
-        # care, and make sure to set it to False again when finished.
-        self._disable_timeouts = False
+        # As long as this is non-zero, there will be no unclaim on timeout.
+        # Use _timeout_disabler() to change it.
+        self._disable_timeouts = 0
         self._timeout_interval = float(default_args.get(
             "rpc_timeout_interval",
             TIMEOUT_INTERVAL
         ))
         self.session_id = None
+        self._rpc_stats = RpcStats()
+        # Cursor of get_log_buf() calls without since_seq
+        self._log_buf_seq = 0
+        # Runs jobs, and keeps the calls which use the periph manager apart
+        # from them
+        self._jobs = JobRunner(self.log)
+        # A periph manager which was created by a job, see _reset_mgr()
+        self._new_periph_manager = None
         # Create the periph_manager for this device
         # This call will be forwarded to the device specific implementation
         # e.g. in periph_manager/n3xx.py
@@ -72,9 +98,11 @@ class MPMServer(RPCServer):
         # configuration with cmake (-DMPM_DEVICE).
         # mgr is thus derived from PeriphManagerBase
         # (see periph_manager/base.py)
-        from usrp_mpm.periph_manager import periph_manager
+        with startup_span("import periph_manager"):
+            from usrp_mpm.periph_manager import periph_manager
         self._mgr_generator = lambda: periph_manager(default_args)
-        self.periph_manager = self._mgr_generator()
+        with startup_span("periph_manager construction"):
+            self.periph_manager = self._mgr_generator()
         device_info = self.periph_manager.get_device_info()
         self._state.dev_type.value = \
                 to_binary_str(device_info.get("type", "n/a"))
@@ -86,19 +114,31 @@ class MPMServer(RPCServer):
                 to_binary_str(device_info.get("name", "n/a"))
         self._state.dev_fpga_type.value = \
                 to_binary_str(device_info.get("fpga", "n/a"))
+        self._state.changed()
         self._db_methods = []
         self._mb_methods = []
+        # Maps the claimed commands of the periph_manager and dboards to the
+        # functions they call, see multicall()
+        self._claimed_functions = {}
+        # The same for the commands which require no claim
+        self._safe_functions = {}
         self.claimed_methods = copy.copy(self.default_claimed_methods)
         self._last_error = ""
-        self._init_rpc_calls(self.periph_manager)
-        # We call the server __init__ function here, and not earlier, because
-        # first the commands need to be registered
-        super(MPMServer, self).__init__(
-            pack_params={'use_bin_type': True},
-            unpack_params={'max_buffer_size': 50000000, 'raw': False},
-        )
+        with startup_span("RPC registration"):
+            self._init_rpc_calls(self.periph_manager)
+            # We call the server __init__ function here, and not earlier,
+            # because first the commands need to be registered
+            super(MPMServer, self).__init__(
+                pack_params={'use_bin_type': True},
+                unpack_params={'max_buffer_size': 50000000, 'raw': False},
+            )
         self._state.system_ready.value = True
+        finish_startup()
         self.log.info("RPC server ready!")
+        if str2bool(default_args.get('profile_startup', False)):
+            self.log.info("Startup profile (start, duration, phase):")
+            for line in format_startup_profile():
+                self.log.info(line)
         # Optionally spawn watchdog. Note: In order for us to be able to spawn
         # the task from this thread, the main process needs to hand control to
         # us using watchdog.transfer_control().
@@ -115,6 +155,8 @@ class MPMServer(RPCServer):
         # Clear old calls:
         for meth_list in (self._db_methods, self._mb_methods):
             for method in meth_list:
+                self._claimed_functions.pop(method, None)
+                self._safe_functions.pop(method, None)
                 if hasattr(self, method):
                     delattr(self, method)
                 else:
@@ -176,12 +218,40 @@ class MPMServer(RPCServer):
                     "token `{}'.".format(command, token)
                 )
                 raise RuntimeError("Invalid token!")
+            return self._call_claimed_function(command, args)
+        new_claimed_function.__doc__ = function.__doc__
+        setattr(self, command, new_claimed_function)
+        self._claimed_functions[command] = function
+
+    def _get_registered_function(self, command, functions):
+        """
+        Return the function behind command from functions (the claimed or
+        the safe ones). A job may have reset the periph manager while the
+        call was waiting for it, which replaces all of them.
+        """
+        function = functions.get(command)
+        if function is None:
+            raise RuntimeError(
+                "Method `{}' is no longer available".format(command))
+        return function
+
+    def _call_claimed_function(self, command, args):
+        """
+        Call the function behind a claimed command. The caller must have
+        checked the token. Waits while a job is running.
+        """
+        with self._jobs.call():
+            start_ns = time.monotonic_ns()
+            failed = False
             try:
+                function = self._get_registered_function(
+                    command, self._claimed_functions)
                 # Because we can only reach this point with a valid claim,
                 # there's no harm in resetting the timer
                 self._reset_timer()
                 return function(*args)
             except Exception as ex:
+                failed = True
                 self.log.error(
                     "Uncaught exception in method %s: %s \n %s ",
                     command, str(ex), traceback.format_exc()
@@ -189,11 +259,21 @@ class MPMServer(RPCServer):
                 self._last_error = str(ex)
                 raise
             finally:
+                self._rpc_stats.record(command, time.monotonic_ns() - start_ns, failed)
+                if command in self.periph_manager.cache_invalidating_methods:
+                    self.periph_manager.clear_caches()
                 if not self._state.claim_status.value:
                     self.log.error("Lost claim during API call to `%s'!",
                                    command)
-        new_claimed_function.__doc__ = function.__doc__
-        setattr(self, command, new_claimed_function)
+
+    def _call_job_function(self, command, *args):
+        """
+        Call the function behind a claimed command in a job. It's looked up
+        when the job runs, because an earlier job may have reset the periph
+        manager.
+        """
+        return self._get_registered_function(
+            command, self._claimed_functions)(*args)
 
     def _add_safe_command(self, function, command):
         """
@@ -204,17 +284,45 @@ class MPMServer(RPCServer):
         self.log.trace("adding safe command %s pointing to %s", command, function)
         def new_unclaimed_function(*args):
             " Define a function that does not require a claim token check "
+            start_ns = time.monotonic_ns()
+            failed = False
             try:
-                return function(*args)
+                return self._call_safe_function(
+                    lambda: self._get_registered_function(command, self._safe_functions),
+                    args)
             except Exception as ex:
+                failed = True
                 self.log.error(
                     "Uncaught exception in method %s :%s\n %s ",
                     command, str(ex), traceback.format_exc()
                 )
                 self._last_error = str(ex)
                 raise
+            finally:
+                self._rpc_stats.record(command, time.monotonic_ns() - start_ns, failed)
         new_unclaimed_function.__doc__ = function.__doc__
         setattr(self, command, new_unclaimed_function)
+        self._safe_functions[command] = function
+
+    def _call_safe_function(self, get_function, args):
+        """
+        Call get_function()(*args), where the function doesn't require a
+        claim. Unlike claimed calls, these don't wait for jobs, so that
+        monitoring keeps working during long jobs.
+
+        Only while a job which may reset the periph manager is pending or
+        running (see mgr_resetting_methods), they don't reach the periph
+        manager: @cached methods return the value they cached last, even if
+        it expired. Everything else waits for the job.
+        """
+        if not self._jobs.has_unfinished(self.mgr_resetting_methods):
+            with self._jobs.call(wait=False):
+                return get_function()(*args)
+        found, value = get_cached_value(get_function(), args)
+        if found:
+            return value
+        with self._jobs.call():
+            return get_function()(*args)
 
     ###########################################################################
     # Diagnostics and introspection
@@ -236,6 +344,31 @@ class MPMServer(RPCServer):
                     and callable(getattr(self, method))
         ]
 
+    def get_rpc_stats(self):
+        """
+        Return call counts, error counts and latency histograms of the
+        periph_manager and dboard methods, and of init(), since the last
+        call to reset_rpc_stats(). See RpcStats.get_stats() for the format.
+        """
+        return self._rpc_stats.get_stats()
+
+    def reset_rpc_stats(self, token):
+        """
+        Clear the statistics returned by get_rpc_stats()
+        """
+        if not self._check_token_valid(token):
+            self._last_error = "reset_rpc_stats() called without valid claim."
+            raise RuntimeError("reset_rpc_stats() called without valid claim.")
+        self._rpc_stats.reset()
+
+    def get_startup_profile(self):
+        """
+        Return how long the phases of MPM startup took, as a list of
+        dictionaries with the keys name, start, duration (both in seconds),
+        depth (of nested phases), and thread.
+        """
+        return get_startup_profile()
+
     def ping(self, data=None):
         """
         Take in data as argument and send it back
@@ -244,6 +377,151 @@ class MPMServer(RPCServer):
         self.log.debug("I was pinged from: %s:%s", self.client_host, self.client_port)
         return data
 
+    ###########################################################################
+    # Batched calls
+    ###########################################################################
+    def multicall(self, token, calls):
+        """
+        Run several RPC calls in one round trip.
+
+        calls is a list of (method, args) pairs, where args is the list of
+        arguments of the method, without a token. If any of the methods
+        requires a claim, the token is checked once up front. The calls run
+        in order, and a failing call does not stop the ones after it.
+
+        Returns a list with one (success, value) pair per call, where value
+        is the return value of the call, or the error message if it failed.
+        """
+        claimed = [method for method, _ in calls if method in self.claimed_methods]
+        if claimed and not self._check_token_valid(token):
+            self.log.warning(
+                "Thwarted attempt to access functions {} with invalid " \
+                "token `{}'.".format(claimed, token)
+            )
+            raise RuntimeError("Invalid token!")
+        results = []
+        for method, args in calls:
+            try:
+                results.append((True, self._run_batched_call(token, method, args)))
+            except Exception as ex:
+                results.append((False, str(ex)))
+        return results
+
+    def _run_batched_call(self, token, method, args):
+        """
+        Run one of the calls of multicall()
+        """
+        if method.startswith('_') or method == 'multicall' \
+                or not callable(getattr(self, method, None)):
+            raise RuntimeError("Unknown method: {}".format(method))
+        if method not in self.claimed_methods:
+            return getattr(self, method)(*args)
+        # An earlier call of the batch may have released the claim. This is
+        # a local comparison, unlike the round trip a separate call costs.
+        if not self._check_token_valid(token):
+            raise RuntimeError("Lost claim before calling `{}'".format(method))
+        if method in self._claimed_functions:
+            return self._call_claimed_function(method, args)
+        return getattr(self, method)(token, *args)
+
+    ###########################################################################
+    # Jobs
+    ###########################################################################
+    def start_job(self, token, method, args):
+        """
+        Start running a long running call as a job, and return the job ID.
+
+        The call runs in a worker thread, so the RPC server keeps answering
+        other calls while it runs. Jobs run one after the other, in the order
+        they were started. Use poll_job() or wait_job() to get the progress
+        and the result, and cancel_job() to cancel it.
+
+        method can be init, update_component, reset_timer_and_mgr, or any
+        periph_manager or dboard method which requires a claim. args is the
+        list of arguments of the method, without a token. The claim won't
+        time out while a job is pending or running.
+        """
+        if not self._check_token_valid(token):
+            self.log.warning(
+                "Thwarted attempt to start job `{}' with invalid token `{}'."
+                .format(method, token)
+            )
+            raise RuntimeError("Invalid token!")
+        function = self._get_job_function(method)
+        self._disable_timeouts += 1
+        job = self._jobs.start(method, function, args, self._finish_job)
+        self.log.debug("Started job %d: %s", job.job_id, method)
+        return job.job_id
+
+    def poll_job(self, job_id):
+        """
+        Return the state of a job as a dictionary with the keys:
+        - id, method: The job ID and the method it runs
+        - state: pending, running, done, failed, or cancelled
+        - progress, status: The progress (0.0 to 1.0) and current step, as
+          reported by the method
+        - result: The return value of the method, once the job is done
+        - error: The error message, if the job failed
+        - elapsed: Seconds since the job was started, or until it finished
+        """
+        return self._jobs.get(job_id).get_info()
+
+    def wait_job(self, job_id, timeout=None):
+        """
+        Wait until a job is finished, or for at most timeout seconds, then
+        return its state like poll_job() does.
+        """
+        job = self._jobs.get(job_id)
+        job.done_event.wait(timeout)
+        return job.get_info()
+
+    def cancel_job(self, token, job_id):
+        """
+        Cancel a job. A pending job will not run at all. A running job stops
+        at the next point where it reports its progress, unless it already
+        started changing the device in a way which can't be left half done
+        (e.g., installing components). Returns False if the job was already
+        finished or can't be cancelled anymore. Use poll_job() to see if it
+        was cancelled.
+        """
+        if not self._check_token_valid(token):
+            self._last_error = "cancel_job() called without valid claim."
+            raise RuntimeError("cancel_job() called without valid claim.")
+        return self._jobs.cancel(job_id)
+
+    def _get_job_function(self, method):
+        """
+        Return the function which runs method in a job
+        """
+        if method in self._claimed_functions:
+            return functools.partial(self._call_job_function, method)
+        if method in self.job_methods:
+            # These have a private counterpart without the claim and timer
+            # handling, which is done by start_job() and _finish_job()
+            return getattr(self, '_' + method)
+        raise RuntimeError("Method `{}' can't run as a job".format(method))
+
+    def _finish_job(self, job):
+        """
+        Called on the RPC server thread when a job is done, before any other
+        call can use the periph manager
+        """
+        if self._new_periph_manager is not None:
+            periph_manager, self._new_periph_manager = self._new_periph_manager, None
+            self._swap_mgr(periph_manager)
+        if job.state != RpcJob.CANCELLED:
+            self._rpc_stats.record(
+                job.method, time.monotonic_ns() - job.start_ns,
+                job.state == RpcJob.FAILED)
+        if job.state == RpcJob.FAILED:
+            self._last_error = job.error
+        if self.periph_manager is not None and \
+                job.method in self.periph_manager.cache_invalidating_methods:
+            self.periph_manager.clear_caches()
+        self._disable_timeouts -= 1
+        if self._state.claim_status.value:
+            self._reset_timer()
+
     ###########################################################################
     # Claiming logic
     ###########################################################################
@@ -298,6 +576,7 @@ class MPMServer(RPCServer):
             choice(ascii_letters + digits) for _ in range(TOKEN_LEN)
         ), 'ascii')
         self._state.claim_status.value = True
+        self._state.changed()
         self.periph_manager.claimed = True
         self.periph_manager.claim()
         if self.periph_manager.clear_rpc_registry_on_unclaim:
@@ -349,6 +628,16 @@ class MPMServer(RPCServer):
 
         Resets and deinitalizes the periph manager as well.
         """
+        # Jobs of this session shouldn't run past it. Wait for the one which
+        # is running, it may not be cancellable anymore.
+        self._jobs.cancel_all()
+        with self._jobs.call():
+            self._unclaim_and_deinit()
+
+    def _unclaim_and_deinit(self):
+        """
+        Does the work of _unclaim(), once no job is running
+        """
         error_msg = "Unclaim timed out acquiring the shared state lock after 1 second."
         self._acquire_or_throw(self._state.lock, error_msg)
         self.log.debug(
@@ -370,6 +659,7 @@ class MPMServer(RPCServer):
             self.periph_manager.unclaim()
             self.periph_manager.set_connection_type(None)
             self.periph_manager.deinit()
+            self.periph_manager.clear_caches()
         except BaseException as ex:
             self._last_error = str(ex)
             self.log.error("Deinitialization failed: %s", str(ex))
@@ -380,6 +670,7 @@ class MPMServer(RPCServer):
             # must always clear the claim and the _state lock at this point.
             self._state.claim_status.value = False
             self._state.claim_token.value = b''
+            self._state.changed()
             self._state.lock.release()
             self.session_id = None
 
@@ -416,11 +707,11 @@ class MPMServer(RPCServer):
 
     @contextmanager
     def _timeout_disabler(self):
-        self._disable_timeouts = True
+        self._disable_timeouts += 1
         try:
             yield self
         finally:
-            self._disable_timeouts = False
+            self._disable_timeouts -= 1
 
     ###########################################################################
     # Status queries
@@ -434,7 +725,10 @@ class MPMServer(RPCServer):
         get device information
         This is as safe method which can be called without a claim on the device
         """
-        info = get_map_for_rpc(self.periph_manager.get_device_info(), self.log)
+        # Copy, because the periph manager caches its device info
+        info = get_map_for_rpc(
+            dict(self._call_safe_function(lambda: self.periph_manager.get_device_info, ())),
+            self.log)
         info["mpm_version"] = "{}.{}".format(*MPM_COMPAT_NUM)
         if _is_connection_local(self.client_host):
             info["connection"] = "local"
@@ -448,10 +742,26 @@ class MPMServer(RPCServer):
         """
         return self._last_error
 
-    def get_log_buf(self, token):
+    def get_log_buf(self, token, since_seq=None, max_records=None,
+                    min_level=0, compact=False):
         """
-        Return the contents of the log buffer as a list of str -> str
-        dictionaries.
+        Return log records from the log buffer. Reading doesn't remove them,
+        so several readers can follow the log at the same time.
+
+        Without since_seq, this returns the records which weren't returned
+        by an earlier call without since_seq, as a list of str -> str
+        dictionaries (name, message, levelname, msecs).
+
+        With since_seq, this returns a dictionary:
+        - records: The records with a sequence number of since_seq or higher,
+          oldest first. At most max_records of them, and only those of level
+          min_level (number or name) or higher.
+        - next_seq: Use this as since_seq for the next call.
+        - lost: Number of records which were overwritten before they could
+          be returned.
+        With compact, records are (seq, created, levelno, name, message)
+        tuples, otherwise they are dictionaries with these keys plus
+        levelname and msecs.
         """
         if not self._check_token_valid(token):
             self.log.warning(
@@ -462,12 +772,32 @@ class MPMServer(RPCServer):
             err_msg = "get_log_buf() called without valid claim."
             self._last_error = err_msg
             raise RuntimeError(err_msg)
-        log_records = get_main_logger().get_log_buf()
-        self.log.trace("Returning %d log records.", len(log_records))
-        return [
-            {k: str(v) for k, v in iter(record.items())}
-            for record in log_records
-        ]
+        if since_seq is None:
+            log_records, self._log_buf_seq, _ = \
+                get_main_logger().get_log_buf(self._log_buf_seq, max_records, min_level)
+            return [{
+                'name': name,
+                'message': message,
+                'levelname': logging.getLevelName(levelno),
+                'msecs': str(int((created % 1) * 1000)),
+            } for _, created, levelno, name, message in log_records]
+        log_records, next_seq, lost = \
+            get_main_logger().get_log_buf(since_seq, max_records, min_level)
+        if not compact:
+            log_records = [{
+                'seq': seq,
+                'created': created,
+                'levelno': levelno,
+                'levelname': logging.getLevelName(levelno),
+                'name': name,
+                'message': message,
+                'msecs': int((created % 1) * 1000),
+            } for seq, created, levelno, name, message in log_records]
+        return {
+            'records': log_records,
+            'next_seq': next_seq,
+            'lost': lost,
+        }
 
     ###########################################################################
     # Session initialization
@@ -485,12 +815,27 @@ class MPMServer(RPCServer):
             )
             self._last_error = "init() called without valid claim."
             raise RuntimeError("init() called without valid claim.")
+        with self._jobs.call():
+            start_ns = time.monotonic_ns()
+            failed = True
+            try:
+                result = self._init(args)
+                failed = False
+                return result
+            finally:
+                self._rpc_stats.record('init', time.monotonic_ns() - start_ns, failed)
+
+    def _init(self, args):
+        """
+        Initialize device, without the claim check of init()
+        """
         try:
             result = self.periph_manager.init(args)
         except Exception as ex:
             self._last_error = str(ex)
             self.log.error("init() failed with error: %s", str(ex))
         finally:
+            self.periph_manager.clear_caches()
             self.log.debug("init() result: {}".format(result))
         return result
 
@@ -515,11 +860,26 @@ class MPMServer(RPCServer):
     def _reset_mgr(self):
         """
         Reset the Peripheral Manager for this RPC server.
+
+        In a job, the new Peripheral Manager is created in the job worker
+        thread, but only replaces the old one once the job is done (see
+        _finish_job()), because the RPC methods must only be registered
+        from the RPC server thread.
         """
         self.log.info("Resetting peripheral manager.")
         self.periph_manager.tear_down()
+        if get_current_job() is not None:
+            self._new_periph_manager = self._mgr_generator()
+            return
         self.periph_manager = None
-        self.periph_manager = self._mgr_generator()
+        self._swap_mgr(self._mgr_generator())
+
+    def _swap_mgr(self, periph_manager):
+        """
+        Make periph_manager the Peripheral Manager for this RPC server, and
+        register its RPC methods
+        """
+        self.periph_manager = periph_manager
         self._init_rpc_calls(self.periph_manager)
         # Clear the method cache in order to remove stale references to
         # methods from the old peripheral manager (the one before reset)
@@ -528,6 +888,7 @@ class MPMServer(RPCServer):
         device_info = self.periph_manager.get_device_info()
         self._state.dev_fpga_type.value = \
                 to_binary_str(device_info.get("fpga", "n/a"))
+        self._state.changed()
 
     def reset_timer_and_mgr(self, token):
         """
@@ -544,20 +905,27 @@ class MPMServer(RPCServer):
             raise RuntimeError("Attempt to reset manager without valid claim.")
 
         # Stop the timer, reset_timer_and_mgr can take some time:
-        with self._timeout_disabler():
-            try:
-                self._reset_mgr()
-                self.log.debug("Reset the periph manager")
-            except Exception as ex:
-                self.log.error(
-                    "Error in reset_timer_and_mgr: {}".format(
-                        ex
-                    ))
-                self._last_error = str(ex)
+        with self._timeout_disabler(), self._jobs.call():
+            self._reset_timer_and_mgr()
 
         self.log.debug("End of reset_timer_and_mgr")
         self._reset_timer()
 
+    def _reset_timer_and_mgr(self):
+        """
+        Reset the peripheral manager, without the claim check and timer
+        handling of reset_timer_and_mgr()
+        """
+        try:
+            self._reset_mgr()
+            self.log.debug("Reset the periph manager")
+        except Exception as ex:
+            self.log.error(
+                "Error in reset_timer_and_mgr: {}".format(
+                    ex
+                ))
+            self._last_error = str(ex)
+
     def update_component(self, token, file_metadata_l, data_l):
         """"
         Updates the device component files specified by the metadata and data
@@ -572,40 +940,85 @@ class MPMServer(RPCServer):
                 )
             self.log.error(self._last_error)
             raise RuntimeError("Attempt to update component without valid claim.")
-        with self._timeout_disabler():
-            result = self.periph_manager.update_component(file_metadata_l, data_l)
-            if not result:
-                component_ids = [metadata['id'] for metadata in file_metadata_l]
-                raise RuntimeError("Failed to update components: {}".format(component_ids))
-
-            # Check if we need to reset the peripheral manager
-            reset_now = False
-            for metadata, data in zip(file_metadata_l, data_l):
-                # Make sure the component is in the updateable_components
-                component_id = metadata['id']
-                if component_id in self.periph_manager.updateable_components:
-                    # Check if that updating that component means the PM should be reset
-                    reset_now = (reset_now or
-                                 self.periph_manager.updateable_components[component_id]['reset']) and \
-                                 not metadata.get('reset', "").lower() == "false"
-                else:
-                    self.log.debug("ID {} not in updateable components ({})".format(
-                        component_id, self.periph_manager.updateable_components))
-            try:
-                self.log.trace("Reset after updating component? {}".format(reset_now))
-                if reset_now:
-                    self._reset_mgr()
-                    self.log.debug("Reset the periph manager")
-            except Exception as ex:
-                self.log.error(
-                    "Error in update_component while resetting: {}".format(
-                        ex
-                    ))
-                self._last_error = str(ex)
+        with self._timeout_disabler(), self._jobs.call():
+            self._update_component(file_metadata_l, data_l)
 
         self.log.debug("End of update_component")
         self._reset_timer()
 
+    def _update_component(self, file_metadata_l, data_l):
+        """
+        Update the components, without the claim check and timer handling of
+        update_component()
+        """
+        result = self.periph_manager.update_component(file_metadata_l, data_l)
+        if not result:
+            component_ids = [metadata['id'] for metadata in file_metadata_l]
+            raise RuntimeError("Failed to update components: {}".format(component_ids))
+        self._reset_mgr_after_update(file_metadata_l)
+
+    def commit_component_upload(self, token, filenames):
+        """
+        Finish chunked uploads of component files (see the
+        begin_component_upload() call), and install the files like
+        update_component() does. All files which go together, like a
+        bitfile and its device tree, must be committed in one call.
+        :param filenames: List of the filenames from the metadata of the
+                          uploads
+        """
+        if not self._check_token_valid(token):
+            self._last_error =\
+                "Attempt to commit component upload without valid claim from {}".format(
+                    self.client_host
+                )
+            self.log.error(self._last_error)
+            raise RuntimeError("Attempt to commit component upload without valid claim.")
+        with self._timeout_disabler(), self._jobs.call():
+            self._commit_component_upload(filenames)
+
+        self.log.debug("End of commit_component_upload")
+        self._reset_timer()
+
+    def _commit_component_upload(self, filenames):
+        """
+        Install uploaded components, without the claim check and timer
+        handling of commit_component_upload()
+        """
+        metadata_l = self.periph_manager.install_uploaded_components(filenames)
+        self._reset_mgr_after_update(metadata_l)
+
+    def _reset_mgr_after_update(self, file_metadata_l):
+        """
+        Reset the peripheral manager, if one of the components which were just
+        updated requires it
+        """
+        # Check if we need to reset the peripheral manager
+        reset_now = False
+        for metadata in file_metadata_l:
+            # Make sure the component is in the updateable_components
+            component_id = metadata['id']
+            if component_id in self.periph_manager.updateable_components:
+                # Check if that updating that component means the PM should be reset
+                reset_now = (reset_now or
+                             self.periph_manager.updateable_components[component_id]['reset']) and \
+                             not metadata.get('reset', "").lower() == "false"
+            else:
+                self.log.debug("ID {} not in updateable components ({})".format(
+                    component_id, self.periph_manager.updateable_components))
+        if reset_now:
+            report_progress(1.0, "Resetting peripheral manager")
+        try:
+            self.log.trace("Reset after updating component? {}".format(reset_now))
+            if reset_now:
+                self._reset_mgr()
+                self.log.debug("Reset the periph manager")
+        except Exception as ex:
+            self.log.error(
+                "Error in update_component while resetting: {}".format(
+                    ex
+                ))
+            self._last_error = str(ex)
+
 def _is_connection_local(client_hostname):
     return client_hostname in net.get_local_ip_addrs()
 
@@ -616,7 +1029,7 @@ def _rpc_server_process(shared_state, port, default_args):
     """
     This is the actual process that's running the RPC server.
     """
-    connections = Pool(1000)
+    connections = Pool(MAX_CONNECTIONS)
     server = StreamServer(
         ('0.0.0.0', port),
         handle=MPMServer(shared_state, default_args),
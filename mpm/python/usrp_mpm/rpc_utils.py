@@ -8,6 +8,19 @@
 Implements decorators and utility functions to be used with the RPC server
 """
 
+import copy
+import functools
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from itertools import count
+from gevent import spawn
+from gevent.event import Event
+from gevent.lock import Semaphore
+from gevent.threadpool import ThreadPool
+from usrp_mpm.mpmlog import get_original
+
 def no_claim(func):
     " Decorator for functions that require no token check "
     func._notok = True
@@ -18,6 +31,60 @@ def no_rpc(func):
     func._norpc = True
     return func
 
+def cached(ttl):
+    """
+    Decorator for read-mostly methods of periph managers and dboards: The
+    return value is cached for ttl seconds, per object and arguments. Calls
+    with keyword arguments or with arguments which can't be hashed are not
+    cached, nor are exceptions.
+
+    Use clear_cache() when the answers of these methods change, see also
+    PeriphManagerBase.cache_invalidating_methods.
+    """
+    def decorator(func):
+        name = func.__name__
+        @functools.wraps(func)
+        def cached_func(self, *args, **kwargs):
+            if kwargs:
+                return func(self, *args, **kwargs)
+            cache = self.__dict__.get('_rpc_cache')
+            if cache is None:
+                cache = self._rpc_cache = RpcCache()
+            return cache.call(name, ttl, func, self, args)
+        cached_func._cache_ttl = ttl
+        return cached_func
+    return decorator
+
+def clear_cache(obj):
+    """
+    Drop all values which methods of obj decorated with @cached have cached
+    """
+    cache = obj.__dict__.get('_rpc_cache')
+    if cache is not None:
+        cache.clear()
+
+def get_cache_stats(obj):
+    """
+    Return the cache statistics of the methods of obj decorated with @cached,
+    see RpcCache.get_stats()
+    """
+    cache = obj.__dict__.get('_rpc_cache')
+    return cache.get_stats() if cache is not None else {}
+
+def get_cached_value(method, args):
+    """
+    Return (True, value) if method, a bound method decorated with @cached,
+    has a value cached for args, even if it expired. Otherwise, return
+    (False, None). This never calls method.
+    """
+    obj = getattr(method, '__self__', None)
+    if obj is None or not hasattr(method, '_cache_ttl'):
+        return False, None
+    cache = obj.__dict__.get('_rpc_cache')
+    if cache is None:
+        return False, None
+    return cache.peek(method.__name__, tuple(args))
+
 def get_map_for_rpc(map, log):
     """
     ensure the map contains only string values otherwise it cannot be
@@ -29,3 +96,477 @@ def get_map_for_rpc(map, log):
             log.warning('casting parameter "{}" from None to "n/a"'.format(key))
             map[key] = "n/a"
     return map
+
+
+MAX_FINISHED_JOBS = 32 # Number of finished jobs which can still be polled
+
+class JobCancelled(Exception):
+    """
+    Raised by report_progress() when the job it reports for was cancelled
+    """
+
+# The job which the current thread is running, see job_context()
+_job_context = threading.local()
+
+@contextmanager
+def job_context(job):
+    """
+    Make report_progress() calls within this context update job. The RPC
+    server wraps every call it runs as a job into this.
+    """
+    _job_context.job = job
+    try:
+        yield job
+    finally:
+        _job_context.job = None
+
+def get_current_job():
+    """
+    Return the job which the current thread is running, or None
+    """
+    return getattr(_job_context, 'job', None)
+
+def report_progress(progress, status=""):
+    """
+    Report the progress of a long running call, which can be polled while it
+    runs as a job (see MPMServer.start_job()). progress is the fraction of
+    the work that's done (0.0 to 1.0), status is a short description of the
+    current step.
+
+    This is also the point where a job can be cancelled: if a client
+    cancelled the job, and it can still be cancelled (see disable_cancel()),
+    JobCancelled is raised. Outside of a job, this does nothing, so it's
+    safe to call from any method.
+    """
+    job = get_current_job()
+    if job is None:
+        return
+    if job.cancel_requested and job.cancellable:
+        raise JobCancelled("Job {} was cancelled".format(job.job_id))
+    job.progress = progress
+    job.status = status
+
+def disable_cancel():
+    """
+    Make the job which the current thread is running run to its end, even if
+    it gets cancelled. Call this before changes to the device which must not
+    be left half done, like installing a set of component files. Outside of
+    a job, this does nothing.
+    """
+    job = get_current_job()
+    if job is not None:
+        job.cancellable = False
+
+class RpcJob:
+    """
+    A call which runs in the worker thread of a JobRunner.
+
+    The worker thread only writes state (when the job starts running),
+    cancellable, progress and status (see report_progress()). Everything
+    else is written from the RPC server thread.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    def __init__(self, job_id, method):
+        self.job_id = job_id
+        self.method = method
+        self.state = self.PENDING
+        self.progress = 0.0
+        self.status = ""
+        self.result = None
+        self.error = ""
+        self.cancel_requested = False
+        self.cancellable = True
+        self.start_time = time.time()
+        self.start_ns = time.monotonic_ns()
+        self.end_time = None
+        self.done_event = Event()
+
+    def is_done(self):
+        """
+        Returns True if the job won't run anymore
+        """
+        return self.state in (self.DONE, self.FAILED, self.CANCELLED)
+
+    def get_info(self):
+        """
+        Return the state of the job as a dictionary
+        """
+        end_time = self.end_time if self.end_time is not None else time.time()
+        return {
+            'id': self.job_id,
+            'method': self.method,
+            'state': self.state,
+            'progress': self.progress,
+            'status': self.status,
+            'result': self.result,
+            'error': self.error,
+            'elapsed': end_time - self.start_time,
+        }
+
+class JobRunner:
+    """
+    Runs long running calls as jobs in a worker thread, one after the other,
+    in the order they were started, see MPMServer.start_job().
+
+    Jobs are kept apart from the RPC calls which use the periph manager.
+    Those calls run within call(): They wait while a job is running or
+    waiting to run, and a job waits until the calls in progress have
+    returned. Any number of calls can be in progress at the same time.
+    Calls which may run alongside jobs use call(wait=False), they only
+    keep jobs from starting while they run.
+
+    Only the job functions run in the worker thread. Everything else,
+    including the on_done callback of a job, runs on the greenlets of the
+    RPC server thread.
+    """
+    def __init__(self, log):
+        self.log = log
+        self._pool = ThreadPool(1)
+        # Held by the job which is running, until its on_done callback
+        # returned
+        self._job_lock = Semaphore()
+        self._jobs = {}
+        self._job_ids = count(1)
+        self._num_calls = 0
+        # Jobs which were started, but aren't done yet
+        self._num_jobs = 0
+        # The methods of these jobs, by job ID
+        self._unfinished = {}
+        self._no_calls = Event()
+        self._no_calls.set()
+        self._no_jobs = Event()
+        self._no_jobs.set()
+
+    def start(self, method, function, args, on_done=None):
+        """
+        Start a job which runs function(*args) in the worker thread, and
+        return it. on_done(job) is called when the job is done, before any
+        other call or job can run.
+        """
+        job = RpcJob(next(self._job_ids), method)
+        self._jobs[job.job_id] = job
+        self._prune()
+        self._num_jobs += 1
+        self._unfinished[job.job_id] = method
+        self._no_jobs.clear()
+        spawn(self._job_worker, job, function, args, on_done)
+        return job
+
+    def get(self, job_id):
+        """
+        Return the job with the ID job_id
+        """
+        if job_id not in self._jobs:
+            raise RuntimeError("Unknown job: {}".format(job_id))
+        return self._jobs[job_id]
+
+    def cancel(self, job_id):
+        """
+        Cancel a job. Returns False if the job is done, or can't be cancelled
+        anymore (see disable_cancel()).
+        """
+        job = self.get(job_id)
+        if job.is_done() or not job.cancellable:
+            return False
+        job.cancel_requested = True
+        return True
+
+    def cancel_all(self):
+        """
+        Cancel all jobs which aren't done yet, as far as they can be cancelled
+        """
+        for job in self._jobs.values():
+            if not job.is_done():
+                job.cancel_requested = True
+
+    def has_unfinished(self, methods):
+        """
+        Returns True if a job which runs one of methods is waiting to run,
+        or running, or its on_done callback hasn't returned yet
+        """
+        return any(method in methods for method in self._unfinished.values())
+
+    @contextmanager
+    def call(self, wait=True):
+        """
+        Context for an RPC call which uses the periph manager. Waits until
+        no job is running or waiting to run, unless wait is False.
+        """
+        while wait and self._num_jobs:
+            self._no_jobs.wait()
+        self._num_calls += 1
+        self._no_calls.clear()
+        try:
+            yield
+        finally:
+            self._num_calls -= 1
+            if not self._num_calls:
+                self._no_calls.set()
+
+    def _prune(self):
+        """
+        Forget the oldest finished jobs, keeping MAX_FINISHED_JOBS
+        """
+        finished = [job_id for job_id, job in self._jobs.items() if job.is_done()]
+        for job_id in finished[:-MAX_FINISHED_JOBS]:
+            del self._jobs[job_id]
+
+    def _job_worker(self, job, function, args, on_done):
+        """
+        The greenlet which waits for a job. It hands the call to the worker
+        thread.
+        """
+        try:
+            while self._num_calls:
+                self._no_calls.wait()
+            with self._job_lock:
+                result, error, trace = \
+                    self._pool.apply(self._run_job, (job, function, args))
+                if isinstance(error, JobCancelled):
+                    job.state = RpcJob.CANCELLED
+                elif error is not None:
+                    self.log.error(
+                        "Job %d (%s) failed: %s \n %s ",
+                        job.job_id, job.method, str(error), trace
+                    )
+                    job.error = str(error)
+                    job.state = RpcJob.FAILED
+                else:
+                    job.result = result
+                    job.state = RpcJob.DONE
+                job.end_time = time.time()
+                if on_done is not None:
+                    try:
+                        on_done(job)
+                    except Exception as ex:
+                        self.log.error("Finishing job %d (%s) failed: %s",
+                                       job.job_id, job.method, str(ex))
+        finally:
+            self._num_jobs -= 1
+            del self._unfinished[job.job_id]
+            if not self._num_jobs:
+                self._no_jobs.set()
+            job.done_event.set()
+            self.log.debug("Job %d finished: %s", job.job_id, job.state)
+
+    @staticmethod
+    def _run_job(job, function, args):
+        """
+        Runs in the job worker thread. Returns the result, the exception
+        which the job raised (or None), and its traceback. The thread pool
+        would print exceptions which are raised here.
+        """
+        if job.cancel_requested:
+            return None, JobCancelled(), ""
+        job.state = RpcJob.RUNNING
+        try:
+            with job_context(job):
+                return function(*args), None, ""
+        except Exception as ex:
+            return None, ex, traceback.format_exc()
+
+class _MethodStats:
+    """
+    Counters and latency histogram of one RPC method, see RpcStats
+    """
+    __slots__ = ('calls', 'errors', 'total_ns', 'max_ns', 'buckets')
+
+    def __init__(self, num_buckets):
+        self.calls = 0
+        self.errors = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.buckets = [0] * num_buckets
+
+class RpcStats:
+    """
+    Call counts, error counts, and latency histograms of RPC methods.
+
+    The histograms have logarithmic buckets: bucket 0 counts calls which
+    took less than 1 us, and bucket n > 0 counts calls which took from
+    2**(n-1) us up to 2**n us. The last bucket also counts all slower
+    calls.
+
+    Recording a call only updates a few counters of the method, and takes
+    no lock, so record() and reset() must only be called from the RPC
+    server's main thread (the gevent hub thread). The counters don't yield
+    to other greenlets, so they are never updated concurrently. This holds
+    for the wrappers of RPC calls, and for jobs, which are recorded by
+    JobRunner's on_done callback on that thread rather than by the job
+    worker thread. Other threads, like the job worker thread or the thread
+    pools of the daughterboards, must not record calls. get_stats() may be
+    called from any thread, and reset() swaps in a new dictionary instead
+    of clearing the old one.
+    """
+    # 2**31 us is about 36 minutes
+    NUM_BUCKETS = 32
+
+    def __init__(self):
+        self._methods = {}
+        self._since = time.time()
+
+    def record(self, method, duration_ns, failed=False):
+        """
+        Account for a call to method which took duration_ns nanoseconds.
+        Must be called from the RPC server's main thread.
+        """
+        stats = self._methods.get(method)
+        if stats is None:
+            stats = self._methods[method] = _MethodStats(self.NUM_BUCKETS)
+        stats.calls += 1
+        if failed:
+            stats.errors += 1
+        stats.total_ns += duration_ns
+        if duration_ns > stats.max_ns:
+            stats.max_ns = duration_ns
+        bucket = min((duration_ns // 1000).bit_length(), self.NUM_BUCKETS - 1)
+        stats.buckets[bucket] += 1
+
+    def reset(self):
+        """
+        Clear all statistics
+        """
+        self._methods = {}
+        self._since = time.time()
+
+    @staticmethod
+    def _get_percentile_us(buckets, calls, fraction):
+        """
+        Return the upper bound of the bucket which holds the call at the
+        given fraction of the calls
+        """
+        rank = max(int(calls * fraction + 0.5), 1)
+        count = 0
+        for bucket, bucket_calls in enumerate(buckets):
+            count += bucket_calls
+            if count >= rank:
+                return 1 << bucket
+        return 1 << (len(buckets) - 1)
+
+    def get_stats(self):
+        """
+        Return the statistics of every method which was called since the
+        last reset as a dictionary. Latencies are in microseconds. The
+        percentiles are the upper bounds of the buckets they fall into.
+        The histogram only lists buckets which aren't empty, as
+        (upper bound, number of calls) pairs.
+        """
+        methods = {}
+        for method, stats in list(self._methods.items()):
+            methods[method] = {
+                'calls': stats.calls,
+                'errors': stats.errors,
+                'total_us': stats.total_ns // 1000,
+                'mean_us': stats.total_ns // (1000 * stats.calls),
+                'max_us': stats.max_ns // 1000,
+                'p50_us': self._get_percentile_us(stats.buckets, stats.calls, 0.5),
+                'p99_us': self._get_percentile_us(stats.buckets, stats.calls, 0.99),
+                'histogram': [
+                    (1 << bucket, count)
+                    for bucket, count in enumerate(stats.buckets) if count
+                ],
+            }
+        return {
+            'since': self._since,
+            'methods': methods,
+        }
+
+class RpcCache:
+    """
+    The values cached by the @cached methods of one object, and how often
+    they were found in the cache.
+
+    Cached methods are called from the greenlets of the RPC server's main
+    thread, and from the job worker thread, at the same time. The lock is
+    a real one, but it's only held to look up and store values, never
+    while a method runs.
+
+    Callers get copies of the cached values, so they may modify them. A
+    cached method may yield to other greenlets, so clear() may run while a
+    value is computed: that value may already be stale, and is returned but
+    not stored.
+    """
+    def __init__(self):
+        # (method, args) -> (expiry time, value)
+        self._entries = {}
+        # method -> [hits, misses]
+        self._counts = {}
+        self._num_clears = 0
+        self._lock = get_original('_thread', 'allocate_lock')()
+
+    def call(self, name, ttl, func, obj, args):
+        """
+        Return (a copy of) the cached value of func(obj, *args), or call it
+        if there is none, or it's older than ttl seconds.
+        """
+        key = (name, args)
+        now = time.monotonic()
+        with self._lock:
+            try:
+                entry = self._entries.get(key)
+            except TypeError:
+                # Unhashable arguments, e.g. lists
+                entry = None
+                counts = None
+            else:
+                counts = self._counts.setdefault(name, [0, 0])
+                if entry is not None and now < entry[0]:
+                    counts[0] += 1
+                    return copy.deepcopy(entry[1])
+                counts[1] += 1
+            num_clears = self._num_clears
+        value = func(obj, *args)
+        if counts is not None:
+            stored = copy.deepcopy(value)
+            with self._lock:
+                if num_clears == self._num_clears:
+                    self._entries[key] = (now + ttl, stored)
+        return value
+
+    def peek(self, name, args):
+        """
+        Return (True, value) if a value of the method name is cached for
+        args, even if it expired, and (False, None) otherwise. Counts as a
+        hit.
+        """
+        with self._lock:
+            try:
+                entry = self._entries.get((name, args))
+            except TypeError:
+                return False, None
+            if entry is None:
+                return False, None
+            self._counts[name][0] += 1
+            return True, copy.deepcopy(entry[1])
+
+    def clear(self):
+        """
+        Drop all cached values
+        """
+        with self._lock:
+            self._entries = {}
+            self._num_clears += 1
+
+    def get_stats(self):
+        """
+        Return the hits, misses and hit rate of every method, and how often
+        the cache was cleared.
+        """
+        methods = {}
+        with self._lock:
+            counts = {name: tuple(count) for name, count in self._counts.items()}
+        for name, (hits, misses) in counts.items():
+            methods[name] = {
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': hits / (hits + misses),
+            }
+        return {
+            'clears': self._num_clears,
+            'methods': methods,
+        }
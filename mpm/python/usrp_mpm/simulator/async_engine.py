@@ -0,0 +1,189 @@
+#
+# Copyright 2024 Ettus Research, a National Instruments Brand
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+This module contains the asyncio engine for the simulator. Instead of
+one thread per stream plus a socket thread, the endpoint and all of its
+streams run as coroutines on a single event loop.
+
+Select it with engine = asyncio in the [simulator] section of the
+config file (see config.py).
+"""
+import asyncio
+from threading import Thread
+from .chdr_endpoint import ChdrEndpoint, SendWrapper, CHDR_WIDTHS
+from .chdr_stream import ChdrOutputStream, ChdrInputStream
+
+class AsyncSendWrapper(SendWrapper):
+    """Sends packets directly from the event loop thread.
+
+    Scatter/gather sends go straight to the socket. If the socket is
+    busy, or the transport still has data buffered (which must go out
+    first to keep packets in order), the buffers are joined and handed
+    to the transport instead.
+
+    There is one socket per xport. Packets to a peer go out on the
+    socket it last sent from.
+    """
+    def __init__(self, endpoint, socks):
+        super().__init__(None)
+        self.endpoint = endpoint
+        self.socks = socks
+        self.transports = [None] * len(socks)
+        self.peers = {}
+
+    def _get_xport(self, addr):
+        return self.peers.get(addr, 0)
+
+    def send_data(self, data, addr):
+        xport = self._get_xport(addr)
+        if self.endpoint.recorder is not None:
+            self.endpoint.record_tx(data, addr, xport)
+        self.transports[xport].sendto(data, addr)
+
+    def send_buffers(self, buffers, addr):
+        xport = self._get_xport(addr)
+        if self.endpoint.recorder is not None:
+            self.endpoint.record_tx(buffers, addr, xport)
+        transport = self.transports[xport]
+        if transport.get_write_buffer_size() == 0:
+            try:
+                self.socks[xport].sendmsg(buffers, (), 0, addr)
+                return
+            except BlockingIOError:
+                pass
+        transport.sendto(b"".join(buffers), addr)
+
+class ChdrProtocol(asyncio.DatagramProtocol):
+    """Feeds datagrams received on the CHDR socket of one xport to
+    the endpoint
+    """
+    def __init__(self, endpoint, xport):
+        self.endpoint = endpoint
+        self.xport = xport
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.endpoint.send_wrapper.peers[addr] = self.xport
+        response = self.endpoint.handle_datagram(data, len(data), addr, self.xport)
+        if response is not None:
+            self.transport.sendto(response, addr)
+
+    def error_received(self, exc):
+        self.endpoint.log.warning("CHDR socket error: {}".format(exc))
+
+class AsyncChdrInputStream(ChdrInputStream):
+    """A ChdrInputStream whose worker is a coroutine on the running
+    event loop. It must be created from the loop thread.
+    """
+    def _start(self):
+        # Not bounded: this is filled from datagram_received(), which
+        # can't wait. queue_packet() drops data packets beyond the queue
+        # depth instead.
+        self.rx_queue = asyncio.Queue()
+        self.task = asyncio.get_running_loop().create_task(self._rx_task())
+
+    async def _rx_task(self):
+        self.log.info("Stream RX Task Starting")
+        while not self.stop:
+            batch = [await self.rx_queue.get()]
+            while not self.rx_queue.empty():
+                batch.append(self.rx_queue.get_nowait())
+            self._process_batch(batch)
+        self.sample_sink.close()
+        self.log.info("Stream RX Task Done")
+
+    def finish(self):
+        self.stop = True
+        self.rx_queue.put_nowait((None, None, None))
+
+class AsyncChdrOutputStream(ChdrOutputStream):
+    """A ChdrOutputStream whose worker is a coroutine on the running
+    event loop. Packets are paced by the loop's timer instead of
+    sleeping or spinning. It must be created from the loop thread.
+    """
+    def _start(self):
+        self.strs_queue = asyncio.Queue(100)
+        self.task = asyncio.get_running_loop().create_task(self._tx_task())
+
+    async def _tx_task(self):
+        self._log_start()
+        budget = 0
+        for send_data, send_len in self._generate_packets():
+            if budget == 0:
+                # Always yield to the loop, even when running behind, so
+                # one stream can't starve the socket and the other streams
+                await asyncio.sleep(0)
+                budget, wait_ns = self.pacer.poll()
+                while budget == 0:
+                    await asyncio.sleep(wait_ns / 1e9)
+                    budget, wait_ns = self.pacer.poll()
+            budget -= 1
+
+            # Check Flow Control to assert there is space downstream
+            while not self._can_fit_packet(send_len):
+                strs_update = await self.strs_queue.get()
+                self._update_recv(strs_update.get_payload_strs())
+
+            self.send_wrapper.send_buffers(send_data, self.stream_spec.addr)
+            self.xfer.count_packet(send_len)
+            self.pacer.sent()
+
+        self._log_finish()
+        self.sample_source.close()
+        self.done = True
+
+class AsyncChdrEndpoint(ChdrEndpoint):
+    """A ChdrEndpoint which runs the CHDR socket, the RFNoC graph and
+    all streams on one asyncio event loop in a background thread.
+    """
+    def __init__(self, log, config):
+        # pylint: disable=super-init-not-called
+        # The base class constructor starts the threaded socket worker
+        self.log = log.getChild("ChdrEndpoint")
+        self.config = config
+        self.chdr_w = CHDR_WIDTHS[config.hardware.chdr_width]
+        self.xport_map = {}
+
+        self.socks = self.open_sockets()
+        for sock in self.socks:
+            sock.setblocking(False)
+        self.send_wrapper = AsyncSendWrapper(self, self.socks)
+        self.recorder = self.create_recorder()
+
+        self.graph = self.create_graph(self.send_wrapper, AsyncChdrOutputStream,
+                                       AsyncChdrInputStream)
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread(target=self.loop_worker, daemon=True)
+        self.thread.start()
+
+    def loop_worker(self):
+        """This is the method that runs in a background thread. It
+        runs the event loop which handles all CHDR traffic.
+        """
+        self.log.info("Starting ChdrEndpoint Event Loop")
+        asyncio.set_event_loop(self.loop)
+        for xport, sock in enumerate(self.socks):
+            transport, _ = self.loop.run_until_complete(
+                self.loop.create_datagram_endpoint(
+                    lambda xport=xport: ChdrProtocol(self, xport), sock=sock))
+            self.send_wrapper.transports[xport] = transport
+        self.loop.run_forever()
+        for transport in self.send_wrapper.transports:
+            transport.close()
+        self.loop.close()
+        self.log.info("Stopped ChdrEndpoint Event Loop")
+
+    def close(self):
+        """Stop the event loop, close the sockets and finish the
+        capture, if any
+        """
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        if self.recorder is not None:
+            self.recorder.close()
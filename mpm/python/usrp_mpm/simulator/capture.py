@@ -0,0 +1,153 @@
+#
+# Copyright 2024 Ettus Research, a National Instruments Brand
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+This module contains the PcapRecorder, which captures the raw CHDR
+datagrams of the simulator into a pcap file.
+
+The datagrams are wrapped into synthesized IPv4/UDP headers, so the
+RFNoC dissectors in tools/dissectors decode them just like a capture
+of real hardware.
+
+Enable it with the capture_file key in the [simulator] section of the
+config file (see config.py).
+"""
+
+import os
+import socket
+import struct
+import time
+from usrp_mpm.mpmlog import get_original
+
+# Nanosecond resolution pcap, see
+# https://www.tcpdump.org/manpages/pcap-savefile.5.html
+PCAP_MAGIC_NS = 0xA1B23C4D
+PCAP_VERSION = (2, 4)
+# Every packet begins with an IPv4 header, no link layer
+LINKTYPE_RAW = 101
+SNAPLEN = 0xFFFF
+PCAP_FILE_HEADER = struct.Struct("<IHHiIII")
+PCAP_RECORD_HEADER = struct.Struct("<IIII")
+IPV4_HEADER = struct.Struct("!BBHHHBBH4s4s")
+UDP_HEADER = struct.Struct("!HHHH")
+IP_PROTO_UDP = 17
+IP_TTL = 64
+HEADERS_LEN = IPV4_HEADER.size + UDP_HEADER.size
+
+class PcapRecorder:
+    """Writes datagrams to a pcap file from a background thread.
+
+    record() only puts the datagram into a queue.SimpleQueue, so it is
+    cheap enough to call from the socket thread for every datagram.
+    The writer thread blocks on that queue and does all the formatting
+    and file I/O. It is a real thread, and the queue is the one from
+    before gevent's monkey patching, so the writer never holds up the
+    greenlets of the RPC server. If the writer falls more than
+    max_pending datagrams behind, new datagrams are dropped and counted
+    instead of queued.
+
+    If max_size is set, the recorder runs in ring mode: once the
+    capture file grows past max_size bytes, it is renamed to path.1
+    (path.1 to path.2, and so on) and a new file is started. At most
+    max_files files are kept, the oldest one is deleted.
+    """
+    # How long close() waits for the writer to catch up
+    CLOSE_TIMEOUT = 10.0
+
+    def __init__(self, log, path, max_size=0, max_files=1, max_pending=65536):
+        self.log = log.getChild("PcapRecorder")
+        self.path = path
+        self.max_size = max_size
+        self.max_files = max(max_files, 1)
+        self.max_pending = max_pending
+        self.num_written = 0
+        self.num_dropped = 0
+        self._pending = get_original('queue', 'SimpleQueue')()
+        self._file = None
+        self._file_size = 0
+        self._open_file()
+        # Held by the writer thread until it is done
+        self._stopped = get_original('_thread', 'allocate_lock')()
+        self._stopped.acquire()
+        get_original('_thread', 'start_new_thread')(self._writer_worker, ())
+        self.log.info("Capturing CHDR traffic to {}".format(path))
+
+    def record(self, data, src, dst):
+        """Queue a datagram for writing.
+
+        data must not change after this call, so pass a copy of reused
+        buffers. src and dst are (address, port) tuples.
+        """
+        if self._pending.qsize() >= self.max_pending:
+            self.num_dropped += 1
+            return
+        self._pending.put((time.time_ns(), data, src, dst))
+
+    def close(self):
+        """Write all queued datagrams, then close the capture file"""
+        self._pending.put(None)
+        if not self._stopped.acquire(timeout=self.CLOSE_TIMEOUT):
+            self.log.warning("Capture writer did not finish in time")
+            return
+        self._file.close()
+        self.log.info("Capture done: wrote {} datagrams, dropped {}"
+                      .format(self.num_written, self.num_dropped))
+
+    def get_stats(self):
+        """Return the number of datagrams written and dropped"""
+        return {
+            'written': self.num_written,
+            'dropped': self.num_dropped,
+            'pending': self._pending.qsize(),
+        }
+
+    def _writer_worker(self):
+        pending = self._pending
+        try:
+            while True:
+                if pending.empty():
+                    # Don't keep half written records sitting in the buffer
+                    # while the stream is idle
+                    self._file.flush()
+                item = pending.get()
+                if item is None:
+                    return
+                self._write_record(*item)
+        finally:
+            self._stopped.release()
+
+    def _write_record(self, timestamp, data, src, dst):
+        udp_len = UDP_HEADER.size + len(data)
+        ip_header = IPV4_HEADER.pack(
+            0x45, 0, IPV4_HEADER.size + udp_len, 0, 0, IP_TTL, IP_PROTO_UDP, 0,
+            socket.inet_aton(src[0]), socket.inet_aton(dst[0]))
+        # A zero UDP checksum means "not computed"
+        udp_header = UDP_HEADER.pack(src[1], dst[1], udp_len, 0)
+        pkt_len = HEADERS_LEN + len(data)
+        seconds, nanoseconds = divmod(timestamp, 1000000000)
+        self._file.write(PCAP_RECORD_HEADER.pack(seconds, nanoseconds, pkt_len, pkt_len))
+        self._file.write(ip_header)
+        self._file.write(udp_header)
+        self._file.write(data)
+        self._file_size += PCAP_RECORD_HEADER.size + pkt_len
+        self.num_written += 1
+        if self.max_size and self._file_size >= self.max_size:
+            self._rotate()
+
+    def _open_file(self):
+        self._file = open(self.path, "wb")
+        self._file.write(PCAP_FILE_HEADER.pack(
+            PCAP_MAGIC_NS, *PCAP_VERSION, 0, 0, SNAPLEN, LINKTYPE_RAW))
+        self._file_size = PCAP_FILE_HEADER.size
+
+    def _rotate(self):
+        """Start a new capture file, see the class docstring"""
+        self._file.close()
+        if self.max_files > 1:
+            for index in range(self.max_files - 1, 0, -1):
+                src = self.path if index == 1 else "{}.{}".format(self.path, index - 1)
+                if os.path.exists(src):
+                    os.replace(src, "{}.{}".format(self.path, index))
+        self._open_file()
@@ -8,39 +8,73 @@ packet dispatch, and acts as an interface between these and the RFNoC
 Graph.
 """
 
-from threading import Thread
+import functools
+from threading import Thread, Lock
 import socket
 import queue
 import select
-from uhd.chdr import ChdrPacket, ChdrWidth
+import struct
+from uhd.chdr import ChdrPacket, ChdrWidth, PacketType
+from usrp_mpm.mpmlog import TRACE
 from .rfnoc_graph import XbarNode, XportNode, StreamEndpointNode, RFNoCGraph, NodeType
 from .chdr_stream import ChdrOutputStream, ChdrInputStream
+from .noc_block_regs import ReplayBlock
+from .sample_source import NullSamples
+from .capture import PcapRecorder
 
-CHDR_W = ChdrWidth.W64
+CHDR_WIDTHS = {
+    64: ChdrWidth.W64,
+    128: ChdrWidth.W128,
+    256: ChdrWidth.W256,
+    512: ChdrWidth.W512,
+}
+# The first 64 bits of every CHDR packet, see chdr_types.hpp:chdr_header
+CHDR_HEADER = struct.Struct("<Q")
+CHDR_HEADER_LENGTH_OFFSET = 16
+CHDR_HEADER_PKT_TYPE_OFFSET = 53
+DATA_PKT_TYPES = (int(PacketType.DATA_NO_TS), int(PacketType.DATA_WITH_TS))
 
 class SelectableQueue:
     """ A simple python Queue implementation which can be selected.
     This allows waiting on a queue and a socket simultaneously.
+
+    The signal socket carries at most one pending byte, no matter how
+    many items are queued. The consumer takes every queued item per
+    wakeup using get_all().
     """
     def __init__(self, max_size=0):
         self._queue = queue.Queue(max_size)
         self._send_signal_rx, self._send_signal_tx = socket.socketpair()
+        self._signal_lock = Lock()
+        self._signaled = False
 
     def put(self, item, block=True, timeout=None):
         """ Put an element into the queue, optionally blocking """
         self._queue.put(item, block, timeout)
-        self._send_signal_tx.send(b"\x00")
+        with self._signal_lock:
+            if not self._signaled:
+                self._signaled = True
+                self._send_signal_tx.send(b"\x00")
 
     def fileno(self):
         """ A fileno compatible with select.select """
         return self._send_signal_rx.fileno()
 
-    def get(self):
-        """ Return the first element in the queue, blocking if none
-        are available.
+    def get_all(self):
+        """ Return a list of all elements in the queue, blocking until
+        the queue has been signaled.
         """
-        self._send_signal_rx.recv(1)
-        return self._queue.get_nowait()
+        with self._signal_lock:
+            self._send_signal_rx.recv(1)
+            self._signaled = False
+        items = []
+        # Anything put after the flag was cleared signals again, so
+        # it is fine if this loop picks up some of those items early
+        while True:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                return items
 
 class SendWrapper:
     """This class is used as an abstraction over queueing packets to be
@@ -61,6 +95,12 @@ class SendWrapper:
         """Queue data to be sent to addr"""
         self.queue.put((data, addr))
 
+    def send_buffers(self, buffers, addr):
+        """Queue a list of bytes-like objects to be sent to addr as
+        a single datagram, without joining them first
+        """
+        self.queue.put((buffers, addr))
+
 
 class ChdrEndpoint:
     """This class is created by the sim periph_manager
@@ -70,18 +110,21 @@ class ChdrEndpoint:
 
     The config parameter is a Config object (see simulator/config.py)
     """
+    # Number of datagrams read per wakeup of the socket thread
+    RECV_BATCH = 32
+    MAX_MTU = 8000
+
     def __init__(self, log, config):
         self.log = log.getChild("ChdrEndpoint")
         self.config = config
-        self.source_gen = config.source_gen
-        self.sink_gen = config.sink_gen
+        self.chdr_w = CHDR_WIDTHS[config.hardware.chdr_width]
         self.xport_map = {}
 
         self.send_queue = SelectableQueue()
         self.send_wrapper = SendWrapper(self.send_queue)
+        self.recorder = self.create_recorder()
 
-        self.graph = RFNoCGraph(self.get_default_nodes(), self.log, 0, self.send_wrapper,
-                                CHDR_W, config.hardware.rfnoc_device_type)
+        self.graph = self.create_graph(self.send_wrapper)
         self.thread = Thread(target=self.socket_worker, daemon=True)
         self.thread.start()
 
@@ -95,19 +138,99 @@ class ChdrEndpoint:
         This method is called by the daughterboard. It coresponds to
         sim_dboard.py:sim_db#set_catalina_clock_rate()
         """
-        self.graph.get_stream_spec().sample_rate = rate
+        self.graph.set_sample_rate(rate)
+
+    def close(self):
+        """Stop the socket thread, close the sockets and finish the
+        capture, if any
+        """
+        # None in the send queue tells the socket thread to stop
+        self.send_queue.put(None)
+        self.thread.join()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def get_tx_rate_stats(self):
+        """Return the packet rate statistics of the output streams as
+        a list with one entry per stream endpoint that has transmitted.
+        See PacketPacer.get_stats() for the contents of each entry.
+        """
+        stats = (stream_ep.get_output_stats() for stream_ep in self.graph.stream_ep)
+        return [entry for entry in stats if entry is not None]
 
     def get_default_nodes(self):
         """Get a sensible NoC Core setup. This is the simplest
-        functional layout. It has one of each required component.
+        functional layout: one crossbar, with one xport node per
+        simulated xport, and one stream endpoint per channel.
+
+        The nodes are ordered xports, crossbar, stream endpoints, which
+        is the order the crossbar's port indices refer to. If the device
+        has a Replay block, its stream endpoints follow those of the
+        channels.
         """
-        nodes = [
-            XportNode(0),
-            XbarNode(0, [2], [0]),
-            StreamEndpointNode(0, self.source_gen, self.sink_gen)
-        ]
+        num_xports = self.config.hardware.num_xports
+        num_channels = self.config.hardware.num_channels
+        num_seps = num_channels + self.config.hardware.replay_ports
+        xport_indices = list(range(num_xports))
+        sep_indices = [num_xports + 1 + sep for sep in range(num_seps)]
+        nodes = [XportNode(xport) for xport in xport_indices]
+        nodes.append(XbarNode(0, sep_indices, xport_indices))
+        nodes += [StreamEndpointNode(chan, self.config.get_source_gen(chan),
+                                     self.config.get_sink_gen(chan))
+                  for chan in range(num_channels)]
+        # The graph connects these to the Replay block
+        nodes += [StreamEndpointNode(sep, NullSamples, NullSamples)
+                  for sep in range(num_channels, num_seps)]
         return nodes
 
+    def create_graph(self, send_wrapper, output_stream_cls=ChdrOutputStream,
+                     input_stream_cls=ChdrInputStream):
+        """Create the RFNoCGraph of this endpoint"""
+        hardware = self.config.hardware
+        input_stream_cls = functools.partial(input_stream_cls, **self.config.rx_stream_args)
+        replay_mem = None
+        if hardware.replay_ports:
+            replay_mem = ReplayBlock.create_memory(hardware.replay_mem_addr_w,
+                                                   self.config.replay_mem_file)
+        return RFNoCGraph(self.get_default_nodes(), self.log, 0, send_wrapper,
+                          self.chdr_w, hardware.rfnoc_device_type,
+                          output_stream_cls, input_stream_cls,
+                          hardware.replay_ports, replay_mem)
+
+    def create_recorder(self):
+        """Create the PcapRecorder of this endpoint, or return None if
+        capturing is disabled
+        """
+        if not self.config.capture_file:
+            return None
+        return PcapRecorder(self.log, self.config.capture_file,
+                            self.config.capture_max_size, self.config.capture_max_files)
+
+    def get_local_addr(self, xport):
+        """Return the (address, port) the socket of xport is bound to"""
+        return (self.config.chdr_addr, self.config.chdr_port + xport)
+
+    def record_tx(self, data, addr, xport):
+        """Capture a datagram sent to addr from the socket of xport.
+        data is a bytes-like object or a list of them.
+        """
+        if isinstance(data, list):
+            data = b"".join(data)
+        else:
+            data = bytes(data)
+        self.recorder.record(data, self.get_local_addr(xport), addr)
+
+    def open_sockets(self):
+        """Open and bind one UDP socket per simulated xport, on
+        consecutive ports
+        """
+        socks = []
+        for xport in range(self.config.hardware.num_xports):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(self.get_local_addr(xport))
+            socks.append(sock)
+        return socks
+
     def send_strc(self, stream_ep, addr):
         pass # TODO: currently not implemented
 
@@ -124,40 +247,133 @@ class ChdrEndpoint:
         """This is the method that runs in a background thread. It
         blocks on the CHDR socket and processes packets as they come
         in.
+
+        Every wakeup, up to RECV_BATCH datagrams are read into a
+        preallocated receive ring, and the whole send queue is drained.
         """
         self.log.info("Starting ChdrEndpoint Thread")
-        main_sock = socket.socket(socket.AF_INET,
-                                  socket.SOCK_DGRAM)
-        main_sock.bind(("0.0.0.0", 49153))
+        socks = self.open_sockets()
+        # select() is the only place the worker waits. The sockets must not
+        # block, MSG_DONTWAIT isn't enough: A gevent socket ignores it and
+        # waits for the next datagram unless its timeout is 0.
+        for sock in socks:
+            sock.setblocking(False)
+        xport_of_sock = {sock: xport for xport, sock in enumerate(socks)}
+        # Packets to a peer go out on the socket it last sent from
+        sock_of_peer = {}
+        ring = memoryview(bytearray(ChdrEndpoint.RECV_BATCH * ChdrEndpoint.MAX_MTU))
+        slots = [ring[i * ChdrEndpoint.MAX_MTU:(i + 1) * ChdrEndpoint.MAX_MTU]
+                 for i in range(ChdrEndpoint.RECV_BATCH)]
+        received = [None] * ChdrEndpoint.RECV_BATCH
 
         while True:
             # This allows us to block on multiple sockets at the same time
-            ready_list, _, _ = select.select([main_sock, self.send_queue], [], [])
-            buffer = bytearray(8000) # Max MTU
+            ready_list, _, _ = select.select(socks + [self.send_queue], [], [])
             for sock in ready_list:
-                if sock is main_sock:
-                    # Received Data over socket
-                    n_bytes, sender = main_sock.recvfrom_into(buffer)
-                    self.log.trace("Received {} bytes of data from {}"
-                                   .format(n_bytes, sender))
-                    try:
-                        packet = ChdrPacket.deserialize(CHDR_W, buffer[:n_bytes])
-                        self.log.trace("Decoded Packet: {}"
-                                       .format(packet.to_string_with_payload()))
-                        entry_xport = (NodeType.XPORT, 0)
-                        response = self.graph.handle_packet(packet, entry_xport, sender,
-                                                            sender, n_bytes)
-
-                        if response is not None:
-                            data = response.serialize()
-                            self.log.trace("Returning Packet: {}"
-                                           .format(packet.to_string_with_payload()))
-                            main_sock.sendto(bytes(data), sender)
-                    except BaseException as ex:
-                        self.log.warning("Unable to decode packet: {}"
-                                         .format(ex))
-                        raise ex
-                else:
-                    data, addr = self.send_queue.get()
-                    sent_len = main_sock.sendto(data, addr)
-                    assert len(data) == sent_len, "Didn't send whole packet."
+                if sock is self.send_queue:
+                    continue
+                xport = xport_of_sock[sock]
+                num_recv = self._recv_batch(sock, slots, received)
+                for slot, (n_bytes, sender) in zip(slots, received[:num_recv]):
+                    sock_of_peer[sender] = sock
+                    response = self.handle_datagram(slot, n_bytes, sender, xport)
+                    if response is not None:
+                        self._send(sock, response, sender)
+            if self.send_queue in ready_list:
+                for item in self.send_queue.get_all():
+                    if item is None:
+                        for sock in socks:
+                            sock.close()
+                        self.log.info("Stopped ChdrEndpoint Thread")
+                        return
+                    data, addr = item
+                    main_sock = sock_of_peer.get(addr, socks[0])
+                    if self.recorder is not None:
+                        self.record_tx(data, addr, xport_of_sock[main_sock])
+                    if isinstance(data, list):
+                        data_len = sum(len(buf) for buf in data)
+                    else:
+                        data_len = len(data)
+                    sent_len = self._send(main_sock, data, addr)
+                    assert data_len == sent_len, "Didn't send whole packet."
+
+    @staticmethod
+    def _send(sock, data, addr):
+        """Send data to addr on the non-blocking sock, waiting while its
+        send buffer is full. data is a bytes-like object, or a list of
+        them to be sent as one datagram (see SendWrapper.send_buffers).
+        Returns the number of bytes sent.
+        """
+        while True:
+            try:
+                if isinstance(data, list):
+                    return sock.sendmsg(data, (), 0, addr)
+                return sock.sendto(data, addr)
+            except BlockingIOError:
+                select.select([], [sock], [])
+
+    @staticmethod
+    def _recv_batch(sock, slots, received):
+        """Read up to len(slots) datagrams from the non-blocking sock,
+        one per slot.
+
+        Python has no binding for recvmmsg(), so this reads until the
+        socket is empty.
+        Returns the number of datagrams read. Their sizes and senders
+        are stored in received.
+        """
+        for index, slot in enumerate(slots):
+            try:
+                received[index] = sock.recvfrom_into(slot)
+            except BlockingIOError:
+                return index
+        return len(slots)
+
+    def handle_datagram(self, slot, n_bytes, sender, xport=0):
+        """Validate the header of a received datagram, then deserialize
+        it and pass it through the graph, entering at the xport node
+        with index xport.
+
+        Returns the serialized response packet, or None if there is
+        nothing to send back to sender.
+        """
+        if self.recorder is not None:
+            self.recorder.record(bytes(slot[:n_bytes]), sender,
+                                 self.get_local_addr(xport))
+        if n_bytes < CHDR_HEADER.size:
+            self.log.warning("Dropping runt packet of {} bytes from {}"
+                             .format(n_bytes, sender))
+            return
+        header, = CHDR_HEADER.unpack_from(slot)
+        pkt_len = (header >> CHDR_HEADER_LENGTH_OFFSET) & 0xFFFF
+        if pkt_len > n_bytes:
+            self.log.warning("Dropping truncated packet from {}: header length is {}, "
+                             "received {} bytes".format(sender, pkt_len, n_bytes))
+            return
+        # Decoding is only worth it for control traffic, and only if
+        # anybody is going to see it
+        trace = self.log.isEnabledFor(TRACE) and \
+            ((header >> CHDR_HEADER_PKT_TYPE_OFFSET) & 0x7) not in DATA_PKT_TYPES
+        try:
+            # Passing bytes selects the fast (memcpy) deserialize binding
+            packet = ChdrPacket.deserialize(self.chdr_w, bytes(slot[:pkt_len]))
+            if trace:
+                self.log.trace("Decoded Packet from {}: {}"
+                               .format(sender, packet.to_string_with_payload()))
+            entry_xport = (NodeType.XPORT, xport)
+            response = self.graph.handle_packet(packet, entry_xport, sender,
+                                                sender, n_bytes)
+
+            if response is None:
+                return None
+            if trace:
+                self.log.trace("Returning Packet: {}"
+                               .format(response.to_string_with_payload()))
+            response = bytes(response.serialize())
+            if self.recorder is not None:
+                self.record_tx(response, sender, xport)
+            return response
+        except BaseException as ex:
+            self.log.warning("Unable to decode packet: {}"
+                             .format(ex))
+            raise ex
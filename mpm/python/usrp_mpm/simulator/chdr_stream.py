@@ -9,6 +9,7 @@ handles managing threads, as well as interfacing with sample sources
 and sinks.
 """
 import time
+import struct
 from threading import Thread
 import queue
 import socket
@@ -56,19 +57,151 @@ class XferCount:
     def __str__(self):
         return "XferCount{{num_bytes:{}, num_packets:{}}}".format(self.num_bytes, self.num_packets)
 
+class DataPacketTemplate:
+    """A pre-serialized data packet header.
+
+    The header is serialized once through ChdrPacket. Per packet, only
+    the length, sequence number and (if present) timestamp fields are
+    patched in place. This relies on the header layout being fixed:
+    the first 64-bit word holds dst_epid, length and seq_num and the
+    timestamp always follows in the next 64 bits (RFNoC Specification
+    section 2.2.1). Packets are serialized little endian.
+    """
+    LEN_SEQ = struct.Struct("<HH")
+    LEN_SEQ_OFFSET = 2
+    TIMESTAMP = struct.Struct("<Q")
+    TIMESTAMP_OFFSET = 8
+
+    def __init__(self, chdr_w, dst_epid, has_timestamp=False):
+        header = ChdrHeader()
+        header.dst_epid = dst_epid
+        header.pkt_type = PacketType.DATA_WITH_TS if has_timestamp else PacketType.DATA_NO_TS
+        timestamp = 0 if has_timestamp else None
+        self.has_timestamp = has_timestamp
+        self.header = bytearray(ChdrPacket(chdr_w, header, bytes(0), timestamp).serialize())
+
+    def pack(self, seq_num, payload_len, timestamp=None):
+        """Patch the header for a packet with payload_len bytes of
+        payload and return a copy of it. A copy is returned because
+        the header is queued for the socket thread and this template
+        is reused immediately.
+        """
+        self.LEN_SEQ.pack_into(self.header, self.LEN_SEQ_OFFSET,
+                               len(self.header) + payload_len, seq_num)
+        if self.has_timestamp:
+            self.TIMESTAMP.pack_into(self.header, self.TIMESTAMP_OFFSET, timestamp)
+        return bytes(self.header)
+
+class PacketPacer:
+    """Paces packet transmissions to a target rate.
+
+    Deadlines are computed from the start time and the packet index
+    using time.monotonic_ns(), so timing errors don't accumulate. When
+    the stream falls behind, several packets (up to max_burst) are
+    released per wakeup. Deadlines less than SPIN_NS away are waited
+    for by spinning, because sleep() can't be relied upon at that
+    resolution. The spin still yields with sleep(0) on every iteration,
+    so other greenlets and threads keep running meanwhile.
+
+    If the stream falls more than max_lag packets behind (e.g. while it
+    was blocked on flow control), the missed slots are skipped instead
+    of being caught up on in one long burst.
+    """
+    SPIN_NS = 200000 # 200 us
+    MAX_BURST = 16
+    MAX_LAG = 256
+
+    def __init__(self, seconds_per_packet, max_burst=MAX_BURST, max_lag=MAX_LAG):
+        self.period_ns = seconds_per_packet * 1e9
+        self.max_burst = max_burst
+        self.max_lag = max_lag
+        self.start_ns = time.monotonic_ns()
+        self.stop_ns = None
+        self.next_slot = 0
+        self.num_sent = 0
+        self.num_skipped = 0
+
+    def poll(self):
+        """Returns a tuple (due, wait_ns), where due is the number of
+        packets which may be sent right now, and wait_ns is the time
+        until the next packet is due if due is 0.
+        """
+        now_ns = time.monotonic_ns()
+        due = int((now_ns - self.start_ns) / self.period_ns) + 1 - self.next_slot
+        if due > self.max_lag:
+            self.num_skipped += due - self.max_burst
+            self.next_slot += due - self.max_burst
+            due = self.max_burst
+        if due > 0:
+            return min(due, self.max_burst), 0
+        return 0, self.start_ns + self.next_slot * self.period_ns - now_ns
+
+    def wait(self):
+        """Block until at least one packet is due, and return the
+        number of packets which may be sent right away
+        """
+        while True:
+            due, wait_ns = self.poll()
+            if due > 0:
+                return due
+            if wait_ns > self.SPIN_NS:
+                time.sleep((wait_ns - self.SPIN_NS) / 1e9)
+            else:
+                time.sleep(0)
+
+    def sent(self):
+        """Account for a packet which was sent"""
+        self.next_slot += 1
+        self.num_sent += 1
+
+    def stop(self):
+        """Freeze the statistics at the current time"""
+        self.stop_ns = time.monotonic_ns()
+
+    def get_stats(self):
+        """Return the target and achieved packet rates in packets/sec,
+        along with the packet counts they were computed from
+        """
+        end_ns = self.stop_ns if self.stop_ns is not None else time.monotonic_ns()
+        elapsed = max(end_ns - self.start_ns, 1) / 1e9
+        return {
+            'target_rate': 1e9 / self.period_ns,
+            'actual_rate': self.num_sent / elapsed,
+            'num_sent': self.num_sent,
+            'num_skipped': self.num_skipped,
+        }
+
 class ChdrInputStream:
     """This class encapsulates an Rx Thread. This thread blocks on a
     queue which receives STRC and DATA ChdrPackets. It places the data
     packets into the sample_sink and responds to the STRC packets using
     the send_wrapper
+
+    The stream models an ingress buffer of capacity_bytes bytes, which
+    holds up to queue_depth packets. Both are reported to the host in
+    every STRS, so a host which obeys flow control never overruns it.
+    Data packets which arrive while the buffer is full are dropped and
+    counted, like in hardware. STRC packets are always accepted. Buffer
+    occupancy is tracked with two counters, one written by the producer
+    and one by the worker, so queue_packet() doesn't need a lock.
+
+    Flow control updates are coalesced: the worker processes every
+    packet that is queued when it wakes up, then sends at most one STRS
+    with the final transfer counts. An update is due when the host's
+    STRC frequency is reached, or every strs_interval packets if that
+    is set.
     """
-    CAPACITY_BYTES = int(5e3) # 5 KB
-    QUEUE_CAP = 3
-    def __init__(self, log, chdr_w, sample_sink, send_wrapper, our_epid):
+    CAPACITY_BYTES = 1024 * 1024 # 1 MiB
+    QUEUE_DEPTH = 256
+    def __init__(self, log, chdr_w, sample_sink, send_wrapper, our_epid,
+                 capacity_bytes=CAPACITY_BYTES, queue_depth=QUEUE_DEPTH, strs_interval=0):
         self.log = log
         self.chdr_w = chdr_w
         self.sample_sink = sample_sink
         self.send_wrapper = send_wrapper
+        self.capacity_bytes = capacity_bytes
+        self.queue_depth = queue_depth
+        self.strs_interval = strs_interval
         self.xfer = XferCount()
         self.accum = XferCount()
         self.fc_freq = None
@@ -76,51 +209,91 @@ class ChdrInputStream:
         self.command_addr = None
         self.command_epid = None
         self.our_epid = our_epid
-        self.rx_queue = queue.Queue(ChdrInputStream.QUEUE_CAP)
+        self.strs_due = False
+        # Buffer occupancy is queued_bytes - consumed_bytes, see the
+        # class docstring
+        self.queued_bytes = 0
+        self.consumed_bytes = 0
+        self.num_overruns = 0
         self.stop = False
+        self._start()
+
+    def _start(self):
+        """Start the worker thread. The asyncio engine overrides this
+        to run the worker as a coroutine instead.
+        """
+        # Not bounded: STRC packets and the stop marker must always fit.
+        # queue_packet() drops data packets beyond the queue depth.
+        self.rx_queue = queue.Queue()
         self.thread = Thread(target=self._rx_worker, daemon=True)
         self.thread.start()
 
     def _rx_worker(self):
         self.log.info("Stream RX Worker Starting")
-        while True:
-            packet, recv_len, addr = self.rx_queue.get()
-            # This break is here because when ChdrInputStream.stop() is called,
-            # a tuple of 3 None values is pushed into the queue to unblock the worker.
+        while not self.stop:
+            batch = [self.rx_queue.get()]
+            try:
+                while True:
+                    batch.append(self.rx_queue.get_nowait())
+            except queue.Empty:
+                pass
+            self._process_batch(batch)
+
+        self.sample_sink.close()
+        self.log.info("Stream RX Worker Done")
+
+    def _process_batch(self, batch):
+        """Process a list of (packet, recv_len, addr) tuples, then send
+        a flow control update if one became due
+        """
+        for packet, recv_len, addr in batch:
+            # When ChdrInputStream.finish() is called, a tuple of 3
+            # None values is queued to unblock the worker.
             if self.stop:
-                break
-            header = packet.get_header()
-            self.xfer.count_packet(recv_len)
-            self.accum.count_packet(recv_len)
-            pkt_type = header.pkt_type
-            if pkt_type in (PacketType.DATA_WITH_TS, PacketType.DATA_NO_TS):
-                self.sample_sink.accept_packet(packet)
-            elif pkt_type == PacketType.STRC:
-                req_payload = packet.get_payload_strc()
-                # Ping doesn't change anything, just requests a stream status packet
-                if req_payload.op_code == StrcOpCode.INIT:
-                    self.xfer.clear()
-                    self.fc_freq = XferCount.from_strc(req_payload)
-                    self.command_addr = addr
-                    self.command_epid = req_payload.src_epid
-                elif req_payload.op_code == StrcOpCode.RESYNC:
-                    self.xfer = XferCount.from_strc(req_payload)
-                resp_packet = self._generate_strs_packet(req_payload.src_epid, self.our_epid)
-                self.send_wrapper.send_packet(resp_packet, addr)
-            else:
-                raise RuntimeError("RX Worker received unsupported packet: {}".format(pkt_type))
+                return
+            self._process_packet(packet, recv_len, addr)
+            self.consumed_bytes += recv_len
+        if self.strs_due:
+            self.strs_due = False
+            self.accum.clear()
+            self.log.trace("Flow Control Due, sending STRS")
+            self.command_target = None
+            resp_packet = self._generate_strs_packet(self.command_epid, self.our_epid)
+            self.send_wrapper.send_packet(resp_packet, self.command_addr)
 
-            # Check if a fc status packet is due
-            if self.fc_freq is not None and self.accum.has_exceeded(self.fc_freq):
+    def _process_packet(self, packet, recv_len, addr):
+        """Hand a data packet to the sample_sink or respond to a STRC
+        packet, then check if a flow control update is due
+        """
+        header = packet.get_header()
+        self.xfer.count_packet(recv_len)
+        self.accum.count_packet(recv_len)
+        pkt_type = header.pkt_type
+        if pkt_type in (PacketType.DATA_WITH_TS, PacketType.DATA_NO_TS):
+            self.sample_sink.accept_packet(packet)
+        elif pkt_type == PacketType.STRC:
+            req_payload = packet.get_payload_strc()
+            # Ping doesn't change anything, just requests a stream status packet
+            if req_payload.op_code == StrcOpCode.INIT:
+                self.xfer.clear()
                 self.accum.clear()
-                self.log.trace("Flow Control Due, sending STRS")
-                self.command_target = None
-                resp_packet = self._generate_strs_packet(self.command_epid, self.our_epid)
-                self.log.trace("Sending Flow Control: {}".format(resp_packet.to_string_with_payload()))
-                self.send_wrapper.send_packet(resp_packet, self.command_addr)
+                self.strs_due = False
+                self.fc_freq = XferCount.from_strc(req_payload)
+                self.command_addr = addr
+                self.command_epid = req_payload.src_epid
+            elif req_payload.op_code == StrcOpCode.RESYNC:
+                self.xfer = XferCount.from_strc(req_payload)
+            resp_packet = self._generate_strs_packet(req_payload.src_epid, self.our_epid)
+            self.send_wrapper.send_packet(resp_packet, addr)
+            return
+        else:
+            raise RuntimeError("RX Worker received unsupported packet: {}".format(pkt_type))
 
-        self.sample_sink.close()
-        self.log.info("Stream RX Worker Done")
+        if self.fc_freq is None:
+            return
+        if self.accum.has_exceeded(self.fc_freq) or \
+                (self.strs_interval and self.accum.num_packets >= self.strs_interval):
+            self.strs_due = True
 
     def finish(self):
         """Unblocks the worker and stops the thread.
@@ -136,16 +309,44 @@ class ChdrInputStream:
         resp_payload = StrsPayload()
         resp_payload.src_epid = src_epid
         resp_payload.status = StrsStatus.OKAY
-        resp_payload.capacity_bytes = ChdrInputStream.CAPACITY_BYTES
-        resp_payload.capacity_pkts = 0xFFFFFF
+        resp_payload.capacity_bytes = self.capacity_bytes
+        resp_payload.capacity_pkts = self.queue_depth
         resp_payload.xfer_count_bytes = self.xfer.num_bytes
         resp_payload.xfer_count_pkts = self.xfer.num_packets
         resp_packet = ChdrPacket(self.chdr_w, resp_header, resp_payload)
         return resp_packet
 
+    def _overrun(self, message):
+        """Count a dropped packet and log why. Only the first overrun is
+        a warning, the host won't stop at one.
+        """
+        self.num_overruns += 1
+        log = self.log.warning if self.num_overruns == 1 else self.log.debug
+        log("{} on EPID {}, dropping a packet ({} dropped so far)"
+            .format(message, self.our_epid, self.num_overruns))
+
     def queue_packet(self, packet, recv_len, addr):
-        """Queue a packet to be processed by the ChdrInputStream"""
-        self.rx_queue.put((packet, recv_len, addr))
+        """Queue a data packet to be processed by the ChdrInputStream, or
+        drop it if it doesn't fit into the ingress buffer
+        """
+        if self.rx_queue.qsize() >= self.queue_depth:
+            self._overrun("Ingress queue overrun: {} packets queued".format(self.queue_depth))
+            return
+        occupancy = self.queued_bytes - self.consumed_bytes
+        if occupancy + recv_len > self.capacity_bytes:
+            self._overrun("Ingress buffer overrun: {} of {} bytes in use, {} more arrived"
+                          .format(occupancy, self.capacity_bytes, recv_len))
+            return
+        self.queued_bytes += recv_len
+        self.rx_queue.put_nowait((packet, recv_len, addr))
+
+    def queue_strc(self, packet, recv_len, addr):
+        """Queue a STRC packet to be processed by the ChdrInputStream.
+        These are never dropped, even if the ingress buffer is full: the
+        host would wait for the STRS in response forever.
+        """
+        self.queued_bytes += recv_len
+        self.rx_queue.put_nowait((packet, recv_len, addr))
 
 class ChdrOutputStream:
     """This class encapsulates a Tx Thread. It takes data from its
@@ -164,23 +365,79 @@ class ChdrOutputStream:
         self.xfer = XferCount()
         self.recv = XferCount()
         self.stop = False
-        self.strs_queue = queue.Queue(100)
+        # Set once the worker has sent its last packet
+        self.done = False
         self.strc_seq_num = 0
         self.data_seq_num = 0
+        self.pacer = PacketPacer(stream_spec.seconds_per_packet())
+        self._start()
 
+    def _start(self):
+        """Start the worker thread. The asyncio engine overrides this
+        to run the worker as a coroutine instead.
+        """
+        self.strs_queue = queue.Queue(100)
         self.thread = Thread(target=self._tx_worker, daemon=True)
         self.thread.start()
 
     def _tx_worker(self):
+        self._log_start()
+        budget = 0
+        for send_data, send_len in self._generate_packets():
+            if budget == 0:
+                budget = self.pacer.wait()
+            budget -= 1
+
+            # Check Flow Control to assert there is space downstream
+            while not self._can_fit_packet(send_len):
+                strs_update = self.strs_queue.get()
+                strs_payload = strs_update.get_payload_strs()
+                self._update_recv(strs_payload)
+
+            self.send_wrapper.send_buffers(send_data, self.stream_spec.addr)
+            self.xfer.count_packet(send_len)
+            self.pacer.sent()
+
+        self._log_finish()
+        self.sample_source.close()
+        self.done = True
+
+    def _log_start(self):
         self.log.info("Stream TX Worker Starting with {} packets/sec"
                       .format(1/self.stream_spec.seconds_per_packet()))
         self.log.info("Downstream Buffer Capacity: {} packets or {} bytes"
                       .format(self.stream_spec.capacity_packets, self.stream_spec.capacity_bytes))
+
+    def _log_finish(self):
+        self.pacer.stop()
+        stats = self.pacer.get_stats()
+        self.log.info("Stream Worker Done")
+        self.log.info("Actual Packet Rate was {:.1f} packets/sec (target: {:.1f} packets/sec, "
+                      "{} slots skipped)".format(stats['actual_rate'], stats['target_rate'],
+                                                 stats['num_skipped']))
+
+    def get_rate_stats(self):
+        """Return the target and achieved packet rate of this stream
+        (see PacketPacer.get_stats)
+        """
+        return self.pacer.get_stats()
+
+    def _generate_packets(self):
+        """Generate the data packets of this stream until the stream
+        is stopped, the requested number of samples was produced, or
+        the sample_source is exhausted.
+
+        Every packet is yielded as a (buffers, length) tuple, where
+        buffers is a list of bytes-like objects making up the packet
+        (see SendWrapper.send_buffers).
+        """
         header = ChdrHeader()
-        start_time = time.time()
-        next_send = start_time
         header.dst_epid = self.stream_spec.dst_epid
         header.pkt_type = PacketType.DATA_NO_TS
+        template = DataPacketTemplate(self.chdr_w, self.stream_spec.dst_epid)
+        # Sources which implement next_payload() skip building a
+        # ChdrPacket per data packet, see DataPacketTemplate
+        use_template = True
 
         is_continuous = self.stream_spec.is_continuous
         num_samps_left = None
@@ -195,41 +452,40 @@ class ChdrOutputStream:
             if self.stop:
                 self.log.info("Stream Worker Stopped")
                 break
-            header.seq_num = self.data_seq_num
+            seq_num = self.data_seq_num
             # When seq_num gets to 65535 (Max Unsigned 16 bit integer)
             # It wraps back around to 0
             self.data_seq_num = int(self.data_seq_num + 1) & 0xFFFF
-            packet = ChdrPacket(self.chdr_w, header, bytes(0), timestamp)
             packet_samples = self.stream_spec.packet_samples
             if num_samps_left is not None:
                 packet_samples = min(packet_samples, num_samps_left)
                 num_samps_left -= packet_samples
-            packet = self.sample_source.fill_packet(packet, packet_samples)
-            if packet is None:
-                break
-            send_data = bytes(packet.serialize()) # Serialize before waiting
-
-            delay = next_send - time.time()
-            if delay > 0:
-                time.sleep(delay)
-            next_send = next_send + self.stream_spec.seconds_per_packet()
+            if use_template:
+                payload = self.sample_source.next_payload(packet_samples)
+                if payload is NotImplemented:
+                    self.log.debug("Sample source doesn't implement next_payload(), "
+                                   "serializing every packet")
+                    use_template = False
+                elif payload is None:
+                    break
+                else:
+                    # Only the first packet of a timed stream carries a timestamp
+                    packet_template = template if timestamp is None \
+                        else DataPacketTemplate(self.chdr_w, header.dst_epid, True)
+                    send_data = [packet_template.pack(seq_num, len(payload), timestamp),
+                                 payload]
+                    send_len = len(send_data[0]) + len(payload)
+            if not use_template:
+                header.seq_num = seq_num
+                packet = ChdrPacket(self.chdr_w, header, bytes(0), timestamp)
+                packet = self.sample_source.fill_packet(packet, packet_samples)
+                if packet is None:
+                    break
+                send_data = [bytes(packet.serialize())]
+                send_len = len(send_data[0])
 
             timestamp = None
-
-            # Check Flow Control to assert there is space downstream
-            while not self._can_fit_packet(len(send_data)):
-                strs_update = self.strs_queue.get()
-                strs_payload = strs_update.get_payload_strs()
-                self._update_recv(strs_payload)
-
-            self.send_wrapper.send_data(send_data, self.stream_spec.addr)
-            self.xfer.count_packet(len(send_data))
-
-        self.log.info("Stream Worker Done")
-        finish_time = time.time()
-        self.log.info("Actual Packet Rate was {} packets/sec"
-                      .format(self.xfer.num_packets/(finish_time - start_time)))
-        self.sample_source.close()
+            yield send_data, send_len
 
     def finish(self):
         """Stops the ChdrOutputStream"""
@@ -11,15 +11,21 @@ it identifies itself as.
 """
 
 import configparser
+import functools
 from .sample_source import sinks, sources, NullSamples, from_import_path
 from .hardware_presets import presets
 import numbers
 
+# Default UDP port of the first CHDR transport
+CHDR_PORT = 49153
+
 class HardwareDescriptor:
     """This class contains the various magic numbers that are needed to
     identify specific hardware to UHD
     """
-    def __init__(self, product, uhd_device_type, description, pid, serial_num, dboard_class, rfnoc_device_type):
+    def __init__(self, product, uhd_device_type, description, pid, serial_num, dboard_class,
+                 rfnoc_device_type, num_channels=1, num_xports=1, replay_ports=0,
+                 replay_mem_addr_w=28, chdr_width=64):
         """
         product -> MPM Product, stored in PeriphManager.mboard_info['product']
             e.g. "e320", "b200"
@@ -35,6 +41,17 @@ class HardwareDescriptor:
         rfnoc_device_type -> Device Type read from NoC Core Registers
             see defaults.hpp:device_type_t
             e.g. 0xE320, 0xA300
+        num_channels -> Number of simulated channels. Every channel gets its
+            own stream endpoint and radio block.
+        num_xports -> Number of transport ports. Transport n listens on
+            UDP port chdr_port + n (see Config).
+        replay_ports -> Number of ports of the simulated Replay block.
+            0 means the device has no Replay block. Every port gets its
+            own stream endpoint.
+        replay_mem_addr_w -> Address width of the Replay block's memory,
+            i.e. the memory holds 2**replay_mem_addr_w bytes
+        chdr_width -> Width of the CHDR bus in bits. One of 64, 128, 256
+            or 512
         """
         self.product = product
         self.uhd_device_type = uhd_device_type
@@ -43,6 +60,15 @@ class HardwareDescriptor:
         self.serial_num = serial_num
         self.dboard_class = dboard_class
         self.rfnoc_device_type = rfnoc_device_type
+        self.num_channels = int(num_channels)
+        self.num_xports = int(num_xports)
+        if self.num_channels < 1 or self.num_xports < 1:
+            raise RuntimeError("A simulated device needs at least one channel and one xport")
+        self.replay_ports = int(replay_ports)
+        self.replay_mem_addr_w = int(replay_mem_addr_w)
+        self.chdr_width = int(chdr_width)
+        if self.chdr_width not in (64, 128, 256, 512):
+            raise RuntimeError("Unsupported CHDR width: {}".format(self.chdr_width))
 
     @classmethod
     def from_dict(cls, dict):
@@ -52,7 +78,12 @@ class HardwareDescriptor:
             dict['pid'],
             dict['serial_num'],
             dict['dboard_class'],
-            dict['rfnoc_device_type'])
+            dict['rfnoc_device_type'],
+            dict.get('num_channels', 1),
+            dict.get('num_xports', 1),
+            dict.get('replay_ports', 0),
+            dict.get('replay_mem_addr_w', 28),
+            dict.get('chdr_width', 64))
 
 class Config:
     """This class represents a configuration file for the usrp simulator.
@@ -64,11 +95,79 @@ class Config:
     Source/Sink class to instanitate (see the decorators in
     sample_source.py). The other key value pairs in the section are
     passed to the source/sink constructor as strings through **kwargs
+
+    On devices with several channels (see num_channels in the [hardware]
+    section), every stream gets its own source or sink. Sections named
+    [sample.source.N] and [sample.sink.N] override the defaults for
+    channel N.
+
+    An optional [simulator] section configures the simulator itself:
+    engine -> How the CHDR endpoint and its streams are run. One of
+        "threads" (default, one thread per stream) or "asyncio" (all
+        streams run as coroutines on one event loop)
+    replay_mem_file -> If set, the memory of the Replay block is mapped
+        from this file instead of being allocated, so it persists
+        between runs.
+    chdr_addr -> Address the CHDR sockets are bound to (default: all)
+    chdr_port -> UDP port of the first CHDR transport (default: 49153)
+    capture_file -> If set, all CHDR datagrams are captured into this
+        pcap file (see capture.py)
+    capture_max_size -> If set, the capture runs in ring mode, starting
+        a new file whenever the current one grows beyond this many bytes
+    capture_max_files -> Number of files kept in ring mode (default: 1)
+    rx_buffer_bytes -> Size of the ingress buffer of every stream into
+        the simulator, reported to the host as flow control capacity
+        (default: 1 MiB)
+    rx_queue_depth -> Number of packets that ingress buffer holds
+        (default: 256)
+    rx_strs_interval -> If set, a flow control update is sent after at
+        most this many packets, even if the host asked for fewer
     """
-    def __init__(self, source_gen, sink_gen, hardware):
+    ENGINES = ("threads", "asyncio")
+
+    def __init__(self, source_gen, sink_gen, hardware, engine="threads",
+                 channel_source_gens=None, channel_sink_gens=None, replay_mem_file=None,
+                 chdr_addr="0.0.0.0", chdr_port=CHDR_PORT, capture_file=None,
+                 capture_max_size=0, capture_max_files=1,
+                 rx_buffer_bytes=None, rx_queue_depth=None, rx_strs_interval=None):
         self.source_gen = source_gen
         self.sink_gen = sink_gen
+        self.channel_source_gens = channel_source_gens or {}
+        self.channel_sink_gens = channel_sink_gens or {}
         self.hardware = hardware
+        if engine not in Config.ENGINES:
+            raise RuntimeError("Unknown simulator engine '{}', use one of {}"
+                               .format(engine, Config.ENGINES))
+        self.engine = engine
+        self.replay_mem_file = replay_mem_file
+        self.chdr_addr = chdr_addr
+        self.chdr_port = int(chdr_port)
+        self.capture_file = capture_file
+        self.capture_max_size = int(capture_max_size)
+        self.capture_max_files = int(capture_max_files)
+        # None selects the defaults of ChdrInputStream
+        self.rx_stream_args = {
+            key: int(value) for key, value in (('capacity_bytes', rx_buffer_bytes),
+                                               ('queue_depth', rx_queue_depth),
+                                               ('strs_interval', rx_strs_interval))
+            if value is not None
+        }
+
+    def get_source_gen(self, chan):
+        """Return the SampleSource generator for channel chan"""
+        return self._bind_device(self.channel_source_gens.get(chan, self.source_gen))
+
+    def get_sink_gen(self, chan):
+        """Return the SampleSink generator for channel chan"""
+        return self._bind_device(self.channel_sink_gens.get(chan, self.sink_gen))
+
+    def _bind_device(self, gen):
+        """Pass the serial number to the generators of sample classes
+        which keep state per device (see LoopbackSink)
+        """
+        if getattr(gen, 'per_device', False):
+            return functools.partial(gen, device=self.hardware.serial_num)
+        return gen
 
     @classmethod
     def from_path(cls, log, path):
@@ -86,6 +185,37 @@ class Config:
         if 'sample.sink' in parser:
             sink_gen = Config._read_sample_section(parser['sample.sink'], sinks)
             parser.pop('sample.sink')
+        channel_source_gens = {}
+        channel_sink_gens = {}
+        for section in parser.sections():
+            prefix, _, chan = section.rpartition('.')
+            if prefix == 'sample.source' and chan.isdigit():
+                channel_source_gens[int(chan)] = \
+                    Config._read_sample_section(parser[section], sources)
+                parser.pop(section)
+            elif prefix == 'sample.sink' and chan.isdigit():
+                channel_sink_gens[int(chan)] = \
+                    Config._read_sample_section(parser[section], sinks)
+                parser.pop(section)
+        engine = "threads"
+        replay_mem_file = None
+        chdr_addr = "0.0.0.0"
+        chdr_port = CHDR_PORT
+        capture_file = None
+        capture_max_size = 0
+        capture_max_files = 1
+        rx_args = {}
+        if 'simulator' in parser:
+            engine = parser['simulator'].get('engine', engine)
+            replay_mem_file = parser['simulator'].get('replay_mem_file', None)
+            chdr_addr = parser['simulator'].get('chdr_addr', chdr_addr)
+            chdr_port = parser['simulator'].get('chdr_port', chdr_port)
+            capture_file = parser['simulator'].get('capture_file', None)
+            capture_max_size = parser['simulator'].get('capture_max_size', capture_max_size)
+            capture_max_files = parser['simulator'].get('capture_max_files', capture_max_files)
+            rx_args = {key: value for key, value in parser['simulator'].items()
+                       if key in ('rx_buffer_bytes', 'rx_queue_depth', 'rx_strs_interval')}
+            parser.pop('simulator')
         hardware_section = dict(parser['hardware'])
         preset_name = hardware_section.get('preset', None)
         hardware_preset = presets[preset_name].copy() if preset_name is not None else {}
@@ -99,7 +229,10 @@ class Config:
             # This helps stop you from shooting yourself in the foot when you add
             # the [sampel.sink] section
             log.warning("Unrecognized section in config file: {}".format(unused_section))
-        return cls(source_gen, sink_gen, hardware)
+        return cls(source_gen, sink_gen, hardware, engine,
+                   channel_source_gens, channel_sink_gens, replay_mem_file,
+                   chdr_addr, chdr_port, capture_file, capture_max_size,
+                   capture_max_files, **rx_args)
 
     @staticmethod
     def _read_sample_section(section, lookup):
@@ -111,8 +244,9 @@ class Config:
             constructor = from_import_path(class_name, import_path)
         else:
             constructor = lookup[class_name]
-        def section_gen():
-            return constructor(**args)
+        def section_gen(**kwargs):
+            return constructor(**args, **kwargs)
+        section_gen.per_device = getattr(constructor, 'per_device', False)
         return section_gen
 
     @classmethod
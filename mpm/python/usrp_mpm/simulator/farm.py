@@ -0,0 +1,171 @@
+#
+# Copyright 2024 Ettus Research, a National Instruments Brand
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+This module runs a farm of simulated devices in a single process, for
+testing discovery, claiming and streaming with many devices.
+
+Every device gets its own RPC server, discovery socket and CHDR
+endpoint, but they all share the process and its gevent hub. Devices
+are told apart either by address (device n listens on addr_base + n
+using the standard MPM ports, which works on the 127.0.0.0/8 loopback
+network without any setup) or by port (all devices share addr_base,
+device n uses the PORTS_PER_DEVICE ports from port_base + n *
+PORTS_PER_DEVICE on). In the latter case, UHD must be given the
+discovery_port and rpc_port device args.
+"""
+
+import ipaddress
+import socket
+import sys
+import threading
+from multiprocessing import Process
+from gevent import signal
+from gevent import spawn
+from gevent.pool import Pool
+from gevent.server import StreamServer
+from usrp_mpm import discovery
+from usrp_mpm.mpmlog import get_main_logger
+from usrp_mpm.mpmtypes import SharedState, MPM_DISCOVERY_PORT, MPM_RPC_PORT
+from .config import CHDR_PORT, Config
+
+# Discovery, RPC, and up to 14 CHDR transports
+PORTS_PER_DEVICE = 16
+MAX_CHDR_PORTS = PORTS_PER_DEVICE - 2
+
+def get_device_endpoints(index, addr_base, port_base=None):
+    """
+    Return the (address, discovery port, RPC port, first CHDR port) of
+    device number index of a farm.
+    """
+    if port_base is None:
+        addr = str(ipaddress.IPv4Address(addr_base) + index)
+        return addr, MPM_DISCOVERY_PORT, MPM_RPC_PORT, CHDR_PORT
+    base = port_base + index * PORTS_PER_DEVICE
+    return addr_base, base, base + 1, base + 2
+
+def check_device_args(log, default_args, port_base=None):
+    """
+    Raise a RuntimeError if the devices of a farm with these device args
+    have more CHDR transports than fit into their ports. This is only an
+    issue if the devices are told apart by port.
+    """
+    if port_base is None:
+        return
+    if 'config' in default_args:
+        config = Config.from_path(log, default_args['config'])
+    else:
+        config = Config.default()
+    if config.hardware.num_xports > MAX_CHDR_PORTS:
+        raise RuntimeError(
+            "Devices of a farm told apart by port have at most {} CHDR transports, "
+            "the config asks for {}".format(MAX_CHDR_PORTS, config.hardware.num_xports))
+
+def get_device_serial(index):
+    """
+    Return the serial number of device number index of a farm. It must
+    fit into SharedState.dev_serial.
+    """
+    return "SIMF{:04X}".format(index)
+
+class SimulatedDevice:
+    """
+    One device of a farm: its shared state, RPC server and discovery
+    socket.
+    """
+    def __init__(self, log, index, default_args, addr_base, port_base):
+        # Importing the RPC server monkey patches the process, which must
+        # only happen in the farm process
+        from usrp_mpm.rpc_server import MPMServer, MAX_CONNECTIONS
+        self.index = index
+        self.addr, self.discovery_port, self.rpc_port, self.chdr_port = \
+            get_device_endpoints(index, addr_base, port_base)
+        self.log = log.getChild(get_device_serial(index))
+        device_args = dict(default_args)
+        device_args['sim_serial'] = get_device_serial(index)
+        device_args['sim_chdr_addr'] = self.addr
+        device_args['sim_chdr_port'] = str(self.chdr_port)
+        self.state = SharedState()
+        self.server = StreamServer(
+            (self.addr, self.rpc_port),
+            handle=MPMServer(self.state, device_args),
+            spawn=Pool(MAX_CONNECTIONS))
+        self.discovery_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.discovery_sock.bind((self.addr, self.discovery_port))
+        self.discovery_sock.setsockopt(
+            socket.IPPROTO_IP, discovery.IP_MTU_DISCOVER, discovery.IP_PMTUDISC_DO)
+        self.responder = discovery.DiscoveryResponder(self.state, self.log)
+
+    def start(self):
+        """
+        Start serving RPC and discovery requests
+        """
+        self.server.start()
+        spawn(self._discovery_worker)
+
+    def stop(self):
+        """
+        Stop serving RPC requests
+        """
+        self.server.stop()
+
+    def get_uhd_args(self):
+        """
+        Return the device args which select this device in UHD
+        """
+        args = "addr={}".format(self.addr)
+        if self.discovery_port != MPM_DISCOVERY_PORT:
+            args += ",discovery_port={},rpc_port={}".format(
+                self.discovery_port, self.rpc_port)
+        return args
+
+    def _discovery_worker(self):
+        buf = bytearray(discovery.MAX_SOCK_BUFSIZ)
+        while True:
+            batch = discovery.recv_batch(self.discovery_sock, buf)
+            self.responder.handle_batch(self.discovery_sock, batch)
+
+def _farm_process(num_devices, default_args, addr_base, port_base):
+    """
+    The process running all devices of a farm. Is spawned by
+    spawn_farm_process().
+    """
+    log = get_main_logger().getChild('farm')
+    devices = []
+    for index in range(num_devices):
+        device = SimulatedDevice(log, index, default_args, addr_base, port_base)
+        device.start()
+        log.info("Device %d ready: %s", index, device.get_uhd_args())
+        devices.append(device)
+    log.info("Farm of %d simulated devices is running.", num_devices)
+    # See rpc_server.py:_rpc_server_process() for why the servers aren't
+    # stopped from the signal handlers
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *args: stop_event.set())
+    stop_event.wait()
+    for device in devices:
+        device.stop()
+    sys.exit(0)
+
+def spawn_farm_process(num_devices, default_args, addr_base="127.0.0.1", port_base=None):
+    """
+    Returns a process which runs num_devices simulated devices.
+
+    Arguments:
+    num_devices -- Number of devices
+    default_args -- Device args for every device. A config in here is
+                    shared by all devices.
+    addr_base -- Address of the first device, see module docstring
+    port_base -- If given, all devices use addr_base and are told apart
+                 by port instead
+    """
+    check_device_args(get_main_logger().getChild('farm'), default_args, port_base)
+    proc = Process(
+        target=_farm_process,
+        args=[num_devices, default_args, addr_base, port_base],
+    )
+    proc.start()
+    return proc
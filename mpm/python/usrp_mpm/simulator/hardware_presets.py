@@ -6,5 +6,24 @@ presets['E320'] = {
     'description': "E320-Series Device - SIMULATED",
     'pid': 0xE320,
     'dboard_class': "SimulatedCatalinaDboard",
-    'rfnoc_device_type': 0xE320
+    'rfnoc_device_type': 0xE320,
+    'num_channels': 1,
+    'num_xports': 1,
 }
+
+# Multi-channel variants, e.g. for streaming load tests. These don't
+# correspond to real hardware.
+presets['E320_4CH'] = dict(presets['E320'],
+                           description="E320-Series Device, 4 Channels - SIMULATED",
+                           num_channels=4,
+                           num_xports=2)
+
+presets['E320_8CH'] = dict(presets['E320'],
+                           description="E320-Series Device, 8 Channels - SIMULATED",
+                           num_channels=8,
+                           num_xports=2)
+
+# An E320 with a Replay block, for testing uhd.usrp.dram_utils
+presets['E320_REPLAY'] = dict(presets['E320'],
+                              description="E320-Series Device with Replay Block - SIMULATED",
+                              replay_ports=2)
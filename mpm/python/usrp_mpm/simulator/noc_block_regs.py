@@ -3,6 +3,11 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 #
+import os
+from threading import Lock
+import numpy as np
+from .rfnoc_common import StreamSpec
+from .sample_source import SampleSource, SampleSink
 
 # Read Register Addresses
 #! Register address of the protocol version
@@ -36,6 +41,50 @@ RX_CMD_FINITE = 0x1
 
 RADIO_BASE_ADDR = 0x1000
 REG_CHAN_OFFSET = 128 # 0x80
+RADIO_NOC_ID = 0x12AD1000
+
+# See replay_block_control.cpp
+REPLAY_NOC_ID = 0x4E91A000
+REPLAY_COMPAT = (1 << 16) | 2
+REPLAY_PORT_OFFSET = 256
+REPLAY_WORD_SIZE = 8 # bytes
+REPLAY_CMD_FIFO_SIZE = 32
+REG_REPLAY_COMPAT = 0x00
+REG_REPLAY_MEM_SIZE = 0x04
+REG_REC_RESTART = 0x08
+REG_REC_BASE_ADDR_LO = 0x10
+REG_REC_BASE_ADDR_HI = 0x14
+REG_REC_BUFFER_SIZE_LO = 0x18
+REG_REC_BUFFER_SIZE_HI = 0x1C
+REG_REC_FULLNESS_LO = 0x20
+REG_REC_FULLNESS_HI = 0x24
+REG_PLAY_BASE_ADDR_LO = 0x28
+REG_PLAY_BASE_ADDR_HI = 0x2C
+REG_PLAY_BUFFER_SIZE_LO = 0x30
+REG_PLAY_BUFFER_SIZE_HI = 0x34
+REG_PLAY_CMD_NUM_WORDS_LO = 0x38
+REG_PLAY_CMD_NUM_WORDS_HI = 0x3C
+REG_PLAY_CMD_TIME_LO = 0x40
+REG_PLAY_CMD_TIME_HI = 0x44
+REG_PLAY_CMD = 0x48
+REG_PLAY_WORDS_PER_PKT = 0x4C
+REG_PLAY_ITEM_SIZE = 0x50
+REG_REC_POS_LO = 0x54
+REG_REC_POS_HI = 0x58
+REG_PLAY_POS_LO = 0x5C
+REG_PLAY_POS_HI = 0x60
+REG_PLAY_CMD_FIFO_SPACE = 0x64
+
+PLAY_CMD_STOP = 0x0
+PLAY_CMD_FINITE = 0x1
+PLAY_CMD_CONTINUOUS = 0x2
+# See replay_block_control.cpp
+PLAY_CMD_MASK = 0x3
+PLAY_CMD_TIMED = 1 << 31
+PLAY_CMD_NO_EOB = 1 << 30
+# Playback isn't tied to a sample rate. This bounds the packet rate
+# (in bytes per second), in practice flow control limits it first.
+PLAY_RATE = 1e9
 
 
 class StreamEndpointPort:
@@ -108,6 +157,266 @@ class NocBlock:
     def read_noc_id(self):
         return self.noc_id & 0xFFFFFFFF
 
+    def read_ctrl(self, addr):
+        """Read a register of this block over its control port.
+        Blocks which have registers override this.
+        """
+        raise NotImplementedError("Block 0x{:08X} has no register at 0x{:08X}"
+                                  .format(self.noc_id, addr))
+
+    def write_ctrl(self, addr, value):
+        """Write a register of this block over its control port.
+        Blocks which have registers override this.
+        """
+        raise NotImplementedError("Block 0x{:08X} has no register at 0x{:08X}"
+                                  .format(self.noc_id, addr))
+
+def _set_lo(value, low):
+    return (value & ~0xFFFFFFFF) | (low & 0xFFFFFFFF)
+
+def _set_hi(value, high):
+    return (value & 0xFFFFFFFF) | ((high & 0xFFFFFFFF) << 32)
+
+class ReplayPort:
+    """The register state of one port of a ReplayBlock"""
+    def __init__(self):
+        self.rec_base = 0
+        self.rec_size = 0
+        self.rec_fullness = 0
+        self.play_base = 0
+        self.play_size = 0
+        self.play_num_words = 0
+        self.play_spec = StreamSpec()
+        self.words_per_pkt = 0
+        self.item_size = 4
+        self.player = None
+
+class ReplayBlock(NocBlock):
+    """Simulates a Replay (DRAM) block, see replay_block_control.hpp
+
+    The memory is a NumPy array, or a NumPy memmap of a file if one is
+    given (see create_memory()). Every port has an input, which records
+    into the memory, and an output, which plays back from it. Recording
+    stops when the record buffer is full. Data arriving after that is
+    dropped (the hardware back-pressures instead). Playback wraps around
+    at the end of the play buffer.
+
+    Playback streams are started and stopped through the callbacks
+    start_play(port, stream_spec, sample_source) and stop_play(port).
+    """
+    def __init__(self, log, num_ports, memory, start_play, stop_play):
+        super().__init__(1 << 16, num_ports, num_ports, 512, 1, REPLAY_NOC_ID, 16)
+        self.log = log.getChild("Replay")
+        self.memory = memory
+        self.mem_addr_w = (len(memory) - 1).bit_length()
+        self.ports = [ReplayPort() for _ in range(num_ports)]
+        self.start_play = start_play
+        self.stop_play = stop_play
+        # Records and register accesses come from different threads
+        self.lock = Lock()
+
+    @staticmethod
+    def create_memory(mem_addr_w, path=None):
+        """Create the memory of a ReplayBlock with 2**mem_addr_w bytes.
+        If path is given, the memory is mapped from that file, which is
+        created or resized as needed. Otherwise it is allocated
+        (lazily, by the OS).
+        """
+        mem_size = 1 << mem_addr_w
+        if path is None:
+            return np.zeros(mem_size, dtype=np.uint8)
+        mode = 'r+' if os.path.exists(path) and os.path.getsize(path) == mem_size else 'w+'
+        return np.memmap(path, dtype=np.uint8, mode=mode, shape=(mem_size,))
+
+    def record(self, port, payload):
+        """Write the payload of a data packet received on port into
+        the record buffer. Returns the number of bytes written.
+        """
+        with self.lock:
+            rec = self.ports[port]
+            num_bytes = min(len(payload), rec.rec_size - rec.rec_fullness)
+            start = rec.rec_base + rec.rec_fullness
+            self.memory[start:start + num_bytes] = \
+                np.frombuffer(payload, dtype=np.uint8, count=num_bytes)
+            rec.rec_fullness += num_bytes
+        if num_bytes < len(payload):
+            self.log.debug("Record buffer of port {} full, dropped {} bytes"
+                           .format(port, len(payload) - num_bytes))
+        return num_bytes
+
+    def _get_port(self, port, addr):
+        """Return the state of the port which addr belongs to, or None
+        (with a warning) if the block has no such port
+        """
+        if port < len(self.ports):
+            return self.ports[port]
+        self.log.warning("Port {} not supported, ignoring access to 0x{:08X}"
+                         .format(port, addr))
+        return None
+
+    def read_ctrl(self, addr):
+        port, reg = divmod(addr, REPLAY_PORT_OFFSET)
+        if reg == REG_REPLAY_COMPAT:
+            return REPLAY_COMPAT
+        if reg == REG_REPLAY_MEM_SIZE:
+            return ((REPLAY_WORD_SIZE * 8) << 16) | self.mem_addr_w
+        state = self._get_port(port, addr)
+        if state is None:
+            return 0
+        player = state.player
+        play_pos = state.play_base if player is None else player.pos
+        value = {
+            REG_REC_BASE_ADDR_LO: state.rec_base,
+            REG_REC_BASE_ADDR_HI: state.rec_base >> 32,
+            REG_REC_BUFFER_SIZE_LO: state.rec_size,
+            REG_REC_BUFFER_SIZE_HI: state.rec_size >> 32,
+            REG_REC_FULLNESS_LO: state.rec_fullness,
+            REG_REC_FULLNESS_HI: state.rec_fullness >> 32,
+            REG_REC_POS_LO: state.rec_base + state.rec_fullness,
+            REG_REC_POS_HI: (state.rec_base + state.rec_fullness) >> 32,
+            REG_PLAY_BASE_ADDR_LO: state.play_base,
+            REG_PLAY_BASE_ADDR_HI: state.play_base >> 32,
+            REG_PLAY_BUFFER_SIZE_LO: state.play_size,
+            REG_PLAY_BUFFER_SIZE_HI: state.play_size >> 32,
+            REG_PLAY_POS_LO: play_pos,
+            REG_PLAY_POS_HI: play_pos >> 32,
+            REG_PLAY_WORDS_PER_PKT: state.words_per_pkt,
+            REG_PLAY_ITEM_SIZE: state.item_size,
+            # Commands are executed right away, so the FIFO is always empty
+            REG_PLAY_CMD_FIFO_SPACE: REPLAY_CMD_FIFO_SIZE,
+        }.get(reg)
+        if value is None:
+            return super().read_ctrl(addr)
+        return value & 0xFFFFFFFF
+
+    def write_ctrl(self, addr, value):
+        port, reg = divmod(addr, REPLAY_PORT_OFFSET)
+        state = self._get_port(port, addr)
+        if state is None:
+            return
+        with self.lock:
+            if reg == REG_REC_RESTART:
+                state.rec_fullness = 0
+            elif reg == REG_REC_BASE_ADDR_LO:
+                state.rec_base = _set_lo(state.rec_base, value)
+            elif reg == REG_REC_BASE_ADDR_HI:
+                state.rec_base = _set_hi(state.rec_base, value)
+            elif reg == REG_REC_BUFFER_SIZE_LO:
+                state.rec_size = _set_lo(state.rec_size, value)
+            elif reg == REG_REC_BUFFER_SIZE_HI:
+                state.rec_size = _set_hi(state.rec_size, value)
+            elif reg == REG_PLAY_BASE_ADDR_LO:
+                state.play_base = _set_lo(state.play_base, value)
+            elif reg == REG_PLAY_BASE_ADDR_HI:
+                state.play_base = _set_hi(state.play_base, value)
+            elif reg == REG_PLAY_BUFFER_SIZE_LO:
+                state.play_size = _set_lo(state.play_size, value)
+            elif reg == REG_PLAY_BUFFER_SIZE_HI:
+                state.play_size = _set_hi(state.play_size, value)
+            elif reg == REG_PLAY_CMD_NUM_WORDS_LO:
+                state.play_num_words = _set_lo(state.play_num_words, value)
+            elif reg == REG_PLAY_CMD_NUM_WORDS_HI:
+                state.play_num_words = _set_hi(state.play_num_words, value)
+            elif reg == REG_PLAY_CMD_TIME_LO:
+                state.play_spec.set_timestamp_lo(value)
+            elif reg == REG_PLAY_CMD_TIME_HI:
+                state.play_spec.set_timestamp_hi(value)
+            elif reg == REG_PLAY_WORDS_PER_PKT:
+                state.words_per_pkt = value
+            elif reg == REG_PLAY_ITEM_SIZE:
+                state.item_size = value
+            elif reg != REG_PLAY_CMD:
+                super().write_ctrl(addr, value)
+        if reg == REG_PLAY_CMD:
+            self.play_cmd(port, value)
+
+    def play_cmd(self, port, value):
+        """Execute a play command written to port
+
+        The simulated streams never end with an EOB, so the no-EOB flag
+        (set for STREAM_MODE_NUM_SAMPS_AND_MORE) doesn't change anything.
+        """
+        state = self.ports[port]
+        is_timed = value & PLAY_CMD_TIMED != 0
+        command = value & PLAY_CMD_MASK
+        if state.player is not None:
+            self.stop_play(port)
+            state.player = None
+        if command == PLAY_CMD_STOP:
+            return
+        if command not in (PLAY_CMD_FINITE, PLAY_CMD_CONTINUOUS):
+            raise RuntimeError("Unknown Replay PLAY_CMD: {:08X}".format(value))
+        if state.play_size == 0 or state.play_base + state.play_size > len(self.memory):
+            raise RuntimeError("Invalid play buffer: {} bytes at 0x{:X}"
+                               .format(state.play_size, state.play_base))
+        num_bytes = state.play_num_words * REPLAY_WORD_SIZE \
+            if command == PLAY_CMD_FINITE else None
+        state.player = ReplayPlaySource(self.memory, state.play_base,
+                                        state.play_size, num_bytes)
+        # The player ends a finite stream, so the stream itself is
+        # always continuous
+        stream_spec = state.play_spec
+        stream_spec.is_timed = is_timed
+        stream_spec.is_continuous = True
+        stream_spec.packet_samples = state.words_per_pkt * REPLAY_WORD_SIZE
+        stream_spec.sample_rate = PLAY_RATE
+        self.start_play(port, stream_spec, state.player)
+
+class ReplayPlaySource(SampleSource):
+    """Plays back a region of a ReplayBlock's memory, wrapping around
+    at its end. If num_bytes is given, the source is exhausted after
+    that many bytes, otherwise it plays forever.
+    """
+    def __init__(self, memory, base, size, num_bytes=None):
+        self.memory = memoryview(memory)
+        self.base = base
+        self.end = base + size
+        self.pos = base
+        self.remaining = num_bytes
+
+    def next_payload(self, payload_size):
+        if self.remaining is not None:
+            if self.remaining == 0:
+                return None
+            payload_size = min(payload_size, self.remaining)
+            self.remaining -= payload_size
+        start = self.pos
+        if start + payload_size <= self.end:
+            # This hands out the memory itself, a later recording
+            # overwrites the payload just like on the hardware
+            payload = self.memory[start:start + payload_size]
+            self.pos = start + payload_size
+        else:
+            tail = payload_size - (self.end - start)
+            payload = bytes(self.memory[start:self.end]) + \
+                bytes(self.memory[self.base:self.base + tail])
+            self.pos = self.base + tail
+        if self.pos == self.end:
+            self.pos = self.base
+        return payload
+
+    def fill_packet(self, packet, payload_size):
+        payload = self.next_payload(payload_size)
+        if payload is None:
+            return None
+        packet.set_payload_bytes(bytes(payload))
+        return packet
+
+    def close(self):
+        pass
+
+class ReplayRecordSink(SampleSink):
+    """Records the data received on a port of a ReplayBlock"""
+    def __init__(self, replay, port):
+        self.replay = replay
+        self.port = port
+
+    def accept_packet(self, packet):
+        self.replay.record(self.port, bytes(packet.get_payload_bytes()))
+
+    def close(self):
+        pass
+
 class NocBlockRegs:
     """Represents registers associated whith a group of NoCBlocks
     roughly similar to UHD's client_zero
@@ -129,9 +438,14 @@ class NocBlockRegs:
             Port is either StreamEndpointPort or NocBlockPort
         sample_width -> Sample width of radio
         samples_per_cycle -> Samples produced by a radio cycle
-        get_stream_spec -> Callback which returns the current stream spec
-        create_tx_stream -> Callback which takes a block_index and starts a tx stream
+        get_stream_spec -> Callback which takes the index of a radio block
+            in blocks and returns that radio's current stream spec
+        create_tx_stream -> Callback which takes a stream endpoint block_id
+            and the index of a radio block and starts a tx stream
         stop_tx_stream -> Callback which takes a block_index and stops a tx stream
+
+        Radio blocks (NoC ID RADIO_NOC_ID) are simulated here. Accesses
+        to other blocks are forwarded to their read_ctrl()/write_ctrl().
         """
         self.log = log.getChild("Regs")
         self.protover = protover
@@ -147,12 +461,40 @@ class NocBlockRegs:
         self.adjacency_list_reg = NocBlockRegs._parse_adjacency_list(self.adjacency_list)
         self.sample_width = sample_width
         self.samples_per_cycle = samples_per_cycle
+        # Data loopback test register, per radio block
         self.radio_reg = {}
         self.get_stream_spec = get_stream_spec
         self.create_tx_stream = create_tx_stream
         self.stop_tx_stream = stop_tx_stream
 
-    def read(self, addr):
+    def block_index_from_port(self, port):
+        """Translate a control port number into an index into blocks.
+        Returns None for client zero and the control endpoints.
+
+        See client_zero.hpp:client_zero#get_ctrl_xbar_port()
+        """
+        if port is None or port < 1 + self.num_ctrl_ep:
+            return None
+        block_index = port - 1 - self.num_ctrl_ep
+        if block_index >= self.num_blocks:
+            raise RuntimeError("No block on control port {}".format(port))
+        return block_index
+
+    def is_radio(self, block_index):
+        """Is the block at block_index a radio"""
+        return self.blocks[block_index].noc_id == RADIO_NOC_ID
+
+    def read(self, addr, port=None):
+        """Read a register. port is the control port of the request, and
+        selects a NoC block. If it is not given, or if it addresses
+        client zero, the first radio's registers are accessible from
+        RADIO_BASE_ADDR on.
+        """
+        block_index = self.block_index_from_port(port)
+        if block_index is not None:
+            if self.is_radio(block_index):
+                return self.read_radio(addr, block_index)
+            return self.blocks[block_index].read_ctrl(addr)
         # See client_zero.cpp
         if addr == PROTOVER_ADDR:
             return self.read_protover()
@@ -168,14 +510,14 @@ class NocBlockRegs:
             return self.read_port_reg(addr)
         # See radio_control_impl.cpp
         elif addr >= 0x1000 and addr < 0x10000:
-            return self.read_radio(addr)
+            return self.read_radio(addr, self.get_first_radio())
         # See client_zero.cpp
         elif addr >= 0x10000:
             return self.read_adjacency_list(addr)
         else:
             raise RuntimeError("Unsupported register addr: 0x{:08X}".format(addr))
 
-    def read_radio(self, addr):
+    def read_radio(self, addr, block_index):
         if addr == 0x1000:
             raise NotImplementedError() # TODO: This should be REG_COMPAT
         elif addr == 0x1004:
@@ -184,15 +526,13 @@ class NocBlockRegs:
             offset = addr - 0x1000
             chan = offset // 0x80
             radio_offset = offset % 0x80
-            if radio_offset == 0x40:
-                return self.radio_reg
-            elif radio_offset == 0x3C:
-                return self.radio_reg
+            if radio_offset in (0x40, 0x3C):
+                return self.radio_reg.get(block_index, 0)
             else:
                 raise NotImplementedError("Radio addr 0x{:08X} not implemented".format(addr))
 
-    def write_radio(self, addr, value):
-        """Write a value to radio registers
+    def write_radio(self, addr, value, block_index):
+        """Write a value to the registers of the radio at block_index
 
         See radio_control_impl.cpp
         """
@@ -203,32 +543,34 @@ class NocBlockRegs:
             self.log.warn("Channel {} not suported".format(chan))
             return
         reg = offset % 0x80
+        stream_spec = self.get_stream_spec(block_index)
         if reg == REG_RX_MAX_WORDS_PER_PKT:
-            self.get_stream_spec().packet_samples = value
+            stream_spec.packet_samples = value
         elif reg == REG_RX_CMD_NUM_WORDS_HI:
-            self.get_stream_spec().set_num_words_hi(value)
+            stream_spec.set_num_words_hi(value)
         elif reg == REG_RX_CMD_NUM_WORDS_LO:
-            self.get_stream_spec().set_num_words_lo(value)
+            stream_spec.set_num_words_lo(value)
         elif reg == REG_RX_CMD_TIME_HI:
-            self.get_stream_spec().set_timestamp_hi(value)
+            stream_spec.set_timestamp_hi(value)
         elif reg == REG_RX_CMD_TIME_LO:
-            self.get_stream_spec().set_timestamp_lo(value)
+            stream_spec.set_timestamp_lo(value)
         elif reg == REG_RX_CMD:
             if value & (1 << 31) != 0:
                 value = value & ~(1 << 31) # Clear the flag
-                self.get_stream_spec().is_timed = True
+                stream_spec.is_timed = True
+            radio_port = (self.get_block_id(block_index), chan)
             if value == RX_CMD_STOP:
-                sep_block_id = self.resolve_ep_towards_outputs((self.get_radio_port(), chan))
+                sep_block_id = self.resolve_ep_towards_outputs(radio_port)
                 self.stop_tx_stream(sep_block_id)
                 return
             elif value == RX_CMD_CONTINUOUS:
-                self.get_stream_spec().is_continuous = True
+                stream_spec.is_continuous = True
             elif value == RX_CMD_FINITE:
-                self.get_stream_spec().is_continuous = False
+                stream_spec.is_continuous = False
             else:
                 raise RuntimeError("Unknown Stream RX_CMD: {:08X}".format(value))
-            sep_block_id = self.resolve_ep_towards_outputs((self.get_radio_port(), chan))
-            self.create_tx_stream(sep_block_id)
+            sep_block_id = self.resolve_ep_towards_outputs(radio_port)
+            self.create_tx_stream(sep_block_id, block_index)
 
     def resolve_ep_towards_outputs(self, block_id):
         """Follow dataflow downstream through the adjacency list until
@@ -242,12 +584,18 @@ class NocBlockRegs:
                 else:
                     return self.resolve_ep_towards_outputs(dst_blk)
 
-    def get_radio_port(self):
-        """Returns the block_id of the radio block"""
-        radio_noc_id = 0x12AD1000
-        for i, block in enumerate(self.blocks):
-            if block.noc_id == radio_noc_id:
-                return i + 1 + self.num_stream_ep
+    def get_block_id(self, block_index):
+        """Returns the block_id (as used in the adjacency list) of the
+        block at block_index
+        """
+        return block_index + 1 + self.num_stream_ep
+
+    def get_first_radio(self):
+        """Returns the index of the first radio block"""
+        for i in range(self.num_blocks):
+            if self.is_radio(i):
+                return i
+        raise RuntimeError("Graph has no radio block")
 
     # This is the FPGA compat number
     def read_protover(self):
@@ -278,18 +626,26 @@ class NocBlockRegs:
             index = (offset // 4) - 1
             return self.adjacency_list_reg[index]
 
-    def write(self, addr, value):
+    def write(self, addr, value, port=None):
+        """Write a register. See read() for the meaning of port."""
+        block_index = self.block_index_from_port(port)
+        if block_index is None:
+            block_index = self.get_first_radio()
+        elif not self.is_radio(block_index):
+            self.blocks[block_index].write_ctrl(addr, value)
+            return
         if addr == 0x1040 or addr == 0x10C0:
             self.log.trace("Storing value: 0x:{:08X} to self.radio_reg for data loopback test".format(value))
-            self.radio_reg = value
+            self.radio_reg[block_index] = value
         # assuming 2 channels, out of bounds is
         # BASE + 2 * CHAN_OFFSET = 0x1000 + 2 * 0x80 = 0x1100
         elif 0x1000 <= addr < 0x1100:
-            self.write_radio(addr, value)
+            self.write_radio(addr, value, block_index)
 
     def read_port_reg(self, addr):
         port = addr // 0x40
-        if port < self.num_stream_ep:
+        # Port 0 is client zero, the stream endpoints follow
+        if port <= self.num_stream_ep:
             raise NotImplementedError()
         else:
             block = port - self.num_stream_ep - 1
@@ -10,10 +10,13 @@ This module handles and responds to Management and Ctrl Packets. It
 also instantiates the registers and acts as an interface between
 the chdr packets on the network and the registers.
 """
+import functools
 from uhd.chdr import MgmtOpCode, MgmtOpCfg, MgmtOpSelDest
-from .noc_block_regs import NocBlockRegs, NocBlock, StreamEndpointPort, NocBlockPort
+from .noc_block_regs import NocBlockRegs, NocBlock, StreamEndpointPort, NocBlockPort, \
+    ReplayBlock, ReplayRecordSink, RADIO_NOC_ID
 from .rfnoc_common import Node, NodeType, StreamSpec, to_iter, swap_src_dst, RETURN_TO_SENDER
 from .stream_endpoint_node import StreamEndpointNode
+from .chdr_stream import ChdrOutputStream, ChdrInputStream
 
 class XportNode(Node):
     """Represents an Xport node
@@ -148,37 +151,69 @@ class RFNoCGraph:
     It serves as an interface between the ChdrEndpoint and the
     individual blocks/nodes.
     """
-    def __init__(self, graph_list, log, device_id, send_wrapper, chdr_w, rfnoc_device_id):
+    def __init__(self, graph_list, log, device_id, send_wrapper, chdr_w, rfnoc_device_id,
+                 output_stream_cls=ChdrOutputStream, input_stream_cls=ChdrInputStream,
+                 replay_ports=0, replay_mem=None):
+        """output_stream_cls and input_stream_cls are the classes the
+        stream endpoints use to create streams. They differ between the
+        threaded and the asyncio engine (see async_engine.py).
+
+        If replay_ports is not 0, the last replay_ports stream endpoints
+        are connected to the ports of a Replay block whose memory is
+        replay_mem (see ReplayBlock.create_memory()).
+        """
         self.log = log.getChild("Graph")
         self.device_id = device_id
-        self.stream_spec = StreamSpec()
         self.stream_ep = []
         for node in graph_list:
             if node.__class__ is StreamEndpointNode:
                 self.stream_ep.append(node)
             node.graph_init(self.log, self.get_device_id, send_wrapper=send_wrapper,
-                            chdr_w=chdr_w, dst_to_addr=self.dst_to_addr)
+                            chdr_w=chdr_w, dst_to_addr=self.dst_to_addr,
+                            output_stream_cls=output_stream_cls,
+                            input_stream_cls=input_stream_cls)
         # These must be done sequentially so that get_device_id is initialized on all nodes
         # before from_index is called on any node
         for node in graph_list:
             node.from_index(graph_list)
         self.graph_map = {node.get_local_id(): node
                           for node in graph_list}
-        # For now, just use one radio block and hardcode it to the first stream endpoint
-        radio = NocBlock(1 << 16, 2, 2, 512, 1, 0x12AD1000, 16)
-        adj_list = [
-            (StreamEndpointPort(0, 0), NocBlockPort(0, 0)),
-            (StreamEndpointPort(0, 1), NocBlockPort(0, 1)),
-            (NocBlockPort(0, 0), StreamEndpointPort(0, 0)),
-            (NocBlockPort(0, 1), StreamEndpointPort(0, 1))
-        ]
-        self.regs = NocBlockRegs(self.log, 1 << 16, True, 1, [radio], len(self.stream_ep), 1,
-                                 rfnoc_device_id, adj_list, 8, 1, self.get_stream_spec,
-                                 self.radio_tx_cmd, self.radio_tx_stop)
-
-    def radio_tx_cmd(self, sep_block_id):
+        # One radio block per stream endpoint, each hardcoded to its
+        # stream endpoint
+        num_xports = sum(1 for node in graph_list if node.__class__ is XportNode)
+        num_radios = len(self.stream_ep) - replay_ports
+        blocks = []
+        adj_list = []
+        for i in range(num_radios):
+            blocks.append(NocBlock(1 << 16, 2, 2, 512, 1, RADIO_NOC_ID, 16))
+            adj_list += [
+                (StreamEndpointPort(i, 0), NocBlockPort(i, 0)),
+                (StreamEndpointPort(i, 1), NocBlockPort(i, 1)),
+                (NocBlockPort(i, 0), StreamEndpointPort(i, 0)),
+                (NocBlockPort(i, 1), StreamEndpointPort(i, 1))
+            ]
+        # Stream configuration of each radio, by block index
+        self.stream_specs = [StreamSpec() for _ in blocks]
+        self.replay = None
+        if replay_ports:
+            self.replay = ReplayBlock(self.log, replay_ports, replay_mem,
+                                      self.replay_tx_cmd, self.replay_tx_stop)
+            blocks.append(self.replay)
+            for port in range(replay_ports):
+                sep_inst = num_radios + port
+                adj_list += [
+                    (StreamEndpointPort(sep_inst, 0), NocBlockPort(num_radios, port)),
+                    (NocBlockPort(num_radios, port), StreamEndpointPort(sep_inst, 0))
+                ]
+                self.stream_ep[sep_inst].sink_gen = \
+                    functools.partial(ReplayRecordSink, self.replay, port)
+        self.regs = NocBlockRegs(self.log, 1 << 16, True, num_xports, blocks,
+                                 len(self.stream_ep), 1, rfnoc_device_id, adj_list, 8, 1,
+                                 self.get_stream_spec, self.radio_tx_cmd, self.radio_tx_stop)
+
+    def radio_tx_cmd(self, sep_block_id, radio_index):
         """Triggers the creation of a ChdrOutputStream in the ChdrEndpoint using
-        the current stream_spec.
+        the current stream_spec of the radio at radio_index.
 
         This method transforms the sep_block_id into an epid useable by
         the transmit code
@@ -190,10 +225,11 @@ class RFNoCGraph:
         sep_inst = sep_blk - 1
         sep_id = (NodeType.STRM_EP, sep_inst)
         stream_ep = self.graph_map[sep_id]
-        self.stream_spec.addr = self.dst_to_addr(stream_ep)
+        stream_spec = self.stream_specs[radio_index]
+        stream_spec.addr = self.dst_to_addr(stream_ep)
         self.log.info("Streaming with StreamSpec:")
-        self.log.info(str(self.stream_spec))
-        stream_ep.begin_output(self.stream_spec)
+        self.log.info(str(stream_spec))
+        stream_ep.begin_output(stream_spec)
 
     def radio_tx_stop(self, sep_block_id):
         """Triggers the destuction of a ChdrOutputStream in the ChdrEndpoint
@@ -209,6 +245,27 @@ class RFNoCGraph:
         stream_ep = self.graph_map[sep_id]
         stream_ep.end_output()
 
+    def _replay_sep(self, port):
+        """Find the stream endpoint an output port of the Replay block
+        is connected to
+        """
+        replay_id = self.regs.get_block_id(self.regs.blocks.index(self.replay))
+        sep_blk, _ = self.regs.resolve_ep_towards_outputs((replay_id, port))
+        return self.graph_map[(NodeType.STRM_EP, sep_blk - 1)]
+
+    def replay_tx_cmd(self, port, stream_spec, sample_source):
+        """Start playing back sample_source from a port of the Replay block"""
+        stream_ep = self._replay_sep(port)
+        stream_spec.addr = self.dst_to_addr(stream_ep)
+        self.log.debug("Replay port {} playing with StreamSpec: {}".format(port, stream_spec))
+        stream_ep.begin_output(stream_spec, sample_source)
+
+    def replay_tx_stop(self, port):
+        """Stop the playback of a port of the Replay block"""
+        stream_ep = self._replay_sep(port)
+        if stream_ep.output_stream is not None:
+            stream_ep.end_output()
+
     def get_device_id(self):
         return self.device_id
 
@@ -217,8 +274,14 @@ class RFNoCGraph:
         self.device_id = device_id
 
     def change_spp(self, spp):
-        """Change the Stream Samples per Packet"""
-        self.stream_spec.packet_samples = spp
+        """Change the Stream Samples per Packet of all radios"""
+        for stream_spec in self.stream_specs:
+            stream_spec.packet_samples = spp
+
+    def set_sample_rate(self, rate):
+        """Change the sample rate of all radios"""
+        for stream_spec in self.stream_specs:
+            stream_spec.sample_rate = rate
 
     def find_ep_by_id(self, epid):
         """Find a Stream Endpoint which identifies with epid"""
@@ -273,6 +336,6 @@ class RFNoCGraph:
                                          sender=sender, num_bytes=num_bytes)
         return response_packet
 
-    def get_stream_spec(self):
-        """ Get the current output stream configuration """
-        return self.stream_spec
+    def get_stream_spec(self, radio_index=0):
+        """ Get the current output stream configuration of a radio """
+        return self.stream_specs[radio_index]
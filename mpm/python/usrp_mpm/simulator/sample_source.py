@@ -8,6 +8,10 @@ This module contains the interface for providing data to a simulator
 stream and receiving data from a simulator stream.
 """
 import importlib.util
+import mmap
+import os
+from threading import Lock
+import numpy as np
 
 sources = {}
 sinks = {}
@@ -50,6 +54,19 @@ class SampleSource:
         """
         raise NotImplementedError()
 
+    # pylint: disable=unused-argument,no-self-use
+    def next_payload(self, payload_size):
+        """Optionally return the next payload_size bytes of samples as
+        a bytes-like object, without building a packet.
+        Returning None signals that this source is exhausted.
+
+        Sources implementing this let ChdrOutputStream send their data
+        behind a pre-serialized header. The returned object must not be
+        modified after it was handed out. Sources that only implement
+        fill_packet() are still supported.
+        """
+        return NotImplemented
+
     def close(self):
         """Use this to clean up any resources held by the object"""
         raise NotImplementedError()
@@ -76,6 +93,7 @@ class NullSamples(SampleSource, SampleSink):
     """
     def __init__(self, log=None):
         self.log = log
+        self.zeroes = bytes(0)
 
     def fill_packet(self, packet, payload_size):
         if self.log is not None:
@@ -84,6 +102,13 @@ class NullSamples(SampleSource, SampleSink):
         packet.set_payload_bytes(payload)
         return packet
 
+    def next_payload(self, payload_size):
+        if self.log is not None:
+            self.log.debug("Null Source called, providing {} bytes of zeroes".format(payload_size))
+        if len(self.zeroes) < payload_size:
+            self.zeroes = bytes(payload_size)
+        return memoryview(self.zeroes)[:payload_size]
+
     def accept_packet(self, packet):
         if self.log is not None:
             self.log.debug("Null Source called, accepting {} bytes of payload"
@@ -101,12 +126,18 @@ class IOSource(SampleSource):
         self.read_obj = read
 
     def fill_packet(self, packet, payload_size):
-        payload = self.read_obj.read(payload_size)
-        if len(payload) == 0:
+        payload = self.next_payload(payload_size)
+        if payload is None:
             return None
         packet.set_payload_bytes(payload)
         return packet
 
+    def next_payload(self, payload_size):
+        payload = self.read_obj.read(payload_size)
+        if len(payload) == 0:
+            return None
+        return payload
+
     def close(self):
         self.read_obj.close()
 
@@ -138,7 +169,7 @@ class FileSource(IOSource):
         read = self.open()
         super().__init__(read)
 
-    def fill_packet(self, packet, payload_size):
+    def next_payload(self, payload_size):
         payload = self.read_obj.read(payload_size)
         if len(payload) == 0:
             if self.repeat:
@@ -147,8 +178,7 @@ class FileSource(IOSource):
                 payload = self.read_obj.read(payload_size)
             else:
                 return None
-        packet.set_payload_bytes(payload)
-        return packet
+        return payload
 
 @cli_sink
 class FileSink(IOSink):
@@ -156,3 +186,451 @@ class FileSink(IOSink):
     def __init__(self, write_file):
         write = open(write_file, "wb")
         super().__init__(write)
+
+@cli_source
+class MmapFileSource(SampleSource):
+    """This class creates a SampleSource from a memory mapped file.
+
+    Payloads are slices of the mapping, so sending a packet involves
+    neither a read() nor a copy. With repeat, playback wraps around
+    at the end of the file.
+    """
+    def __init__(self, read_file, repeat=False):
+        if isinstance(repeat, bool):
+            self.repeat = repeat
+        else:
+            self.repeat = repeat == "True"
+        with open(read_file, "rb") as file:
+            self.size = os.fstat(file.fileno()).st_size
+            # mmap can't map empty files
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) \
+                if self.size > 0 else None
+        if self.map is not None and hasattr(self.map, "madvise"):
+            self.map.madvise(mmap.MADV_SEQUENTIAL)
+        self.view = memoryview(self.map) if self.map is not None else None
+        self.offset = 0
+
+    def fill_packet(self, packet, payload_size):
+        payload = self.next_payload(payload_size)
+        if payload is None:
+            return None
+        packet.set_payload_bytes(bytes(payload))
+        return packet
+
+    def next_payload(self, payload_size):
+        if self.view is None:
+            return None
+        if self.offset == self.size:
+            if not self.repeat:
+                return None
+            self.offset = 0
+        end = self.offset + payload_size
+        if end <= self.size or not self.repeat:
+            payload = self.view[self.offset:end]
+            self.offset = min(end, self.size)
+            return payload
+        # Only the payload which wraps around is copied
+        chunks = []
+        while payload_size > 0:
+            chunk = self.view[self.offset:self.offset + payload_size]
+            chunks.append(chunk)
+            payload_size -= len(chunk)
+            self.offset = (self.offset + len(chunk)) % self.size
+        return b"".join(chunks)
+
+    def close(self):
+        # Payloads may still be waiting to be sent, so the mapping is
+        # left to the garbage collector instead of being closed here
+        self.view = None
+        self.map = None
+
+@cli_sink
+class MmapFileSink(SampleSink):
+    """This class creates a SampleSink which writes into a memory
+    mapped file.
+
+    The file is grown in steps of chunk_size bytes (sparse, so
+    unwritten space takes no disk space), which is the only time
+    accepting a packet makes a system call. On close, the file is
+    truncated to the data actually received.
+    """
+    def __init__(self, write_file, chunk_size=64 * 1024 * 1024):
+        self.chunk_size = int(chunk_size)
+        self.file = open(write_file, "w+b")
+        self.file.truncate(self.chunk_size)
+        self.map = mmap.mmap(self.file.fileno(), self.chunk_size)
+        self.offset = 0
+
+    def accept_packet(self, packet):
+        self.write(bytes(packet.get_payload_bytes()))
+
+    def write(self, data):
+        """Append data to the file"""
+        end = self.offset + len(data)
+        if end > len(self.map):
+            self.map.resize(end + self.chunk_size - end % self.chunk_size)
+        self.map[self.offset:end] = data
+        self.offset = end
+
+    def close(self):
+        self.map.close()
+        self.file.truncate(self.offset)
+        self.file.close()
+
+# sc16 samples go over the wire as item32 words with I in the upper and
+# Q in the lower half-word (see convert_common.hpp in UHD)
+SC16_BYTES = 4
+SC16_FULL_SCALE = 32767
+
+def to_sc16(samples, amplitude=1.0):
+    """Quantize complex float samples to an (N, 2) int16 array of I/Q
+    pairs. Samples are expected to lie within the unit circle, and are
+    scaled by amplitude before quantization.
+    """
+    samples = np.asarray(samples, dtype=np.complex128) * (amplitude * SC16_FULL_SCALE)
+    iq = np.empty((len(samples), 2), dtype=np.int16)
+    iq[:, 0] = np.clip(np.round(samples.real), -32768, 32767)
+    iq[:, 1] = np.clip(np.round(samples.imag), -32768, 32767)
+    return iq
+
+def to_words(iq):
+    """Pack an (N, 2) int16 array of I/Q pairs into sc16 wire words"""
+    return ((iq[:, 0].astype(np.uint16).astype(np.uint32) << 16)
+            | iq[:, 1].astype(np.uint16)).astype('<u4')
+
+def from_words(words):
+    """Unpack sc16 wire words into complex samples, scaled so that
+    full scale is 1.0
+    """
+    iq = np.asarray(words, dtype='<u4').view('<i2').reshape(-1, 2)
+    # Little endian words: the lower half-word (Q) comes first
+    return (iq[:, 1] + 1j * iq[:, 0].astype(np.float64)) / SC16_FULL_SCALE
+
+class PeriodicSource(SampleSource):
+    """Base class for sources which play back a precomputed, periodic
+    sc16 waveform.
+
+    The waveform is converted to wire format once. Payloads are handed
+    out as read-only memoryview slices of that buffer, so producing a
+    packet does not allocate. The buffer holds the waveform followed by
+    enough of its own beginning that any payload can be sliced without
+    wrapping around.
+    """
+    def __init__(self, iq):
+        """iq is an (N, 2) int16 array of I/Q pairs (see to_sc16)"""
+        iq = np.asarray(iq, dtype=np.int16)
+        assert len(iq) > 0, "Waveform must contain at least one sample"
+        self._period = to_words(iq)
+        self.period_bytes = len(self._period) * SC16_BYTES
+        self._offset = 0
+        self._view = None
+        self._extend(8000) # Max MTU
+
+    def _extend(self, payload_size):
+        """Rebuild the buffer so that payload_size bytes can be sliced
+        from any offset within the first period
+        """
+        reps = 1 + -(-payload_size // self.period_bytes)
+        buffer = np.tile(self._period, reps)
+        buffer.flags.writeable = False
+        self._view = memoryview(buffer.view(np.uint8))
+
+    def next_payload(self, payload_size):
+        """Return the next payload_size bytes of the waveform as a
+        memoryview. The view stays valid for the lifetime of the source.
+        """
+        if self._offset + payload_size > len(self._view):
+            self._extend(payload_size)
+        start = self._offset
+        self._offset = (start + payload_size) % self.period_bytes
+        return self._view[start:start + payload_size]
+
+    def fill_packet(self, packet, payload_size):
+        packet.set_payload_bytes(bytes(self.next_payload(payload_size)))
+        return packet
+
+    def close(self):
+        pass
+
+@cli_source
+class ToneSource(PeriodicSource):
+    """A single complex exponential.
+
+    freq is given relative to rate; leave rate at 1 to give freq as a
+    fraction of the sample rate. The frequency is rounded so that an
+    integer number of cycles fits into period samples.
+    """
+    def __init__(self, freq, rate=1.0, amplitude=0.7, period=4096):
+        period = int(period)
+        cycles = round(float(freq) / float(rate) * period)
+        phase = 2 * np.pi * cycles * np.arange(period) / period
+        super().__init__(to_sc16(np.exp(1j * phase), float(amplitude)))
+
+@cli_source
+class MultiToneSource(PeriodicSource):
+    """A sum of complex exponentials with equal amplitude.
+
+    freqs is a comma separated list, given relative to rate (see
+    ToneSource). amplitude is the peak amplitude of the sum.
+    """
+    def __init__(self, freqs, rate=1.0, amplitude=0.7, period=4096):
+        period = int(period)
+        if isinstance(freqs, str):
+            freqs = [float(freq) for freq in freqs.split(",")]
+        cycles = np.round(np.asarray(freqs, dtype=float) / float(rate) * period)
+        phase = 2 * np.pi * np.outer(cycles, np.arange(period)) / period
+        samples = np.exp(1j * phase).sum(axis=0) / len(cycles)
+        super().__init__(to_sc16(samples, float(amplitude)))
+
+@cli_source
+class NoiseSource(PeriodicSource):
+    """Complex white Gaussian noise with the given RMS amplitude.
+
+    The noise repeats every period samples. Pass a seed to make runs
+    reproducible.
+    """
+    def __init__(self, amplitude=0.1, period=65536, seed=None):
+        rng = np.random.default_rng(None if seed is None else int(seed))
+        period = int(period)
+        samples = (rng.standard_normal(period) + 1j * rng.standard_normal(period)) \
+            / np.sqrt(2)
+        super().__init__(to_sc16(samples, float(amplitude)))
+
+@cli_source
+class ChirpSource(PeriodicSource):
+    """A linear frequency sweep from start_freq to stop_freq over period
+    samples. Frequencies are given relative to rate (see ToneSource).
+    """
+    def __init__(self, start_freq, stop_freq, rate=1.0, amplitude=0.7, period=65536):
+        period = int(period)
+        start = float(start_freq) / float(rate)
+        stop = float(stop_freq) / float(rate)
+        n = np.arange(period)
+        phase = 2 * np.pi * (start * n + (stop - start) * n * n / (2 * period))
+        super().__init__(to_sc16(np.exp(1j * phase), float(amplitude)))
+
+@cli_source
+class PrbsSource(PeriodicSource):
+    """A QPSK-like signal built from a maximum length PRBS sequence.
+
+    I carries the sequence, Q carries the same sequence delayed by half
+    a period. The waveform repeats every 2**order - 1 samples.
+    """
+    # order -> (first tap, second tap) of x^first + x^second + 1
+    TAPS = {7: (7, 6), 9: (9, 5), 11: (11, 9), 15: (15, 14), 23: (23, 18)}
+
+    def __init__(self, order=15, amplitude=0.7):
+        bits = PrbsSource.prbs(int(order))
+        i_bits = bits
+        q_bits = np.roll(bits, len(bits) // 2)
+        samples = ((1 - 2 * i_bits.astype(float)) + 1j * (1 - 2 * q_bits.astype(float))) \
+            / np.sqrt(2)
+        super().__init__(to_sc16(samples, float(amplitude)))
+
+    @staticmethod
+    def prbs(order):
+        """Generate one period of a PRBS sequence as a uint8 array.
+
+        b[k] = b[k - first] ^ b[k - second] depends only on bits at
+        least `second` positions back, so the sequence is computed in
+        blocks of that size.
+        """
+        if order not in PrbsSource.TAPS:
+            raise RuntimeError("Unsupported PRBS order {}, use one of {}"
+                               .format(order, sorted(PrbsSource.TAPS)))
+        first, second = PrbsSource.TAPS[order]
+        length = (1 << order) - 1
+        bits = np.empty(length + first, dtype=np.uint8)
+        bits[:first] = 1
+        pos = first
+        while pos < len(bits):
+            end = min(pos + second, len(bits))
+            bits[pos:end] = bits[pos - first:end - first] ^ bits[pos - second:end - second]
+            pos = end
+        return bits[first:]
+
+@cli_source
+class RampSource(PeriodicSource):
+    """An sc16 counter, useful for checking sample integrity.
+
+    I counts up from 0 and Q counts down from -1, both wrapping around
+    at the int16 limits. The waveform repeats every 65536 samples.
+    """
+    def __init__(self, step=1):
+        count = (np.arange(65536, dtype=np.int64) * int(step)).astype(np.uint16)
+        iq = np.empty((len(count), 2), dtype=np.int16)
+        iq[:, 0] = count.view(np.int16)
+        iq[:, 1] = (~count).view(np.int16)
+        super().__init__(iq)
+
+class LoopbackRing:
+    """A bounded ring buffer of sc16 words, shared by a LoopbackSink
+    and a LoopbackSource.
+
+    When the ring is full, the oldest samples are overwritten, so the
+    latency through the loopback never exceeds capacity samples.
+    Reading from an empty ring yields nothing, the source fills the
+    gap with zeros (like a radio receiving nothing).
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity, dtype='<u4')
+        # Absolute sample counters, the buffer index is pos % capacity
+        self.read_pos = 0
+        self.write_pos = 0
+        self.num_dropped = 0
+        self.lock = Lock()
+
+    def write(self, words):
+        """Append words to the ring, dropping the oldest samples if it
+        overflows
+        """
+        with self.lock:
+            if len(words) > self.capacity:
+                self.num_dropped += len(words) - self.capacity
+                self.read_pos += len(words) - self.capacity
+                self.write_pos += len(words) - self.capacity
+                words = words[-self.capacity:]
+            num = len(words)
+            start = self.write_pos % self.capacity
+            first = min(num, self.capacity - start)
+            self.buffer[start:start + first] = words[:first]
+            self.buffer[:num - first] = words[first:]
+            self.write_pos += num
+            overflow = self.write_pos - self.read_pos - self.capacity
+            if overflow > 0:
+                self.read_pos += overflow
+                self.num_dropped += overflow
+
+    def read(self, out):
+        """Move up to len(out) words from the ring into out. Returns
+        the number of words read.
+        """
+        with self.lock:
+            num = min(len(out), self.write_pos - self.read_pos)
+            start = self.read_pos % self.capacity
+            first = min(num, self.capacity - start)
+            out[:first] = self.buffer[start:start + first]
+            out[first:num] = self.buffer[:num - first]
+            self.read_pos += num
+        return num
+
+# (device, channel) -> LoopbackRing
+loopback_rings = {}
+loopback_rings_lock = Lock()
+
+def get_loopback_ring(device, channel, capacity):
+    """Return the LoopbackRing named channel of device, creating it with
+    capacity samples if it doesn't exist yet. Rings live as long as the
+    simulator, so they outlast the streams using them. Devices which
+    share a process (see farm.py) have separate rings.
+    """
+    with loopback_rings_lock:
+        key = (device, channel)
+        if key not in loopback_rings:
+            loopback_rings[key] = LoopbackRing(capacity)
+        return loopback_rings[key]
+
+@cli_sink
+class LoopbackSink(SampleSink):
+    """Feeds the samples it receives into the loopback ring named
+    channel, to be sent back by a LoopbackSource of the same channel.
+
+    device is filled in with the serial number of the simulated device
+    (see Config.get_sink_gen()), so it need not be set in the config.
+    """
+    per_device = True
+
+    def __init__(self, channel="0", capacity=262144, device=""):
+        self.ring = get_loopback_ring(device, channel, int(capacity))
+
+    def accept_packet(self, packet):
+        self.ring.write(np.frombuffer(bytes(packet.get_payload_bytes()), dtype='<u4'))
+
+    def close(self):
+        pass
+
+@cli_source
+class LoopbackSource(SampleSource):
+    """Sends the samples of the loopback ring named channel (see
+    LoopbackSink) through a simulated channel:
+
+    delay -> Delay in samples, may be fractional. Fractional delays use
+        a windowed sinc interpolator, which is most accurate for delays
+        of at least LoopbackSource.HALF_TAPS samples.
+    freq_offset -> Frequency offset, relative to rate (see ToneSource)
+    iq_gain, iq_phase -> IQ imbalance: gain (dB) and phase (degrees)
+        of Q relative to I
+    gain -> Gain in dB
+    noise -> RMS amplitude of complex white Gaussian noise added after
+        the gain, relative to full scale
+
+    The impairments are applied in that order, then the samples are
+    quantized to sc16 again. Without impairments the samples are passed
+    through unchanged. Pass a seed to make the noise reproducible.
+    device works like in LoopbackSink.
+    """
+    HALF_TAPS = 8
+    per_device = True
+
+    def __init__(self, channel="0", capacity=262144, delay=0.0, freq_offset=0.0, rate=1.0,
+                 iq_gain=0.0, iq_phase=0.0, gain=0.0, noise=0.0, seed=None, device=""):
+        self.ring = get_loopback_ring(device, channel, int(capacity))
+        delay = float(delay)
+        self.freq = float(freq_offset) / float(rate)
+        self.phase = 0.0
+        iq_gain = 10 ** (float(iq_gain) / 20)
+        iq_phase = np.deg2rad(float(iq_phase))
+        self.iq_mix = (iq_gain * np.cos(iq_phase), -iq_gain * np.sin(iq_phase)) \
+            if (iq_gain, iq_phase) != (1.0, 0.0) else None
+        self.gain = 10 ** (float(gain) / 20)
+        self.noise = float(noise)
+        self.rng = np.random.default_rng(None if seed is None else int(seed))
+        self.taps = None
+        if delay != 0.0:
+            # Everything beyond the interpolator's reach is a plain shift
+            self.shift = max(0, int(np.floor(delay)) - LoopbackSource.HALF_TAPS + 1)
+            frac = delay - self.shift
+            t = np.arange(int(np.ceil(frac)) + LoopbackSource.HALF_TAPS) - frac
+            window = np.cos(np.pi * t / (2 * LoopbackSource.HALF_TAPS)) ** 2
+            self.taps = np.where(np.abs(t) < LoopbackSource.HALF_TAPS,
+                                 np.sinc(t) * window, 0.0)
+            self.history = np.zeros(self.shift + len(self.taps) - 1, dtype=np.complex128)
+        self.passthrough = self.taps is None and self.freq == 0.0 \
+            and self.iq_mix is None and self.gain == 1.0 and self.noise == 0.0
+
+    def impair(self, samples):
+        """Apply the channel impairments to an array of complex samples"""
+        if self.taps is not None:
+            buf = np.concatenate((self.history, samples))
+            if len(self.history):
+                self.history = buf[-len(self.history):]
+            samples = np.convolve(buf[:len(buf) - self.shift], self.taps, 'valid')
+        if self.freq != 0.0:
+            phase = self.phase + 2 * np.pi * self.freq * np.arange(len(samples))
+            samples = samples * np.exp(1j * phase)
+            self.phase = (self.phase + 2 * np.pi * self.freq * len(samples)) % (2 * np.pi)
+        if self.iq_mix is not None:
+            cos_term, sin_term = self.iq_mix
+            samples = samples.real + 1j * (cos_term * samples.imag + sin_term * samples.real)
+        if self.gain != 1.0:
+            samples = samples * self.gain
+        if self.noise != 0.0:
+            samples = samples + (self.rng.standard_normal(len(samples))
+                                 + 1j * self.rng.standard_normal(len(samples))) \
+                * (self.noise / np.sqrt(2))
+        return samples
+
+    def next_payload(self, payload_size):
+        words = np.zeros(payload_size // SC16_BYTES, dtype='<u4')
+        self.ring.read(words)
+        if not self.passthrough:
+            words = to_words(to_sc16(self.impair(from_words(words))))
+        return memoryview(words.view(np.uint8))
+
+    def fill_packet(self, packet, payload_size):
+        packet.set_payload_bytes(bytes(self.next_payload(payload_size)))
+        return packet
+
+    def close(self):
+        pass
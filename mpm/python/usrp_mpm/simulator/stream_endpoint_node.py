@@ -37,9 +37,12 @@ class StreamEndpointNode(Node):
         self.chdr_w = None
         self.send_wrapper = None
         self.dst_to_addr = None
+        self.output_stream_cls = None
+        self.input_stream_cls = None
         self.source_gen = source_gen
         self.sink_gen = sink_gen
         self.downstream_capacity = None
+        self.last_output_stats = None
         self.strs_handlers = {}
         self.ep_regs = StreamEpRegs(self.get_epid, self.set_epid, self.set_dst_epid,
                                     self.ctrl_status_callback_out, self.ctrl_status_callback_in,
@@ -70,12 +73,16 @@ class StreamEndpointNode(Node):
         self.begin_input()
         return STRM_STATUS_FC_ENABLED
 
-    def graph_init(self, log, set_device_id, send_wrapper, chdr_w, dst_to_addr, **kwargs):
+    def graph_init(self, log, set_device_id, send_wrapper, chdr_w, dst_to_addr,
+                   output_stream_cls=ChdrOutputStream, input_stream_cls=ChdrInputStream,
+                   **kwargs):
         super().graph_init(log, set_device_id)
         self.ep_regs.log = log
         self.chdr_w = chdr_w
         self.send_wrapper = send_wrapper
         self.dst_to_addr = dst_to_addr
+        self.output_stream_cls = output_stream_cls
+        self.input_stream_cls = input_stream_cls
 
     def get_type(self):
         return NodeType.STRM_EP
@@ -133,12 +140,13 @@ class StreamEndpointNode(Node):
         swap_src_dst(packet, payload)
         if payload.status != CtrlStatus.OKAY:
             raise RuntimeError("Control Status not OK: {}".format(payload.status))
+        # The control port selects client zero or a NoC block
         if payload.op_code == CtrlOpCode.READ:
             payload.is_ack = True
-            payload.set_data([regs.read(payload.address)])
+            payload.set_data([regs.read(payload.address, payload.dst_port)])
         elif payload.op_code == CtrlOpCode.WRITE:
             payload.is_ack = True
-            regs.write(payload.address, payload.get_data()[0])
+            regs.write(payload.address, payload.get_data()[0], payload.dst_port)
         else:
             raise NotImplementedError("Unknown Control OpCode: {}".format(payload.op_code))
         packet.set_payload(payload)
@@ -155,8 +163,9 @@ class StreamEndpointNode(Node):
         else:
             self.output_stream.queue_packet(packet)
 
-    def _handle_strc_packet(self, packet, **kwargs):
-        self._handle_data_packet(packet, **kwargs)
+    def _handle_strc_packet(self, packet, num_bytes, sender, **kwargs):
+        assert self.input_stream is not None
+        self.input_stream.queue_strc(packet, num_bytes, sender)
 
     def send_strc(self, addr):
         """Send a Stream Command packet from the specified stream_ep
@@ -177,23 +186,31 @@ class StreamEndpointNode(Node):
         packet = ChdrPacket(self.chdr_w, header, payload)
         self.send_wrapper.send_packet(packet, addr)
 
-    def begin_output(self, stream_spec):
+    def begin_output(self, stream_spec, sample_source=None):
         """Spin up a new ChdrOutputStream thread which transmits from src_epid
-        according to stream_spec.
+        according to stream_spec. The samples come from sample_source,
+        or from a new source of this endpoint's source_gen if it isn't
+        given.
 
         This is triggered from RFNoC Graph when the radio receives a
         Stream Command
         """
+        # A finite stream which has sent all of its samples is not
+        # stopped explicitly
+        if self.output_stream is not None and self.output_stream.done:
+            self.end_output()
         # As of now, only one stream endpoint port per stream endpoint
         # is supported.
         assert self.output_stream is None, \
             "Output Stream already running on epid: {}".format(self.epid)
+        if sample_source is None:
+            sample_source = self.source_gen()
         stream_spec.dst_epid = self.dst_epid
         stream_spec.capacity_packets = self.downstream_capacity[0]
         stream_spec.capacity_bytes = self.downstream_capacity[1]
         self.downstream_capacity = None
-        self.output_stream = ChdrOutputStream(self.log, self.chdr_w, self.source_gen(),
-                                              stream_spec, self.send_wrapper)
+        self.output_stream = self.output_stream_cls(self.log, self.chdr_w, sample_source,
+                                                    stream_spec, self.send_wrapper)
 
     def end_output(self):
         """Stops src_epid's current transmission. This opens up the sep
@@ -204,8 +221,18 @@ class StreamEndpointNode(Node):
         more samples to send.
         """
         self.output_stream.finish()
+        self.last_output_stats = self.output_stream.get_rate_stats()
         self.output_stream = None
 
+    def get_output_stats(self):
+        """Return the packet rate statistics of the running output
+        stream, or of the last one if none is running. Returns None if
+        this endpoint never had an output stream.
+        """
+        if self.output_stream is not None:
+            return self.output_stream.get_rate_stats()
+        return self.last_output_stats
+
     def begin_input(self):
         """Spin up a new ChdrInputStream thread which receives all data and strc
 
@@ -219,5 +246,5 @@ class StreamEndpointNode(Node):
         # a new one on the same epid, just quietly close the old one.
         if self.input_stream is not None:
             self.input_stream.finish()
-        self.input_stream = ChdrInputStream(self.log, self.chdr_w,
-                                            self.sink_gen(), self.send_wrapper, self.epid)
+        self.input_stream = self.input_stream_cls(self.log, self.chdr_w,
+                                                  self.sink_gen(), self.send_wrapper, self.epid)
@@ -0,0 +1,88 @@
+#
+# Copyright 2024 Ettus Research, a National Instruments Brand
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Records how long the phases of MPM startup take.
+
+Startup code wraps its phases into startup_span(). The spans are always
+recorded, there are only a few of them. Once startup is done (see
+finish_startup()), spans are no longer recorded, so code which also runs
+later (e.g. when the periph manager is reset) doesn't grow the profile.
+The profile can be read with the get_startup_profile() RPC call, or logged
+with usrp_hwd --profile-startup.
+
+This module must only import from the standard library, because it is
+imported first thing in usrp_mpm/__init__.py to time the other imports.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+# All offsets are relative to this
+_START_TIME = time.monotonic()
+# List of (name, start offset, duration, nesting depth, thread name)
+_SPANS = []
+_CONTEXT = threading.local()
+# Set by finish_startup()
+_FINISHED = False
+
+@contextmanager
+def startup_span(name):
+    """
+    Record how long the code in this context takes. Spans may be nested.
+    Does nothing once startup is finished.
+    """
+    if _FINISHED:
+        yield
+        return
+    depth = getattr(_CONTEXT, 'depth', 0)
+    _CONTEXT.depth = depth + 1
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        _CONTEXT.depth = depth
+        _SPANS.append((
+            name,
+            start - _START_TIME,
+            time.monotonic() - start,
+            depth,
+            threading.current_thread().name,
+        ))
+
+def finish_startup():
+    """
+    Stop recording spans. Spans which are still open are recorded when
+    they end.
+    """
+    global _FINISHED
+    _FINISHED = True
+
+def get_startup_profile():
+    """
+    Return the recorded spans, in the order they started, as a list of
+    dictionaries. Times are in seconds since usrp_mpm was first imported.
+    """
+    return [
+        {
+            'name': name,
+            'start': start,
+            'duration': duration,
+            'depth': depth,
+            'thread': thread,
+        }
+        for name, start, duration, depth, thread in sorted(_SPANS, key=lambda x: x[1])
+    ]
+
+def format_startup_profile():
+    """
+    Return the recorded spans as a list of lines for the log
+    """
+    return [
+        "{:8.3f} s {:8.3f} s  {}{}".format(
+            span['start'], span['duration'], '  ' * span['depth'], span['name'])
+        for span in get_startup_profile()
+    ]
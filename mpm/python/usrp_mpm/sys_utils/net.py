@@ -6,6 +6,7 @@
 """
 Network utilities for MPM
 """
+import ipaddress
 import itertools
 import socket
 import pyudev
@@ -145,6 +146,19 @@ def get_iface_addrs(mac_addr):
         return list(itertools.chain.from_iterable(addresses))
 
 
+def get_local_ip_networks():
+    """
+    Return a list of the IPv4 addresses bound to local interfaces, together
+    with their subnets, as ipaddress.IPv4Interface objects.
+    """
+    with IPRoute() as ipr:
+        return [
+            ipaddress.IPv4Interface(
+                "{}/{}".format(addr.get_attr('IFA_ADDRESS'), addr['prefixlen']))
+            for addr in ipr.get_addr(family=socket.AF_INET)
+        ]
+
+
 def byte_to_mac(byte_str):
     """
     converts a bytestring into nice hex representation